@@ -0,0 +1,411 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains BSA extraction engine and BSA writer.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+import hashlib
+import logging
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path, PureWindowsPath
+from typing import Dict, Iterable, List, Tuple
+
+import lz4.frame
+from bethesda_structs.archive.bsa import BSAArchive
+
+from main import MainApp
+
+
+@dataclass
+class BSARecord:
+    """
+    File record of a BSA archive with resolved path and data location.
+    """
+
+    path: PureWindowsPath
+    offset: int
+    size: int
+    compressed: bool
+
+
+class BSAExtractor:
+    """
+    Class for multithreaded BSA extraction.
+
+    Reads the file records from the headers parsed by bethesda_structs
+    and decompresses the file blocks in a thread pool.
+    zlib and LZ4 release the GIL while decompressing so this scales
+    with the available cores.
+    """
+
+    SIZE_MASK = 0x3FFFFFFF
+    COMPRESSION_TOGGLE = 0x40000000
+
+    # Decompressed files are written in batches of this size (in bytes)
+    batch_size = 8 * 1024 * 1024
+
+    def __init__(self, bsa_path: Path, app: MainApp, max_workers: int = None):
+        self.app = app
+        self.bsa_path = bsa_path
+        self.max_workers = max_workers or os.cpu_count() or 1
+
+        self.log = logging.getLogger(self.__repr__())
+        self.log.addHandler(self.app.log_str)
+        self.log.setLevel(self.app.log.level)
+
+        self.archive = BSAArchive.parse_file(str(bsa_path))
+        self._content = memoryview(self.archive.content)
+
+    def __repr__(self):
+        return "BSAExtractor"
+
+    def get_records(self) -> List[BSARecord]:
+        """
+        Returns file records of archive with their paths and data locations.
+        """
+
+        container = self.archive.container
+        archive_flags = container.header.archive_flags
+        compressed = bool(archive_flags.files_compressed)
+
+        records: List[BSARecord] = []
+        file_index = 0
+        for directory_block in container.directory_blocks:
+            directory_path = PureWindowsPath(directory_block.name[:-1])
+
+            for file_record in directory_block.file_records:
+                records.append(
+                    BSARecord(
+                        path=directory_path / container.file_names[file_index],
+                        offset=file_record.offset,
+                        size=file_record.size & self.SIZE_MASK,
+                        compressed=compressed != bool(
+                            file_record.size & self.COMPRESSION_TOGGLE
+                        )
+                    )
+                )
+                file_index += 1
+
+        return records
+
+    def _get_records(self, files: Iterable[str] = None):
+        # Returns records of <files> or all records if None
+        records = self.get_records()
+
+        if files is not None:
+            wanted = {str(PureWindowsPath(file)).lower() for file in files}
+            records = [
+                record
+                for record in records
+                if str(record.path).lower() in wanted
+            ]
+
+        return records
+
+    def _read_record(self, record: BSARecord):
+        data = self._content[record.offset:record.offset + record.size]
+
+        # Skip embedded file name
+        header = self.archive.container.header
+        if header.version >= 104 and header.archive_flags.files_prefixed:
+            data = data[data[0] + 1:]
+
+        if not record.compressed or not record.size:
+            return bytes(data)
+
+        original_size = struct.unpack_from("<I", data)[0]
+        if header.version >= 105:
+            data = lz4.frame.decompress(data[4:])
+        else:
+            data = zlib.decompress(data[4:], bufsize=original_size)
+
+        return data
+
+    @staticmethod
+    def _write_batch(batch: List[Tuple[Path, bytes]]):
+        for path, data in batch:
+            with open(path, "wb") as file:
+                file.write(data)
+
+    def extract(self, output_path: Path, files: Iterable[str] = None):
+        """
+        Extracts archive to <output_path> and returns list of extracted files.
+
+        Params:
+            output_path: folder to extract to
+            files: optional list of file paths (relative to archive root)
+                to extract, all files are extracted if None
+        """
+
+        records = self._get_records(files)
+
+        self.log.debug(
+            f"Extracting {len(records)} file(s) with {self.max_workers} thread(s)..."
+        )
+
+        # Create folders once before writing any file
+        for folder in {record.path.parent for record in records}:
+            os.makedirs(output_path.joinpath(*folder.parts), exist_ok=True)
+
+        extracted: List[Path] = []
+        with ThreadPoolExecutor(self.max_workers) as pool, \
+             ThreadPoolExecutor(1) as writer:
+            batch: List[Tuple[Path, bytes]] = []
+            batch_size = 0
+            pending = []
+
+            for record, data in zip(records, pool.map(self._read_record, records)):
+                path = output_path.joinpath(*record.path.parts)
+                batch.append((path, data))
+                batch_size += len(data)
+                extracted.append(path)
+
+                if batch_size >= self.batch_size:
+                    pending.append(writer.submit(self._write_batch, batch))
+                    batch = []
+                    batch_size = 0
+
+            if batch:
+                pending.append(writer.submit(self._write_batch, batch))
+
+            # Raise exceptions from writer thread
+            for future in pending:
+                future.result()
+
+        self.log.debug(f"Extracted {len(extracted)} file(s).")
+
+        return extracted
+
+
+    def read(self, files: Iterable[str]) -> Dict[str, bytes]:
+        """
+        Reads <files> (relative to archive root) into memory
+        and returns their data by lowercase path.
+        """
+
+        records = self._get_records(files)
+
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            return {
+                str(record.path).lower(): data
+                for record, data in zip(records, pool.map(self._read_record, records))
+            }
+
+
+def hash_name(name: str, ext: str = ""):
+    """
+    Calculates Bethesda hash of file or folder <name>.
+
+    Params:
+        name: lowercase name without extension (folder path for folders)
+        ext: lowercase file extension including dot (empty for folders)
+    """
+
+    hash1 = 0
+    if name:
+        hash1 = (
+            ord(name[-1])
+            | ((ord(name[-2]) if len(name) > 2 else 0) << 8)
+            | (len(name) << 16)
+            | (ord(name[0]) << 24)
+        )
+
+    match ext:
+        case ".kf":
+            hash1 |= 0x80
+        case ".nif":
+            hash1 |= 0x8000
+        case ".dds":
+            hash1 |= 0x8080
+        case ".wav":
+            hash1 |= 0x80000000
+
+    hash2 = 0
+    for char in name[1:-2]:
+        hash2 = (hash2 * 0x1003F + ord(char)) & 0xFFFFFFFF
+
+    hash3 = 0
+    for char in ext:
+        hash3 = (hash3 * 0x1003F + ord(char)) & 0xFFFFFFFF
+
+    hash2 = (hash2 + hash3) & 0xFFFFFFFF
+
+    return (hash2 << 32) + hash1
+
+
+class BSAWriter:
+    """
+    Class for writing files into a BSA archive.
+
+    Writes version 105 (Skyrim Special Edition, LZ4) or
+    version 104 (Skyrim, zlib) archives with hashed folder and
+    file records. File data is streamed into the archive one file
+    at a time and the file records are filled in afterwards.
+    """
+
+    HEADER_SIZE = 36
+    DIRECTORIES_NAMED = 0x1
+    FILES_NAMED = 0x2
+    FILES_COMPRESSED = 0x4
+    MENUS = 0x4
+
+    def __init__(self, app: MainApp, version: int = 105, compressed: bool = True):
+        self.app = app
+        self.version = version
+        self.compressed = compressed
+
+        # Archive paths mapped to source files
+        self.files: Dict[PureWindowsPath, Path] = {}
+
+        self.log = logging.getLogger(self.__repr__())
+        self.log.addHandler(self.app.log_str)
+        self.log.setLevel(self.app.log.level)
+
+    def __repr__(self):
+        return "BSAWriter"
+
+    def add_file(self, archive_path: str, file: Path):
+        """
+        Adds <file> to archive at <archive_path>.
+        """
+
+        self.files[PureWindowsPath(archive_path.lower())] = file
+
+    def _get_folders(self):
+        folders: Dict[str, List[Tuple[int, str, Path]]] = {}
+        for archive_path, file in self.files.items():
+            name = archive_path.name
+            stem, ext = os.path.splitext(name)
+            folders.setdefault(str(archive_path.parent), []).append(
+                (hash_name(stem, ext), name, file)
+            )
+
+        # Records have to be sorted by their hashes
+        return sorted(
+            (
+                (hash_name(folder), folder, sorted(files))
+                for folder, files in folders.items()
+            ),
+            key=lambda folder: folder[0]
+        )
+
+    def _compress(self, data: bytes):
+        if self.version >= 105:
+            compressed = lz4.frame.compress(data)
+        else:
+            compressed = zlib.compress(data)
+
+        return struct.pack("<I", len(data)) + compressed
+
+    def write(self, bsa_path: Path):
+        """
+        Writes archive to <bsa_path>.
+        """
+
+        self.log.info(f"Writing {len(self.files)} file(s) to '{bsa_path.name}'...")
+
+        folders = self._get_folders()
+        folder_record_size = 24 if self.version >= 105 else 16
+        file_names = b"".join(
+            name.encode() + b"\0"
+            for _, _, files in folders
+            for _, name, _ in files
+        )
+
+        archive_flags = self.DIRECTORIES_NAMED | self.FILES_NAMED
+        if self.compressed:
+            archive_flags |= self.FILES_COMPRESSED
+
+        header = struct.pack(
+            "<4sIIIIIIII",
+            b"BSA\0",
+            self.version,
+            self.HEADER_SIZE,
+            archive_flags,
+            len(folders),
+            len(self.files),
+            sum(len(folder) + 1 for _, folder, _ in folders),
+            len(file_names),
+            self.MENUS
+        )
+
+        with open(bsa_path, "wb") as stream:
+            stream.write(header)
+
+            # Folder records
+            block_offset = self.HEADER_SIZE + folder_record_size * len(folders)
+            for folder_hash, folder, files in folders:
+                name_offset = block_offset + len(file_names)
+                if self.version >= 105:
+                    record = struct.pack(
+                        "<QIIQ", folder_hash, len(files), 0, name_offset
+                    )
+                else:
+                    record = struct.pack(
+                        "<QII", folder_hash, len(files), name_offset
+                    )
+                stream.write(record)
+                block_offset += len(folder) + 2 + 16 * len(files)
+
+            # Folder blocks with placeholders for file records
+            file_record_offsets: List[int] = []
+            for _, folder, files in folders:
+                name = folder.encode() + b"\0"
+                stream.write(bytes([len(name)]) + name)
+                for _ in files:
+                    file_record_offsets.append(stream.tell())
+                    stream.write(bytes(16))
+
+            stream.write(file_names)
+
+            # File data
+            file_records: List[bytes] = []
+            for _, _, files in folders:
+                for file_hash, _, file in files:
+                    data = file.read_bytes()
+                    if self.compressed:
+                        data = self._compress(data)
+
+                    file_records.append(
+                        struct.pack("<QII", file_hash, len(data), stream.tell())
+                    )
+                    stream.write(data)
+
+            # Fill in file records
+            for offset, file_record in zip(file_record_offsets, file_records):
+                stream.seek(offset)
+                stream.write(file_record)
+
+        self.log.info("Archive written.")
+
+    def verify(self, bsa_path: Path):
+        """
+        Reads archive at <bsa_path> with the BSA reader and
+        checks if it contains exactly the added files.
+        Returns True if archive is valid.
+        """
+
+        archive = BSAArchive.parse_file(str(bsa_path))
+
+        expected = {
+            str(archive_path): hashlib.sha256(file.read_bytes()).digest()
+            for archive_path, file in self.files.items()
+        }
+        actual = {
+            str(PureWindowsPath(archive_file.filepath)): hashlib.sha256(
+                archive_file.data
+            ).digest()
+            for archive_file in archive.iter_files()
+        }
+
+        if actual != expected:
+            self.log.error(f"Archive '{bsa_path.name}' does not match its source files!")
+            return False
+
+        self.log.debug(f"Verified archive '{bsa_path.name}'.")
+        return True
@@ -0,0 +1,231 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains SWFCompressor class.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import errors
+from main import MainApp
+from swf import SWFFile
+
+
+# Compression candidates (signature, level)
+Candidate = Tuple[bytes, int]
+
+
+class SWFCompressor:
+    """
+    Class for recompressing patched SWF files.
+
+    Compresses the body of an SWF file with every candidate codec and level
+    in parallel and keeps the smallest result or the result that is the
+    fastest to decompress. Candidates that are not finished within the time
+    budget are ignored. The file is kept as it is if no candidate is better.
+
+    Note: Skyrim's Scaleform only supports uncompressed (FWS) and
+    zlib compressed (CWS) files, so LZMA (ZWS) should only be used
+    for other purposes, for eg. distributing patches.
+    """
+
+    SIZE = "size"
+    SPEED = "speed"
+
+    CODECS = {
+        "none": SWFFile.UNCOMPRESSED,
+        "zlib": SWFFile.ZLIB,
+        "lzma": SWFFile.LZMA,
+    }
+
+    # Presets by name with their candidates and goal
+    PRESETS: Dict[str, Tuple[List[Candidate], str]] = {
+        "zlib": ([(SWFFile.ZLIB, 9)], SIZE),
+        "smallest": ([(SWFFile.ZLIB, level) for level in (6, 7, 8, 9)], SIZE),
+        "fastest": ([(SWFFile.ZLIB, level) for level in (1, 6, 9)], SPEED),
+    }
+
+    def __init__(
+        self,
+        app: MainApp,
+        candidates: List[Candidate],
+        goal: str = SIZE,
+        time_budget: float = 10,
+        max_workers: int = None
+    ):
+        self.app = app
+        self.candidates = candidates
+        self.goal = goal
+        self.time_budget = time_budget
+        self.max_workers = max_workers
+
+        self.log = logging.getLogger(self.__repr__())
+        self.log.addHandler(self.app.log_str)
+        self.log.setLevel(self.app.log.level)
+
+        # Results of recompressed files by file name
+        self.stats: Dict[str, dict] = {}
+
+        if SWFFile.LZMA in [signature for signature, _ in candidates]:
+            self.log.warning(
+                "LZMA compressed SWF files are not supported by Skyrim!"
+            )
+
+    def __repr__(self):
+        return "SWFCompressor"
+
+    @classmethod
+    def from_string(cls, app: MainApp, value: str, goal: str = None, time_budget: float = 10):
+        """
+        Creates compressor from preset name or comma separated
+        list of codecs with optional level (for eg. "zlib:9,lzma:6").
+        """
+
+        if value in cls.PRESETS:
+            candidates, preset_goal = cls.PRESETS[value]
+            return cls(app, candidates, goal or preset_goal, time_budget)
+
+        candidates: List[Candidate] = []
+        for option in value.split(","):
+            codec, _, level = option.strip().partition(":")
+            if codec not in cls.CODECS:
+                raise ValueError(f"Unknown compression: {codec!r}")
+            candidates.append((cls.CODECS[codec], int(level) if level else 9))
+
+        return cls(app, candidates, goal or cls.SIZE, time_budget)
+
+    @staticmethod
+    def get_codec_name(signature: bytes):
+        for name, codec in SWFCompressor.CODECS.items():
+            if codec == signature:
+                return name
+
+        raise errors.InvalidSWFFileError(f"Unknown SWF signature: {signature!r}")
+
+    @staticmethod
+    def _try(candidate: Candidate, version: int, body: bytes):
+        signature, level = candidate
+
+        start = time.perf_counter()
+        data = SWFFile.compress(signature, version, body, level)
+        compress_time = time.perf_counter() - start
+
+        # Decompress to verify result and to measure loading time
+        start = time.perf_counter()
+        if SWFFile.decompress(data) != body:
+            raise errors.InvalidSWFFileError("Recompressed SWF differs from original!")
+        decompress_time = time.perf_counter() - start
+
+        return candidate, data, compress_time, decompress_time
+
+    def recompress(self, swf_path: Path):
+        """
+        Recompresses SWF file at <swf_path> and returns path to
+        recompressed file or <swf_path> if it is kept.
+        """
+
+        start = time.perf_counter()
+
+        original = swf_path.read_bytes()
+        version = original[3]
+        decompress_start = time.perf_counter()
+        body = SWFFile.decompress(original)
+        decompress_time = time.perf_counter() - decompress_start
+
+        results = []
+        # Original file is kept if no candidate is better
+        # unless it uses a compression that was not selected
+        signatures = [signature for signature, _ in self.candidates]
+        if original[:3] != SWFFile.LZMA or SWFFile.LZMA in signatures:
+            results.append(((original[:3], None), original, 0, decompress_time))
+
+        executor = ThreadPoolExecutor(self.max_workers)
+        futures = {
+            executor.submit(self._try, candidate, version, body): candidate
+            for candidate in self.candidates
+        }
+        done, not_done = wait(futures, self.time_budget)
+
+        # Candidates that exceeded the time budget are ignored,
+        # candidates that did not start yet are cancelled
+        for future in not_done:
+            future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        if not_done:
+            self.log.debug(
+                f"{len(not_done)} candidate(s) for '{swf_path.name}' "
+                "exceeded time budget."
+            )
+
+        # A failed candidate is skipped instead of failing the whole patch
+        for future in done:
+            try:
+                results.append(future.result())
+            except Exception as ex:
+                signature, level = futures[future]
+                self.log.warning(
+                    f"Failed to compress '{swf_path.name}' with "
+                    f"{self.get_codec_name(signature)} level {level}: {ex}"
+                )
+
+        if not results:
+            raise errors.InvalidSWFFileError(
+                f"No compression finished within {self.time_budget} second(s)!"
+            )
+
+        if self.goal == self.SPEED:
+            best = min(results, key=lambda result: (result[3], len(result[1])))
+        else:
+            best = min(results, key=lambda result: (len(result[1]), result[3]))
+
+        (signature, level), data, _, decompress_time = best
+        elapsed = time.perf_counter() - start
+
+        stats = {
+            "codec": self.get_codec_name(signature),
+            "level": level,
+            "original_size": len(original),
+            "size": len(data),
+            "ratio": len(data) / len(original),
+            "time": elapsed,
+            "decompress_time": decompress_time,
+        }
+        self.stats[swf_path.name] = stats
+
+        if level is None:
+            self.log.info(
+                f"Kept compression of '{swf_path.name}' "
+                f"({stats['codec']}, {len(original)} bytes) in {elapsed:.3f} second(s)."
+            )
+            return swf_path
+
+        self.log.info(
+            f"Recompressed '{swf_path.name}' with {stats['codec']} level {level}: "
+            f"{len(original)} -> {len(data)} bytes ({stats['ratio']:.1%}) "
+            f"in {elapsed:.3f} second(s)."
+        )
+
+        output_path = swf_path.with_name(f"{swf_path.stem}.packed.swf")
+        output_path.write_bytes(data)
+        return output_path
+
+    def get_summary(self):
+        """
+        Returns summary of all recompressed files.
+        """
+
+        original_size = sum(stats["original_size"] for stats in self.stats.values())
+        size = sum(stats["size"] for stats in self.stats.values())
+        elapsed = sum(stats["time"] for stats in self.stats.values())
+        ratio = size / original_size if original_size else 1
+
+        return (
+            f"{original_size} -> {size} bytes ({ratio:.1%}) "
+            f"in {elapsed:.3f} second(s)"
+        )
@@ -0,0 +1,248 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains CorpusRunner class for regression tests across many patches.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+import json
+import logging
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+import errors
+import output
+from main import MainApp
+from patcher import Patcher
+from swf import SWFFile
+
+
+class CorpusRunner:
+    """
+    Class for applying a corpus of patches to one or more
+    RaceMenu versions and comparing the results with golden hashes.
+
+    The corpus is a folder with one patch folder per patch.
+    Golden hashes are stored in "golden.json" in the corpus folder
+    by patch and RaceMenu key (folder name and hash of RaceMenu.bsa),
+    so that different RaceMenu folders with the same name do not collide.
+    They are hashes of the uncompressed SWF files,
+    so that the used compression does not matter.
+    """
+
+    PASSED = "passed"
+    FAILED = "failed"
+    NEW = "new"
+    ERROR = "error"
+
+    def __init__(
+        self,
+        app: MainApp,
+        corpus_path: Path,
+        racemenu_paths: List[Path],
+        max_workers: int = None
+    ):
+        self.app = app
+        self.corpus_path = corpus_path
+        self.racemenu_paths = racemenu_paths
+        self.max_workers = max_workers
+        self.golden_file = corpus_path / "golden.json"
+
+        self.log = logging.getLogger(self.__repr__())
+        self.log.addHandler(self.app.log_str)
+        self.log.setLevel(self.app.log.level)
+
+        self.golden: Dict[str, Dict[str, dict]] = {}
+        self.results: List[dict] = []
+
+    def __repr__(self):
+        return "CorpusRunner"
+
+    def get_patches(self):
+        """
+        Returns all patch folders in corpus.
+        """
+
+        return sorted(
+            path
+            for path in self.corpus_path.iterdir()
+            if (path / "patch.json").is_file()
+        )
+
+    @staticmethod
+    def get_racemenu_key(racemenu_path: Path):
+        """
+        Returns key of RaceMenu at <racemenu_path> for golden hashes.
+        """
+
+        bsa_path = racemenu_path / "RaceMenu.bsa"
+        if not bsa_path.is_file():
+            return racemenu_path.name
+
+        return f"{racemenu_path.name}-{output.OutputWriter.hash_file(bsa_path)[:16]}"
+
+    @staticmethod
+    def hash_swf(swf_path: Path):
+        """
+        Returns hash of uncompressed SWF file at <swf_path>.
+        """
+
+        try:
+            return SWFFile.from_file(swf_path).digest()
+        except errors.InvalidSWFFileError:
+            return output.OutputWriter.hash_file(swf_path)
+
+    def _run_patch(self, patch_path: Path, racemenu_path: Path, racemenu_key: str):
+        result = {
+            "patch": patch_path.name,
+            "racemenu": racemenu_key,
+            "racemenu_path": str(racemenu_path),
+            "status": None,
+            "time": None,
+            "files": {},
+            "sources": {},
+            "stages": [],
+            "entries": {},
+            "error": None,
+        }
+
+        start = time.perf_counter()
+        try:
+            with tempfile.TemporaryDirectory(prefix="DRIP_corpus_") as tmpdir:
+                patcher = Patcher(self.app, patch_path, racemenu_path)
+                patcher.output_path = Path(tmpdir).resolve()
+                patcher.output_store = None
+                patcher.report_path = None
+                # Parallel jobs are not representative for time estimates
+                patcher.timings = None
+                patcher.patch()
+
+                result["files"] = {
+                    rel_path: self.hash_swf(patcher.output_path / rel_path)
+                    for rel_path in sorted(patcher.outputs)
+                }
+                result["sources"] = dict(sorted(patcher.source_hashes.items()))
+                result["stages"] = patcher.pipeline.get_stats()
+                result["entries"] = patcher.entry_stats
+        except Exception as ex:
+            self.log.error(f"Failed to apply '{patch_path.name}' to '{racemenu_path}': {ex!r}")
+            result["status"] = self.ERROR
+            result["error"] = repr(ex)
+        result["time"] = time.perf_counter() - start
+
+        if result["status"] is None:
+            result["status"] = self._compare(result)
+
+        return result
+
+    def _compare(self, result: dict):
+        golden = self.golden.get(result["patch"], {}).get(result["racemenu"])
+
+        if golden is None:
+            return self.NEW
+
+        if golden["files"] == result["files"]:
+            return self.PASSED
+
+        result["error"] = "Different output: " + ", ".join(
+            rel_path
+            for rel_path in sorted(set(golden["files"]) | set(result["files"]))
+            if golden["files"].get(rel_path) != result["files"].get(rel_path)
+        )
+        return self.FAILED
+
+    def run(self):
+        """
+        Applies every patch to every RaceMenu version in parallel
+        and returns results.
+        """
+
+        if self.golden_file.is_file():
+            with open(self.golden_file, "r", encoding="utf8") as file:
+                self.golden = json.load(file)
+
+        racemenu_keys = {
+            racemenu_path: self.get_racemenu_key(racemenu_path)
+            for racemenu_path in self.racemenu_paths
+        }
+        jobs = [
+            (patch_path, racemenu_path, racemenu_keys[racemenu_path])
+            for patch_path in self.get_patches()
+            for racemenu_path in self.racemenu_paths
+        ]
+        self.log.info(f"Running {len(jobs)} patch job(s)...")
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(self.max_workers, thread_name_prefix="Corpus") as executor:
+            self.results = list(executor.map(lambda job: self._run_patch(*job), jobs))
+        elapsed = time.perf_counter() - start
+
+        self.log_report(elapsed)
+        return self.results
+
+    def update_golden(self):
+        """
+        Stores outputs of all successful jobs as golden hashes.
+        """
+
+        for result in self.results:
+            if result["status"] == self.ERROR:
+                continue
+
+            self.golden.setdefault(result["patch"], {})[result["racemenu"]] = {
+                "files": result["files"],
+                "sources": result["sources"],
+            }
+
+        with open(self.golden_file, "w", encoding="utf8") as file:
+            json.dump(self.golden, file, indent=4, sort_keys=True)
+
+        self.log.info(f"Updated golden hashes in '{self.golden_file}'.")
+
+    def log_report(self, elapsed: float):
+        """
+        Logs results as table.
+        """
+
+        self.log.info("Corpus results:")
+        self.log.info(f"{'Patch':<32} {'RaceMenu':<32} {'Status':<8} {'Time (s)':>9}")
+        for result in sorted(self.results, key=lambda result: -result["time"]):
+            self.log.info(
+                f"{result['patch'][:32]:<32} {result['racemenu'][-32:]:<32} "
+                f"{result['status']:<8} {result['time']:>9.3f}"
+            )
+            if result["error"] is not None:
+                self.log.info(f"    {result['error']}")
+
+        counts = {
+            status: len([result for result in self.results if result["status"] == status])
+            for status in (self.PASSED, self.FAILED, self.NEW, self.ERROR)
+        }
+        self.log.info(
+            ", ".join(f"{count} {status}" for status, count in counts.items())
+            + f" in {elapsed:.3f} second(s)."
+        )
+
+    def write_report(self, report_file: Path):
+        """
+        Writes results to JSON file at <report_file>.
+        """
+
+        with open(report_file, "w", encoding="utf8") as file:
+            json.dump(self.results, file, indent=4)
+
+        self.log.info(f"Wrote report to '{report_file}'.")
+
+    @property
+    def passed(self):
+        """
+        Checks if no job failed.
+        """
+
+        return all(
+            result["status"] not in (self.FAILED, self.ERROR)
+            for result in self.results
+        )
@@ -0,0 +1,427 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains PatchDaemon class for running DRIP as a background service.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+import itertools
+import json
+import logging
+import os
+import queue
+import secrets
+import socketserver
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import jstyleson
+
+import bsa
+import errors
+from main import MainApp
+from patcher import Patcher
+
+
+class PatchJob:
+    """
+    Class for patch jobs submitted to the daemon.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    patcher: Patcher = None
+    started: float = None
+    finished: float = None
+    error: str = None
+    cancelled: bool = False
+
+    def __init__(self, job_id: int, patch_path: Path, racemenu_path: Path, options: dict):
+        self.id = job_id
+        self.patch_path = patch_path
+        self.racemenu_path = racemenu_path
+        self.options = options
+        self.state = self.QUEUED
+        self.submitted = time.time()
+        self.logs: List[str] = []
+
+    def __repr__(self):
+        return f"PatchJob({self.id})"
+
+    @property
+    def finished_state(self):
+        return self.state in (self.DONE, self.FAILED, self.CANCELLED)
+
+    def to_dict(self):
+        """
+        Returns job information as JSON serializable dictionary.
+        """
+
+        return {
+            "job": self.id,
+            "patch": str(self.patch_path),
+            "racemenu": str(self.racemenu_path),
+            "state": self.state,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error,
+        }
+
+
+class JobLogHandler(logging.Handler):
+    """
+    Logging handler that appends log messages to the running job.
+    """
+
+    def __init__(self, daemon: "PatchDaemon"):
+        super().__init__()
+
+        self.daemon = daemon
+
+    def emit(self, record: logging.LogRecord):
+        job = self.daemon.current_job
+        if job is None:
+            return
+
+        with self.daemon.condition:
+            job.logs.append(self.format(record))
+            self.daemon.condition.notify_all()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Handles connections to the daemon.
+    Every line sent by the client is one JSON request.
+    """
+
+    server: "DaemonServer"
+
+    def send(self, response: dict):
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+        self.wfile.flush()
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+
+            try:
+                request: dict = json.loads(line)
+                command = request["command"]
+            except (ValueError, KeyError, TypeError):
+                self.send({"status": "error", "error": "Invalid request!"})
+                continue
+
+            if not self.server.daemon.check_token(request.get("token")):
+                self.send({"status": "error", "error": "Invalid token!"})
+                continue
+
+            if command == "logs":
+                self.server.daemon.stream_logs(request, self.send)
+            else:
+                self.send(self.server.daemon.handle_request(request))
+
+
+class DaemonServer(socketserver.ThreadingTCPServer):
+    """
+    TCP server that is bound to the local machine only.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], daemon: "PatchDaemon"):
+        self.daemon = daemon
+
+        super().__init__(address, RequestHandler)
+
+
+class PatchDaemon:
+    """
+    Class for DRIP background service.
+
+    Accepts patch jobs over a local socket with a small JSON protocol
+    (one JSON object per line) and runs them one after another.
+    Every request has to contain the token that is written to
+    <token_path> when the daemon is started, so that only processes
+    of the same user can submit jobs.
+    Parsed RaceMenu BSAs and loaded patch data are kept in memory
+    and reused by subsequent jobs as long as their files are unchanged.
+
+    Supported requests:
+        {"command": "submit", "token": <token>, "patch": <path>, "racemenu": <path>,
+         "output": <optional path>, "output_bsa": <optional bool>,
+         "compression": <optional preset or codecs>,
+         "shards": <optional number of processes per SWF>}
+        {"command": "status", "token": <token>, "job": <optional job id>}
+        {"command": "cancel", "token": <token>, "job": <job id>}
+        {"command": "logs", "token": <token>, "job": <job id>, "follow": <optional bool>}
+        {"command": "shutdown", "token": <token>}
+    """
+
+    DEFAULT_PORT = 47891
+
+    current_job: PatchJob = None
+    server: DaemonServer = None
+    token: str = None
+
+    def __init__(self, app: MainApp, port: int = DEFAULT_PORT, token_path: Path = None):
+        self.app = app
+        self.port = port
+        self.token_path = token_path or (Path(".") / "daemon.token").resolve()
+
+        self.log = logging.getLogger(self.__repr__())
+        self.log.addHandler(self.app.log_str)
+        self.log.setLevel(self.app.log.level)
+
+        self.jobs: Dict[int, PatchJob] = {}
+        self.job_ids = itertools.count(1)
+        self.job_queue: "queue.Queue[PatchJob]" = queue.Queue()
+        self.condition = threading.Condition()
+
+        # Caches keyed by file path with file size and modification time
+        self.extractors: Dict[Path, Tuple[Tuple[int, int], bsa.BSAExtractor]] = {}
+        self.patch_data: Dict[Path, Tuple[Tuple[int, int], dict]] = {}
+
+        self.log_handler = JobLogHandler(self)
+        self.log_handler.setFormatter(self.app.log_fmt)
+
+    def __repr__(self):
+        return "PatchDaemon"
+
+    def _write_token(self):
+        """
+        Creates new token and writes it to a file
+        that only the current user can read.
+        """
+
+        self.token = secrets.token_hex(32)
+
+        self.token_path.unlink(missing_ok=True)
+        fd = os.open(self.token_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w", encoding="utf8") as file:
+            file.write(self.token)
+
+        self.log.info(f"Wrote token to '{self.token_path}'.")
+
+    def check_token(self, token: str):
+        """
+        Checks if <token> matches the token of this session.
+        """
+
+        if self.token is None or not isinstance(token, str):
+            return False
+
+        return secrets.compare_digest(token, self.token)
+
+    @staticmethod
+    def _get_file_key(path: Path):
+        stat = path.stat()
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def _get_extractor(self, bsa_path: Path):
+        key = self._get_file_key(bsa_path)
+        cached = self.extractors.get(bsa_path)
+        if cached is not None and cached[0] == key:
+            self.log.debug(f"Using cached '{bsa_path}'.")
+            return cached[1]
+
+        extractor = bsa.BSAExtractor(bsa_path, self.app)
+        self.extractors[bsa_path] = (key, extractor)
+        return extractor
+
+    def _get_patch_data(self, patch_path: Path):
+        patch_file = patch_path / "patch.json"
+        if not patch_file.is_file():
+            raise errors.InvalidPatchError("Found no 'patch.json'!")
+
+        key = self._get_file_key(patch_file)
+        cached = self.patch_data.get(patch_file)
+        if cached is not None and cached[0] == key:
+            self.log.debug(f"Using cached '{patch_file}'.")
+            return cached[1]
+
+        with open(patch_file, "r", encoding="utf8") as file:
+            patch_data: dict = jstyleson.load(file)
+        self.patch_data[patch_file] = (key, patch_data)
+        return patch_data
+
+    def _run_job(self, job: PatchJob):
+        bsa_path = job.racemenu_path / "RaceMenu.bsa"
+        if not bsa_path.is_file():
+            raise errors.BSANotFoundError
+
+        patcher = Patcher(
+            self.app,
+            job.patch_path,
+            job.racemenu_path,
+            output_bsa=job.options.get("output_bsa", False),
+            compress_bsa=job.options.get("compress_bsa", True),
+            patch_data=self._get_patch_data(job.patch_path),
+            compression=job.options.get("compression"),
+            shards=job.options.get("shards")
+        )
+        patcher.extractor = self._get_extractor(bsa_path)
+        if job.options.get("output"):
+            patcher.output_path = Path(job.options["output"]).resolve()
+
+        # Job may have been cancelled while the patcher was created
+        with self.condition:
+            job.patcher = patcher
+            if job.cancelled:
+                raise errors.PatchCancelledError("Patch cancelled!")
+
+        patcher.patch()
+
+    def _worker(self):
+        while True:
+            job = self.job_queue.get()
+
+            with self.condition:
+                if job.state == job.CANCELLED:
+                    continue
+
+                job.state = job.RUNNING
+                job.started = time.time()
+                self.current_job = job
+
+            try:
+                self._run_job(job)
+                state = job.DONE
+            except Exception as ex:
+                if job.cancelled:
+                    state = job.CANCELLED
+                else:
+                    self.log.error(f"Job {job.id} failed: {ex!r}", exc_info=ex)
+                    state = job.FAILED
+                    job.error = repr(ex)
+
+            with self.condition:
+                job.state = state
+                job.finished = time.time()
+                self.current_job = None
+                self.condition.notify_all()
+
+            self.log.info(
+                f"Job {job.id} {state} in {job.finished - job.started:.3f} second(s)."
+            )
+
+    def handle_request(self, request: dict):
+        """
+        Handles <request> and returns response.
+        """
+
+        match request.get("command"):
+            case "submit":
+                if not request.get("patch") or not request.get("racemenu"):
+                    return {"status": "error", "error": "Missing 'patch' or 'racemenu'!"}
+
+                job = PatchJob(
+                    next(self.job_ids),
+                    Path(request["patch"]).resolve(),
+                    Path(request["racemenu"]).resolve(),
+                    request
+                )
+                self.jobs[job.id] = job
+                self.job_queue.put(job)
+                self.log.info(f"Queued job {job.id} for patch '{job.patch_path.name}'.")
+                return {"status": "ok", "job": job.id}
+
+            case "status":
+                if request.get("job") is None:
+                    return {
+                        "status": "ok",
+                        "jobs": [job.to_dict() for job in self.jobs.values()]
+                    }
+
+                job = self.jobs.get(request["job"])
+                if job is None:
+                    return {"status": "error", "error": "Unknown job!"}
+                return {"status": "ok", **job.to_dict()}
+
+            case "cancel":
+                job = self.jobs.get(request.get("job"))
+                if job is None:
+                    return {"status": "error", "error": "Unknown job!"}
+
+                with self.condition:
+                    if job.finished_state:
+                        return {"status": "error", "error": f"Job is already {job.state}!"}
+
+                    job.cancelled = True
+                    if job.state == job.QUEUED:
+                        job.state = job.CANCELLED
+                        job.finished = time.time()
+                        self.condition.notify_all()
+                    elif job.patcher is not None:
+                        job.patcher.cancel()
+                self.log.info(f"Cancelled job {job.id}.")
+                return {"status": "ok", **job.to_dict()}
+
+            case "shutdown":
+                self.log.info("Shutting down...")
+                threading.Thread(target=self.server.shutdown).start()
+                return {"status": "ok"}
+
+        return {"status": "error", "error": "Unknown command!"}
+
+    def stream_logs(self, request: dict, send):
+        """
+        Sends log lines of job to client via <send>.
+        Waits for new lines until job is finished if "follow" is set.
+        """
+
+        job = self.jobs.get(request.get("job"))
+        if job is None:
+            send({"status": "error", "error": "Unknown job!"})
+            return
+
+        follow = request.get("follow", False)
+        sent = 0
+        while True:
+            with self.condition:
+                if follow:
+                    self.condition.wait_for(
+                        lambda: len(job.logs) > sent or job.finished_state
+                    )
+                lines = job.logs[sent:]
+                finished = job.finished_state
+
+            for line in lines:
+                send({"log": line})
+            sent += len(lines)
+
+            if not follow or (finished and sent == len(job.logs)):
+                break
+
+        send({"status": "ok", **job.to_dict()})
+
+    def serve(self):
+        """
+        Starts daemon and blocks until it is shut down.
+        """
+
+        logging.getLogger().addHandler(self.log_handler)
+
+        threading.Thread(target=self._worker, name="DaemonWorker", daemon=True).start()
+
+        self.server = DaemonServer(("127.0.0.1", self.port), self)
+        self._write_token()
+        self.log.info(f"Listening on 127.0.0.1:{self.port}...")
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.server_close()
+            self.token_path.unlink(missing_ok=True)
+            logging.getLogger().removeHandler(self.log_handler)
+
+        self.log.info("Daemon stopped.")
@@ -0,0 +1,179 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains SWFDelta class for precompiled patches.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+import hashlib
+import json
+import struct
+import zlib
+from difflib import SequenceMatcher
+from pathlib import Path
+from typing import List
+
+import errors
+from swf import SWFFile
+
+
+class SWFDelta:
+    """
+    Class for tag-level differences between an original
+    and a patched SWF file.
+
+    A delta consists of a list of operations that either copy
+    a range of tags from the original SWF or insert new tags.
+    It can only be applied to the exact SWF file it was created from.
+    """
+
+    MAGIC = b"DRIPDLT"
+    FORMAT_VERSION = 1
+
+    source_hash: str = None
+    target_hash: str = None
+    patch_hash: str = None
+    signature: bytes = None
+    version: int = None
+    header: bytes = None
+    trailer: bytes = None
+
+    # Operations are either ("copy", start, count) or ("insert", start, count)
+    # where insert refers to self.tags
+    ops: List[tuple] = None
+    tags: List[bytes] = None
+
+    def __repr__(self):
+        return "SWFDelta"
+
+    @staticmethod
+    def get_file_name(swf_name: str, source_hash: str):
+        """
+        Returns file name of delta for SWF <swf_name> with hash <source_hash>.
+        """
+
+        return f"{swf_name}.{source_hash[:16]}.delta"
+
+    @classmethod
+    def create(cls, source_data: bytes, target: SWFFile, patch_hash: str):
+        """
+        Creates delta that turns SWF file <source_data> into <target>.
+        """
+
+        source = SWFFile.from_bytes(source_data)
+
+        delta = cls()
+        delta.source_hash = hashlib.sha256(source_data).hexdigest()
+        delta.target_hash = target.digest()
+        delta.patch_hash = patch_hash
+        delta.signature = target.signature
+        delta.version = target.version
+        delta.header = target.header
+        delta.trailer = target.trailer
+        delta.ops = []
+        delta.tags = []
+
+        matcher = SequenceMatcher(None, source.tags, target.tags, autojunk=False)
+        for opcode, i1, i2, j1, j2 in matcher.get_opcodes():
+            if opcode == "equal":
+                delta.ops.append(("copy", i1, i2 - i1))
+            elif j2 > j1:
+                delta.ops.append(("insert", len(delta.tags), j2 - j1))
+                delta.tags += target.tags[j1:j2]
+
+        return delta
+
+    def apply(self, source_data: bytes):
+        """
+        Applies delta to SWF file <source_data> and returns patched SWF file.
+
+        Raises InvalidPatchError if delta does not match <source_data>
+        or if the result fails the integrity check.
+        """
+
+        if hashlib.sha256(source_data).hexdigest() != self.source_hash:
+            raise errors.InvalidPatchError("Delta does not match source SWF!")
+
+        source = SWFFile.from_bytes(source_data)
+
+        tags: List[bytes] = []
+        for operation, start, count in self.ops:
+            if operation == "copy":
+                tags += source.tags[start:start + count]
+            else:
+                tags += self.tags[start:start + count]
+
+        target = SWFFile(self.signature, self.version, self.header, tags, self.trailer)
+
+        if target.digest() != self.target_hash:
+            raise errors.InvalidPatchError("Patched SWF failed integrity check!")
+
+        return target
+
+    def dump(self, path: Path):
+        """
+        Writes delta to <path>.
+        """
+
+        info = {
+            "source": self.source_hash,
+            "target": self.target_hash,
+            "patch": self.patch_hash,
+            "signature": self.signature.decode(),
+            "version": self.version,
+            "header": self.header.hex(),
+            "trailer": self.trailer.hex(),
+            "ops": self.ops,
+            "tags": [len(tag) for tag in self.tags],
+        }
+        info_data = json.dumps(info, separators=(",", ":")).encode()
+        payload = struct.pack("<I", len(info_data)) + info_data + b"".join(self.tags)
+
+        with open(path, "wb") as file:
+            file.write(self.MAGIC)
+            file.write(bytes([self.FORMAT_VERSION]))
+            file.write(struct.pack("<I", zlib.crc32(payload)))
+            file.write(zlib.compress(payload, 9))
+
+    @classmethod
+    def load(cls, path: Path):
+        """
+        Loads delta from <path>.
+        """
+
+        data = path.read_bytes()
+        header_size = len(cls.MAGIC) + 5
+
+        if data[:len(cls.MAGIC)] != cls.MAGIC or len(data) < header_size:
+            raise errors.InvalidPatchError(f"'{path.name}' is not a delta file!")
+        if data[len(cls.MAGIC)] != cls.FORMAT_VERSION:
+            raise errors.InvalidPatchError(f"'{path.name}' has an unsupported format!")
+
+        try:
+            crc = struct.unpack_from("<I", data, len(cls.MAGIC) + 1)[0]
+            payload = zlib.decompress(data[header_size:])
+            if zlib.crc32(payload) != crc:
+                raise errors.InvalidPatchError(f"'{path.name}' is corrupted!")
+
+            info_size = struct.unpack_from("<I", payload)[0]
+            info = json.loads(payload[4:4 + info_size])
+
+            delta = cls()
+            delta.source_hash = info["source"]
+            delta.target_hash = info["target"]
+            delta.patch_hash = info["patch"]
+            delta.signature = info["signature"].encode()
+            delta.version = info["version"]
+            delta.header = bytes.fromhex(info["header"])
+            delta.trailer = bytes.fromhex(info["trailer"])
+            delta.ops = [tuple(operation) for operation in info["ops"]]
+            delta.tags = []
+
+            offset = 4 + info_size
+            for size in info["tags"]:
+                delta.tags.append(payload[offset:offset + size])
+                offset += size
+        except (zlib.error, struct.error, ValueError, TypeError, KeyError, AttributeError) as ex:
+            raise errors.InvalidPatchError(f"'{path.name}' is corrupted!") from ex
+
+        return delta
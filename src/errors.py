@@ -30,7 +30,31 @@ class BSANotFoundError(Exception):
     """
 
 
+class BSAWriteError(Exception):
+    """
+    For output BSA archives that fail verification.
+    """
+
+
 class FFDecError(Exception):
     """
     For failed FFDec execution.
     """
+
+
+class OutputWriteError(Exception):
+    """
+    For patched files that cannot be written to the output.
+    """
+
+
+class PatchCancelledError(Exception):
+    """
+    For cancelled patch runs.
+    """
+
+
+class RunNotFoundError(Exception):
+    """
+    For stored runs that are missing or corrupted.
+    """
@@ -6,9 +6,10 @@ Python Version: 3.11.2
 Qt Version: 6.5.1
 """
 
+import argparse
 import logging
+import multiprocessing
 import os
-import shutil
 import sys
 import time
 from pathlib import Path
@@ -31,6 +32,8 @@ class MainApp(qtw.QApplication):
     version = "1.3"
 
     patcher_thread: utils.Thread = None
+    watcher_thread: utils.Thread = None
+    java_installed: bool = None
     done_signal = qtc.Signal()
     start_time: int = None
     enable_patch_btn = qtc.Signal()
@@ -116,18 +119,87 @@ class MainApp(qtw.QApplication):
 
         self.conf_layout.addWidget(patch_path_button, 1, 2)
 
+        output_layout = qtw.QHBoxLayout()
+        self.conf_layout.addLayout(output_layout, 2, 0, 1, 3)
+
+        self.output_bsa_checkbox = qtw.QCheckBox("Pack output into BSA archive")
+        self.output_bsa_checkbox.setToolTip(
+            "Writes the patched files into a BSA archive named after the patch \
+instead of loose files.\nThe archive requires a plugin with the same name to be loaded by the game."
+        )
+        output_layout.addWidget(self.output_bsa_checkbox)
+
+        self.compress_bsa_checkbox = qtw.QCheckBox("Compress BSA archive")
+        self.compress_bsa_checkbox.setChecked(True)
+        self.compress_bsa_checkbox.setDisabled(True)
+        self.output_bsa_checkbox.stateChanged.connect(
+            lambda state: self.compress_bsa_checkbox.setEnabled(
+                self.output_bsa_checkbox.isChecked()
+            )
+        )
+        output_layout.addWidget(self.compress_bsa_checkbox)
+
+        compression_label = qtw.QLabel("SWF compression:")
+        output_layout.addWidget(compression_label)
+        self.compression_box = qtw.QComboBox()
+        self.compression_box.addItem("Keep", None)
+        self.compression_box.addItem("zlib", "zlib")
+        self.compression_box.addItem("Smallest", "smallest")
+        self.compression_box.addItem("Fastest loading", "fastest")
+        self.compression_box.setToolTip(
+            "Recompresses the patched SWF files after patching.\n\
+Smallest: Tries several zlib levels and keeps the smallest file.\n\
+Fastest loading: Keeps the file that is the fastest to decompress."
+        )
+        output_layout.addWidget(self.compression_box)
+        output_layout.addStretch()
+
         self.protocol_widget = qtw.QTextEdit()
         self.protocol_widget.setReadOnly(True)
         self.protocol_widget.setObjectName("protocol")
         self.layout.addWidget(self.protocol_widget, 1)
 
+        progress_layout = qtw.QHBoxLayout()
+        self.layout.addLayout(progress_layout)
+
+        self.progress_bar = qtw.QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setToolTip(
+            "Estimated from previous runs on this computer."
+        )
+        progress_layout.addWidget(self.progress_bar, 1)
+
+        self.progress_label = qtw.QLabel()
+        progress_layout.addWidget(self.progress_label)
+
+        self.progress_bar.hide()
+        self.progress_label.hide()
+
+        self.progress_timer = qtc.QTimer(self.root)
+        self.progress_timer.setInterval(500)
+        self.progress_timer.timeout.connect(self.update_progress)
+
+        button_layout = qtw.QHBoxLayout()
+        self.layout.addLayout(button_layout)
+
         self.patch_button = qtw.QPushButton("Patch!")
         self.patch_button.setDisabled(True)
         self.patch_button.clicked.connect(self.run_patcher)
         self.enable_patch_btn.connect(
             lambda: self.patch_button.setDisabled(False)
         )
-        self.layout.addWidget(self.patch_button)
+        button_layout.addWidget(self.patch_button, 1)
+
+        self.watch_button = qtw.QPushButton("Watch")
+        self.watch_button.setToolTip(
+            "Re-applies the patch automatically whenever patch.json or a shape file changes."
+        )
+        self.watch_button.setDisabled(True)
+        self.watch_button.clicked.connect(self.run_watcher)
+        self.enable_patch_btn.connect(
+            lambda: self.watch_button.setDisabled(False)
+        )
+        button_layout.addWidget(self.watch_button)
 
         docs_label = qtw.QLabel(
             "\
@@ -225,10 +297,13 @@ here</a>.\
             self.patcher = patcher.Patcher(
                 self,
                 Path(self.patch_path_entry.text()).resolve(),
-                Path(self.racemenu_path_entry.text()).resolve()
+                Path(self.racemenu_path_entry.text()).resolve(),
+                output_bsa=self.output_bsa_checkbox.isChecked(),
+                compress_bsa=self.compress_bsa_checkbox.isChecked(),
+                compression=self.compression_box.currentData()
             )
             self.patcher_thread = utils.Thread(
-                self.patcher.patch,
+                self._patch,
                 "PatcherThread",
                 self
             )
@@ -236,40 +311,128 @@ here</a>.\
             self.log.error(f"Selected patch is invalid: {ex}")
             return
 
+        # Java is only required if patch is not precompiled
+        if not self.java_installed and not self.patcher.is_precompiled():
+            self.check_java()
+
         self.patch_button.setText("Cancel")
         self.patch_button.clicked.disconnect(self.run_patcher)
         self.patch_button.clicked.connect(self.cancel_patcher)
+        self.watch_button.setDisabled(True)
 
         self.start_time = time.time()
 
+        self.progress_bar.setValue(0)
+        self.progress_bar.setFormat("%p%")
+        self.progress_label.setText("")
+        self.progress_bar.show()
+        self.progress_label.show()
+        self.progress_timer.start()
+
         self.patcher_thread.start()
 
+    def _patch(self):
+        try:
+            self.patcher.patch()
+        except errors.PatchCancelledError:
+            self.log.warning("Patch incomplete!")
+            self.done_signal.emit()
+
+    def update_progress(self):
+        import timings
+
+        progress = self.patcher.progress
+        if progress is None:
+            return
+
+        progress.check_running()
+
+        self.progress_bar.setValue(round(progress.get_fraction() * 100))
+        remaining = progress.get_remaining()
+        if remaining is None:
+            self.progress_bar.setFormat("%p% - estimating remaining time...")
+        else:
+            self.progress_bar.setFormat(
+                f"%p% - about {timings.format_duration(remaining)} remaining"
+            )
+
+        self.progress_label.setText(
+            "  ".join(
+                f"{stage} {done}/{total}"
+                for stage, (done, total) in progress.get_stage_progress().items()
+            )
+        )
+
     def done(self):
+        self.progress_timer.stop()
+        self.progress_bar.hide()
+        self.progress_label.hide()
+
         self.patch_button.setText("Patch!")
         self.patch_button.clicked.disconnect(self.cancel_patcher)
         self.patch_button.clicked.connect(self.run_patcher)
+        self.watch_button.setDisabled(False)
 
         self.log.info(f"Patching done in {(time.time() - self.start_time):.3f} second(s).")
 
     def cancel_patcher(self):
-        self.patcher_thread.terminate()
+        # Let the pipeline stop after the current step
+        # so that its threads are not killed while writing files
+        self.patcher.cancel()
+        self.patcher_thread.wait()
 
-        if self.patcher.ffdec_interface is not None:
-            if self.patcher.ffdec_interface._pid is not None:
-                utils.kill_child_process(self.patcher.ffdec_interface._pid)
-                self.log.info(f"Killed FFDec with pid {self.patcher.ffdec_interface._pid}.")
-                self.patcher.ffdec_interface._pid = None
+        if self.patcher.workspace is not None:
+            self.patcher.workspace.cleanup()
+            self.log.info("Cleaned up temporary folder.")
 
-        if self.patcher.tmpdir is not None:
-            if self.patcher.tmpdir.is_dir():
-                shutil.rmtree(self.patcher.tmpdir)
-                self.log.info("Cleaned up temporary folder.")
+    def run_watcher(self):
+        import watcher
 
-        self.done()
-        self.log.warning("Patch incomplete!")
+        try:
+            self.patcher = patcher.Patcher(
+                self,
+                Path(self.patch_path_entry.text()).resolve(),
+                Path(self.racemenu_path_entry.text()).resolve()
+            )
+        except errors.InvalidPatchError as ex:
+            self.log.error(f"Selected patch is invalid: {ex}")
+            return
+
+        if not self.java_installed:
+            self.check_java()
+
+        self.watcher = watcher.PatchWatcher(self, self.patcher)
+        self.watcher_thread = utils.Thread(
+            self.watcher.watch,
+            "WatcherThread",
+            self
+        )
+
+        self.watch_button.setText("Stop watching")
+        self.watch_button.clicked.disconnect(self.run_watcher)
+        self.watch_button.clicked.connect(self.stop_watcher)
+        self.patch_button.setDisabled(True)
+
+        self.watcher_thread.start()
+
+    def stop_watcher(self):
+        self.watcher.stop()
+        self.watcher_thread.wait()
+
+        self.watch_button.setText("Watch")
+        self.watch_button.clicked.disconnect(self.stop_watcher)
+        self.watch_button.clicked.connect(self.run_watcher)
+        self.patch_button.setDisabled(False)
 
     def start_func(self):
-        self.check_java()
+        self.log.info("Checking for java installation...")
+        self.java_installed = utils.check_java()
+        if self.java_installed:
+            self.log.info("Java found.")
+        else:
+            self.log.warning(
+                "Java could not be found! Only precompiled patches can be applied!"
+            )
 
         self.log.debug(f"Current path: {Path('.').resolve()}")
         self.log.info("Scanning for RaceMenu...")
@@ -313,8 +476,176 @@ here</a>.\
         return ""
 
 
+class HeadlessApp(qtc.QCoreApplication):
+    """
+    Application class for commandline usage without GUI.
+    """
+
+    name = MainApp.name
+    version = MainApp.version
+
+    done_signal = qtc.Signal()
+
+    def __init__(self):
+        super().__init__()
+
+        self.log = logging.getLogger(self.__repr__())
+        log_fmt = "[%(asctime)s.%(msecs)03d]"
+        log_fmt += "[%(levelname)s]"
+        log_fmt += "[%(name)s.%(funcName)s]: "
+        log_fmt += "%(message)s"
+        self.log_fmt = logging.Formatter(
+            log_fmt,
+            datefmt="%d.%m.%Y %H:%M:%S"
+        )
+        self.log_str = logging.StreamHandler(sys.stdout)
+        self.log_str.setFormatter(self.log_fmt)
+        self.log.addHandler(self.log_str)
+        self.log_level = 20 # Info level
+        self.log.setLevel(self.log_level)
+
+    def __repr__(self):
+        return "HeadlessApp"
+
+
 if __name__ == "__main__":
+    # Required for worker processes of shard mode in the frozen executable
+    multiprocessing.freeze_support()
+
     import patcher
 
-    app = MainApp()
-    app.exec()
+    parser = argparse.ArgumentParser(
+        prog="DRIP.exe",
+        description=f"{MainApp.name} v{MainApp.version}"
+    )
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        help="Compile patch for the RaceMenu version at --racemenu and exit."
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Re-apply patch at --patch whenever it changes until interrupted."
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Run as background service that accepts patch jobs on a local port."
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        help="Port for --daemon."
+    )
+    parser.add_argument(
+        "--list-runs",
+        action="store_true",
+        help="List patch runs in the output store and exit."
+    )
+    parser.add_argument(
+        "--restore",
+        metavar="RUN",
+        help="Restore output of a stored run (or 'vanilla' to remove it) and exit."
+    )
+    parser.add_argument("--output", help="Output folder for --restore (default: output folder of run).")
+    parser.add_argument(
+        "--corpus",
+        help="Apply every patch in this folder to every --racemenu and compare with golden hashes."
+    )
+    parser.add_argument(
+        "--update-golden",
+        action="store_true",
+        help="Store outputs of --corpus as new golden hashes."
+    )
+    parser.add_argument("--report", help="JSON report file for --corpus.")
+    parser.add_argument("--workers", type=int, help="Number of parallel patch jobs for --corpus.")
+    parser.add_argument(
+        "--shards",
+        type=int,
+        help="Patch the tags of large SWF files in this many processes (0 for all cores)."
+    )
+    parser.add_argument("--patch", help="Path to RaceMenu patch folder.")
+    parser.add_argument(
+        "--racemenu",
+        action="append",
+        help="Path to RaceMenu folder (can be used multiple times with --corpus)."
+    )
+    args = parser.parse_args()
+
+    if args.compile:
+        if not args.patch or not args.racemenu:
+            parser.error("--compile requires --patch and --racemenu!")
+
+        app = HeadlessApp()
+        patcher.Patcher(
+            app,
+            Path(args.patch).resolve(),
+            Path(args.racemenu[0]).resolve(),
+            shards=args.shards
+        ).compile()
+    elif args.watch:
+        import watcher
+
+        if not args.patch or not args.racemenu:
+            parser.error("--watch requires --patch and --racemenu!")
+
+        app = HeadlessApp()
+        watcher.PatchWatcher(
+            app,
+            patcher.Patcher(
+                app,
+                Path(args.patch).resolve(),
+                Path(args.racemenu[0]).resolve(),
+                shards=args.shards
+            )
+        ).watch()
+    elif args.corpus:
+        import corpus
+
+        if not args.racemenu:
+            parser.error("--corpus requires --racemenu!")
+
+        app = HeadlessApp()
+        runner = corpus.CorpusRunner(
+            app,
+            Path(args.corpus).resolve(),
+            [Path(path).resolve() for path in args.racemenu],
+            args.workers
+        )
+        runner.run()
+        if args.report:
+            runner.write_report(Path(args.report).resolve())
+        if args.update_golden:
+            runner.update_golden()
+        elif not runner.passed:
+            sys.exit(1)
+    elif args.list_runs:
+        import store
+
+        app = HeadlessApp()
+        for run in store.OutputStore(app).get_runs():
+            print(
+                f"{run['id']}  {time.strftime('%d.%m.%Y %H:%M:%S', time.localtime(run['timestamp']))}  "
+                f"{run['patch']}  {len(run['files'])} file(s)  "
+                f"patch {run['patch_hash'][:12]}  RaceMenu {run['racemenu_hash'][:12]}"
+            )
+    elif args.restore:
+        import store
+
+        app = HeadlessApp()
+        output_store = store.OutputStore(app)
+        output_path = Path(args.output).resolve() if args.output else None
+        if args.restore == "vanilla":
+            output_store.restore_vanilla(output_path)
+        else:
+            output_store.restore(args.restore, output_path)
+    elif args.daemon:
+        import daemon
+
+        app = HeadlessApp()
+        port = daemon.PatchDaemon.DEFAULT_PORT if args.port is None else args.port
+        daemon.PatchDaemon(app, port).serve()
+    else:
+        app = MainApp()
+        app.exec()
@@ -0,0 +1,537 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains functions for applying patch entries to the tags of an XML file.
+
+The functions only work on the top level tags passed to them,
+so that they can be applied to shards of the tags in other processes.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+import html
+import logging
+import re
+from typing import Dict, List, Tuple
+
+from stats import EntryStats, PatchStats
+from transforms import MatrixBatch, RectBatch
+from xml_backend import Element, XMLBackend, get_backend
+
+
+# Marks warnings about elements that were not found in the tags.
+# When patching shards, they are only relevant if no shard found the elements.
+MISSING = {"missing": True}
+
+
+def to_list(value):
+    """
+    Returns <value> as list of strings.
+    """
+
+    if isinstance(value, list):
+        return [str(item) for item in value]
+    return [str(value)]
+
+
+def to_pair(value):
+    """
+    Returns <value> as pair of floats for x and y.
+    """
+
+    if isinstance(value, list):
+        return (float(value[0]), float(value[1]))
+    return (float(value), float(value))
+
+
+def hex_to_rgb(value: str):
+    """
+    Converts hexadecimal color values
+    to a tuple containing the values in rgb.
+    """
+
+    value = value.lstrip('#')
+    lv = len(value)
+    return tuple(int(value[i:i + lv // 3], 16) for i in range(0, lv, lv // 3))
+
+
+def get_sprite_items(xml: XMLBackend, xml_tags: Element, sprite_id, sprite_index: dict):
+    """
+    Returns sprites with <sprite_id> or all sprites for "*".
+    """
+
+    if sprite_id == "*":
+        return xml.findall(xml_tags, "sprites")
+
+    return [
+        item
+        for item in sprite_index.get(str(sprite_id), [])
+        if item.get("type") == "DefineSpriteTag"
+    ]
+
+
+def get_sub_tags(xml: XMLBackend, sprite_item: Element, char_ids: List[str], depths: List[str]):
+    """
+    Returns sub tags of <sprite_item> matching <char_ids> and <depths>.
+    """
+
+    sub_tags: List[Element] = []
+    if "*" in char_ids and "*" in depths:
+        sub_tags = xml.findall(sprite_item, "sub_tags")
+    elif "*" not in char_ids and "*" in depths:
+        for char_id in char_ids:
+            sub_tags += xml.findall(sprite_item, "sub_tags_by_char", char_id=char_id)
+    elif "*" in char_ids and "*" not in depths:
+        for depth in depths:
+            sub_tags += xml.findall(sprite_item, "sub_tags_by_depth", depth=depth)
+    else:
+        for char_id in char_ids:
+            for depth in depths:
+                sub_tags += xml.findall(
+                    sprite_item, "sub_tags_by_char_depth", char_id=char_id, depth=depth
+                )
+
+    return sub_tags
+
+
+def patch_shape_bounds(
+    xml: XMLBackend,
+    shape_index: dict,
+    shape: dict,
+    entry: EntryStats,
+    log: logging.Logger
+):
+    """
+    Applies shape bounds of <shape> entry.
+    """
+
+    for index in shape["index"]:
+        id = index
+        shape_items = shape_index.get(str(id))
+        if not shape_items:
+            log.warning(
+                f"Failed to patch shape with id '{id}': Shape not found in XML!",
+                extra=MISSING
+            )
+            continue
+        bonds_item = xml.find(shape_items[0], "shape_bounds")
+        if bonds_item is None:
+            log.warning(
+                f"Failed to patch shape with id '{id}': Shape has no shape bounds!"
+            )
+            continue
+        entry.matched += 1
+        for key, value in shape["shapeBounds"].items():
+            bonds_item.attrib[key] = str(value).lower()
+        entry.written += len(shape["shapeBounds"])
+
+
+def patch_sprite(
+    xml: XMLBackend,
+    sprite_item: Element,
+    sprite_data: dict,
+    entry: EntryStats,
+    log: logging.Logger
+):
+    """
+    Applies <sprite_data> entry to sub tags of <sprite_item>.
+    """
+
+    sprite_id = sprite_data["SpriteID"]
+    char_ids: List[str] = sprite_data["CharacterID"]
+    depths: List[str] = sprite_data["Depth"]
+
+    log.info(f"Patching sprite with id '{sprite_id}', character ids {', '.join(char_ids)} for depths {', '.join(depths)}...")
+
+    sub_tags = get_sub_tags(xml, sprite_item, char_ids, depths)
+    entry.matched += len(sub_tags)
+
+    # Patch matrix
+    if sprite_data.get("MATRIX"):
+        matrix_items: List[Element] = []
+
+        for sub_tag in sub_tags:
+            matrix_items += xml.findall(sub_tag, "matrix")
+
+        if not matrix_items:
+            log.warning(
+                f"Failed to patch sprite: No matrix found!"
+            )
+        else:
+            for matrix_item in matrix_items:
+                for key, value in sprite_data["MATRIX"].items():
+                    matrix_item.attrib[key] = str(value).lower()
+            entry.written += len(matrix_items) * len(sprite_data["MATRIX"])
+
+    # Patch color transforms
+    if sprite_data.get("colorTransform"):
+        transform_items: List[Element] = []
+
+        for sub_tag in sub_tags:
+            transform_items += xml.findall(sub_tag, "color_transform")
+
+        if not transform_items:
+            log.debug(f"Creating color transform items...")
+
+            # Every sub tag needs its own element
+            # since an element can only have one parent with lxml
+            for sub_tag in sub_tags:
+                transform_item = xml.create_element(
+                    "colorTransform",
+                    {
+                        "type": "CXFORMWITHALPHA",
+                        "alphaAddTerm": "0",
+                        "alphaMultTerm": "0",
+                        "blueAddTerm": "0",
+                        "blueMultTerm": "0",
+                        "greenAddTerm": "0",
+                        "greenMultTerm": "0",
+                        "hasAddTerms": "false",
+                        "hasMultTerms": "false",
+                        "nbits": "10",
+                        "redAddTerm": "0",
+                        "redMultTerm": "0"
+                    }
+                )
+                sub_tag.append(transform_item)
+                sub_tag.attrib["placeFlagHasColorTransform"] = "true"
+                transform_items.append(transform_item)
+            entry.created += len(sub_tags)
+
+        for transform_item in transform_items:
+            for key, value in sprite_data["colorTransform"].items():
+                transform_item.attrib[key] = str(value).lower()
+        entry.written += len(transform_items) * len(sprite_data["colorTransform"])
+
+
+def patch_text(
+    xml: XMLBackend,
+    xml_tags: Element,
+    text_index: dict,
+    text: dict,
+    entry: EntryStats,
+    log: logging.Logger
+):
+    """
+    Applies <text> entry to its text fields.
+    """
+
+    char_ids = text["index"]
+    log.info(f"Patching text with character ids {', '.join(map(str, char_ids))}...")
+    font_id = text.get("font", None)
+    outlines = text.get("useOutlines", None)
+    hex_color = text.get("color", None)
+    rgb_color = hex_to_rgb(hex_color) if hex_color is not None else None
+
+    text_items = []
+    if "*" in char_ids:
+        text_items = xml.findall(xml_tags, "texts")
+        if not text_items:
+            log.warning(
+                f"Failed to patch texts: Found no text items in XML!",
+                extra=MISSING
+            )
+    else:
+        for char_id in char_ids:
+            text_items += [
+                item
+                for item in text_index.get(str(char_id), [])
+                if item.get("type") == "DefineEditTextTag"
+            ]
+            if not text_items:
+                log.warning(
+                    f"Failed to patch text with character id '{char_id}': Text not found in XML!",
+                    extra=MISSING
+                )
+                continue
+
+    entry.matched += len(text_items)
+    for text_item in text_items:
+        # Patch font id
+        if font_id is not None:
+            text_item.attrib["fontId"] = str(font_id)
+            entry.written += 1
+
+        # Patch outlines
+        if outlines is not None:
+            text_item.attrib["useOutlines"] = str(outlines).lower()
+            entry.written += 1
+
+        # Patch color
+        if hex_color is not None:
+            # Patch initial text
+            init_text = text_item.attrib["initialText"]
+            init_text_dec = html.unescape(init_text)
+            init_text_dec = re.sub('color="(.*?)"', f'color="#{hex_color[0:6]}"', init_text_dec)
+            # init_text_enc = html.escape(init_text_dec)
+            init_text_enc = init_text_dec
+            text_item.attrib["initialText"] = init_text_enc
+
+            # Patch textColor tag
+            text_color = xml.find(text_item, "text_color")
+            text_color.attrib["red"] = str(rgb_color[0])
+            text_color.attrib["green"] = str(rgb_color[1])
+            text_color.attrib["blue"] = str(rgb_color[2])
+            text_color.attrib["alpha"] = str(rgb_color[3])
+            entry.written += 5
+
+
+def resolve_transforms(
+    transforms: List[dict],
+    display_rect_item: Element,
+    original_rect: Dict[str, str],
+    log: logging.Logger
+):
+    """
+    Scales the display rect and resolves anchors of <transforms> in order.
+    Returns transforms that only depend on the tags.
+    """
+
+    resolved: List[dict] = []
+    for c, transform in enumerate(transforms):
+        if "scaleDisplayRect" in transform:
+            log.info("Scaling display rect...")
+            rects = RectBatch([display_rect_item])
+            rects.scale(to_pair(transform["scaleDisplayRect"]))
+            rects.write()
+            resolved.append(transform)
+            continue
+
+        translate = list(to_pair(transform.get("translate", 0)))
+
+        # Follow screen edges when display rect was changed
+        anchor: dict = transform.get("anchor", {})
+        for axis, (low, high) in enumerate((("Xmin", "Xmax"), ("Ymin", "Ymax"))):
+            side = anchor.get("xy"[axis], None)
+            if side is None:
+                continue
+
+            old = (float(original_rect.get(low, 0)), float(original_rect.get(high, 0)))
+            new = (float(display_rect_item.get(low, 0)), float(display_rect_item.get(high, 0)))
+            match side:
+                case "left" | "top":
+                    translate[axis] += new[0] - old[0]
+                case "right" | "bottom":
+                    translate[axis] += new[1] - old[1]
+                case "center":
+                    translate[axis] += (sum(new) - sum(old)) / 2
+                case _:
+                    log.warning(f"Unknown anchor '{side}' in transform {c+1}!")
+
+        resolved.append(dict(transform, translate=translate))
+
+    return resolved
+
+
+def patch_transforms(
+    xml: XMLBackend,
+    xml_tags: Element,
+    transforms: List[dict],
+    original_rect: Dict[str, str],
+    shape_index: dict,
+    sprite_index: dict,
+    stats: PatchStats,
+    log: logging.Logger
+):
+    """
+    Applies <transforms> resolved by resolve_transforms() to matrices
+    and shape bounds.
+    """
+
+    entries = [stats.add("transforms", [c]) for c in range(len(transforms))]
+
+    # Collect matrices of all placements selected by any transform
+    selections: List[List[Element]] = []
+    for c, transform in enumerate(transforms):
+        matrix_items: List[Element] = []
+
+        with entries[c].measure() as entry:
+            if "scaleDisplayRect" not in transform:
+                char_ids = to_list(transform.get("CharacterID", "*"))
+                depths = to_list(transform.get("Depth", "*"))
+                sprite_items = get_sprite_items(
+                    xml, xml_tags, transform.get("SpriteID", "*"), sprite_index
+                )
+                for sprite_item in sprite_items:
+                    for sub_tag in get_sub_tags(xml, sprite_item, char_ids, depths):
+                        matrix_items += xml.findall(sub_tag, "matrix")
+
+                if not matrix_items:
+                    log.warning(
+                        f"Failed to apply transform {c+1}: No matrix found!",
+                        extra=MISSING
+                    )
+                entry.matched = len(matrix_items)
+
+        selections.append(matrix_items)
+
+    # Reading and writing all matrices at once is shared by all transforms
+    batch_entry = stats.add("transforms")
+    with batch_entry.measure():
+        batch = MatrixBatch(
+            list({id(item): item for items in selections for item in items}.values())
+        )
+        batch_entry.matched = len(batch.elements)
+
+    for c, (transform, matrix_items) in enumerate(zip(transforms, selections)):
+        with entries[c].measure() as entry:
+            # Scale shape bounds that depend on the display rect
+            if "scaleDisplayRect" in transform:
+                shape_ids = transform.get("shapes", None)
+                if shape_ids is None:
+                    shape_items = [
+                        item
+                        for items in shape_index.values()
+                        for item in items
+                    ]
+                else:
+                    shape_ids = to_list(shape_ids)
+                    shape_items = [
+                        item
+                        for shape_id, items in shape_index.items()
+                        if "*" in shape_ids or shape_id in shape_ids
+                        for item in items
+                    ]
+
+                bounds_items = []
+                for shape_item in shape_items:
+                    bounds_item = xml.find(shape_item, "shape_bounds")
+                    if bounds_item is None:
+                        continue
+                    # Without explicit shape ids only full screen shapes are scaled
+                    if shape_ids is None and any(
+                        bounds_item.get(key) != original_rect.get(key)
+                        for key in RectBatch.KEYS
+                    ):
+                        continue
+                    bounds_items.append(bounds_item)
+
+                log.info(f"Scaling {len(bounds_items)} shape bound(s)...")
+                rects = RectBatch(bounds_items)
+                rects.scale(to_pair(transform["scaleDisplayRect"]))
+                rects.write()
+                entry.matched = len(bounds_items)
+                entry.written = len(bounds_items) * len(RectBatch.KEYS)
+                continue
+
+            if not matrix_items:
+                continue
+
+            batch.transform(
+                batch.get_rows(matrix_items),
+                to_pair(transform.get("scale", 1)),
+                transform["translate"],
+                to_pair(transform.get("origin", 0))
+            )
+
+    with batch_entry.measure():
+        batch_entry.written = batch.write()
+    log.info(f"Transformed {batch_entry.written} matrices.")
+
+
+def patch_tags(
+    xml: XMLBackend,
+    xml_tags: Element,
+    patch_data: dict,
+    original_rect: Dict[str, str],
+    stats: PatchStats,
+    log: logging.Logger
+):
+    """
+    Applies shapes, sprites, transforms and texts of <patch_data>
+    to <xml_tags>. Transforms must be resolved with resolve_transforms().
+    """
+
+    # Top level tags by their ids
+    shape_index = xml.get_index(xml_tags, "shapeId")
+    sprite_index = xml.get_index(xml_tags, "spriteId")
+    text_index = xml.get_index(xml_tags, "characterID")
+
+    # Patch shape bounds
+    for c, shape in enumerate(patch_data.get("shapes", [])):
+        if not shape.get("shapeBounds"):
+            continue
+        log.info(f"Patching shape bounds of shape {c}...")
+        with stats.measure("shapes", shape.get("_sources", [c])) as entry:
+            patch_shape_bounds(xml, shape_index, shape, entry, log)
+
+    # Patch sprites
+    for c, sprite in enumerate(patch_data.get("sprites", [])):
+        with stats.measure("sprites", sprite.get("_sources", [c])) as entry:
+            sprite_items = get_sprite_items(xml, xml_tags, sprite["SpriteID"], sprite_index)
+
+            for sprite_item in sprite_items:
+                patch_sprite(xml, sprite_item, sprite, entry, log)
+
+    # Patch relative transforms
+    if transforms := patch_data.get("transforms", []):
+        patch_transforms(
+            xml, xml_tags, transforms, original_rect, shape_index, sprite_index, stats, log
+        )
+
+    # Patch texts
+    for c, text in enumerate(patch_data.get("text", [])):
+        with stats.measure("text", text.get("_sources", [c])) as entry:
+            patch_text(xml, xml_tags, text_index, text, entry, log)
+
+
+def split_shards(xml: XMLBackend, xml_tags: Element, count: int):
+    """
+    Splits top level tags into <count> shards of serialized tags.
+    """
+
+    tags = list(xml_tags)
+    size, rest = divmod(len(tags), count)
+
+    shards: List[bytes] = []
+    start = 0
+    for c in range(count):
+        end = start + size + (c < rest)
+        shards.append(b"".join(xml.to_bytes(tag) for tag in tags[start:end]))
+        start = end
+
+    return shards
+
+
+class WarningCollector(logging.Handler):
+    """
+    Class for collecting warnings of a shard.
+    """
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+
+        self.warnings: List[Tuple[str, bool]] = []
+
+    def emit(self, record: logging.LogRecord):
+        self.warnings.append((record.getMessage(), getattr(record, "missing", False)))
+
+
+def patch_shard(
+    backend: str,
+    shard: bytes,
+    patch_data: dict,
+    original_rect: Dict[str, str]
+):
+    """
+    Applies <patch_data> to serialized top level tags in <shard>.
+    Runs in a worker process and returns the patched tags,
+    the stats of all entries and all warnings.
+    """
+
+    xml = get_backend(backend)
+    xml_tags = xml.from_bytes(b"<tags>" + shard + b"</tags>")
+
+    log = logging.getLogger("Shard")
+    log.propagate = False
+    log.setLevel(logging.WARNING)
+    collector = WarningCollector()
+    log.addHandler(collector)
+
+    try:
+        stats = PatchStats("shard")
+        patch_tags(xml, xml_tags, patch_data, original_rect, stats, log)
+    finally:
+        log.removeHandler(collector)
+
+    patched = b"".join(xml.to_bytes(tag) for tag in xml_tags)
+    return patched, stats.entries, collector.warnings
@@ -0,0 +1,360 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains PatchOptimizer class.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+import logging
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from main import MainApp
+
+
+# Sprite selector: (sprite id, character ids, depths), None stands for "*"
+Selector = Tuple[str, Optional[FrozenSet[str]], Optional[FrozenSet[str]]]
+
+
+def _to_list(value):
+    if isinstance(value, list):
+        return [str(item) for item in value]
+    return [str(value)]
+
+
+def _to_set(values: List[str]):
+    if "*" in values:
+        return None
+    return frozenset(values)
+
+
+def _set_covers(outer: Optional[FrozenSet[str]], inner: Optional[FrozenSet[str]]):
+    if outer is None:
+        return True
+    return inner is not None and outer >= inner
+
+
+def _set_overlaps(a: Optional[FrozenSet[str]], b: Optional[FrozenSet[str]]):
+    if a is None or b is None:
+        return True
+    return bool(a & b)
+
+
+def covers(outer: Selector, inner: Selector):
+    """
+    Checks if every sub tag selected by <inner> is also selected by <outer>.
+    """
+
+    return (
+        (outer[0] == "*" or outer[0] == inner[0])
+        and _set_covers(outer[1], inner[1])
+        and _set_covers(outer[2], inner[2])
+    )
+
+
+def overlaps(a: Selector, b: Selector):
+    """
+    Checks if <a> and <b> may select the same sub tags.
+    """
+
+    return (
+        (a[0] == "*" or b[0] == "*" or a[0] == b[0])
+        and _set_overlaps(a[1], b[1])
+        and _set_overlaps(a[2], b[2])
+    )
+
+
+class PatchOptimizer:
+    """
+    Class for optimizing the patch data of an SWF file
+    before it is applied to the XML.
+
+    Removes writes that are overwritten by later entries,
+    merges entries with the same selector and reports
+    conflicting entries and entries without effect.
+    The optimized patch data has the same result as the original one.
+    Every optimized entry lists the indexes of the original entries
+    it was created from in "_sources".
+    """
+
+    SPRITE_GROUPS = ("MATRIX", "colorTransform")
+    TEXT_ATTRIBUTES = ("font", "useOutlines", "color")
+
+    def __init__(self, app: MainApp):
+        self.app = app
+
+        self.log = logging.getLogger(self.__repr__())
+        self.log.addHandler(self.app.log_str)
+        self.log.setLevel(self.app.log.level)
+
+        # Messages for patch authors by file name
+        self.conflicts: Dict[str, List[str]] = {}
+        self.no_effect: Dict[str, List[str]] = {}
+        # Indexes of removed entries mapped to the index of an entry
+        # overwriting them by file name and section
+        self.overwritten: Dict[str, Dict[str, Dict[int, int]]] = {}
+
+    def __repr__(self):
+        return "PatchOptimizer"
+
+    def _report_conflict(self, file: str, message: str):
+        self.conflicts.setdefault(file, []).append(message)
+        self.log.warning(f"Conflict in '{file}': {message}")
+
+    def _report_no_effect(self, file: str, entry: str):
+        self.no_effect.setdefault(file, []).append(entry)
+        self.log.warning(f"Entry {entry} in '{file}' has no effect!")
+
+    def optimize(self, file: str, patch_data: dict):
+        """
+        Returns optimized copy of <patch_data> for SWF <file>.
+        """
+
+        optimized = dict(patch_data)
+        self.overwritten[file] = {}
+
+        if patch_data.get("sprites"):
+            optimized["sprites"] = self._optimize_sprites(file, patch_data["sprites"])
+        if patch_data.get("text"):
+            optimized["text"] = self._optimize_texts(file, patch_data["text"])
+        if patch_data.get("shapes"):
+            optimized["shapes"] = self._optimize_shapes(file, patch_data["shapes"])
+
+        self.log.debug(
+            f"Optimized '{file}': "
+            + ", ".join(
+                f"{len(patch_data[section])} -> {len(optimized[section])} {section}"
+                for section in ("sprites", "text", "shapes")
+                if patch_data.get(section)
+            )
+        )
+
+        return optimized
+
+    def _optimize_sprites(self, file: str, sprites: List[dict]):
+        entries: List[Tuple[Selector, dict, List[int]]] = []
+        for sprite in sprites:
+            char_ids = _to_list(sprite["CharacterID"])
+            depths = _to_list(sprite["Depth"])
+            selector = (str(sprite["SpriteID"]), _to_set(char_ids), _to_set(depths))
+            groups = {
+                group: dict(sprite[group])
+                for group in self.SPRITE_GROUPS
+                if sprite.get(group)
+            }
+            entries.append((selector, groups, [char_ids, depths]))
+
+        # Remove writes that are overwritten by a later entry
+        # selecting at least the same sub tags
+        overwriters: Dict[int, int] = {}
+        for c, (selector, groups, _) in enumerate(entries):
+            for group, values in groups.items():
+                for key in list(values):
+                    for d in range(c + 1, len(entries)):
+                        later_selector, later_groups, _ = entries[d]
+                        if key not in later_groups.get(group, {}):
+                            continue
+
+                        later_value = later_groups[group][key]
+                        if covers(later_selector, selector):
+                            if str(later_value).lower() != str(values[key]).lower():
+                                self._report_conflict(
+                                    file,
+                                    f"sprites[{c+1}].{group}.{key} is overwritten "
+                                    f"by sprites[{d+1}] ({values[key]} -> {later_value})."
+                                )
+
+                            # Color transforms are only created for non-empty groups
+                            if group != "colorTransform" or len(values) > 1:
+                                del values[key]
+                                overwriters[c] = d
+                            break
+                        elif overlaps(later_selector, selector):
+                            if str(later_value).lower() != str(values[key]).lower():
+                                self._report_conflict(
+                                    file,
+                                    f"sprites[{c+1}] and sprites[{d+1}] may write "
+                                    f"different values to {group}.{key}."
+                                )
+
+        # Merge entries with the same selector if no entry in between
+        # may select the same sub tags
+        kept: List[Tuple[Selector, dict, List[int], List[int]]] = []
+        for c, (selector, groups, lists) in enumerate(entries):
+            groups = {group: values for group, values in groups.items() if values}
+            if not groups:
+                self._report_no_effect(file, f"sprites[{c+1}]")
+                if c in overwriters:
+                    self.overwritten[file].setdefault("sprites", {})[c] = overwriters[c]
+                continue
+
+            for previous in reversed(kept):
+                if previous[0] == selector:
+                    for group, values in groups.items():
+                        previous[1].setdefault(group, {}).update(values)
+                    previous[3].append(c)
+                    break
+                elif overlaps(previous[0], selector):
+                    kept.append((selector, groups, lists, [c]))
+                    break
+            else:
+                kept.append((selector, groups, lists, [c]))
+
+        return [
+            {
+                "SpriteID": selector[0],
+                "CharacterID": lists[0],
+                "Depth": lists[1],
+                **groups,
+                "_sources": sources,
+            }
+            for selector, groups, lists, sources in kept
+        ]
+
+    def _optimize_texts(self, file: str, texts: List[dict]):
+        wildcard_ids = {"*"}
+        explicit_ids: List[str] = []
+        for text in texts:
+            for char_id in _to_list(text["index"]):
+                if char_id != "*" and char_id not in explicit_ids:
+                    explicit_ids.append(char_id)
+
+        # Last writer for every attribute of every character id
+        # where "*" stands for all character ids without explicit entry
+        resolved: Dict[str, Dict[str, Tuple[int, object]]] = {}
+        reported = set()
+        for char_id in explicit_ids + list(wildcard_ids):
+            values: Dict[str, Tuple[int, object]] = {}
+            for c, text in enumerate(texts):
+                char_ids = _to_list(text["index"])
+                if "*" not in char_ids and char_id not in char_ids:
+                    continue
+
+                for attribute in self.TEXT_ATTRIBUTES:
+                    value = text.get(attribute, None)
+                    if value is None:
+                        continue
+
+                    if attribute in values and values[attribute][1] != value:
+                        conflict = (values[attribute][0], c, attribute)
+                        if conflict not in reported:
+                            reported.add(conflict)
+                            self._report_conflict(
+                                file,
+                                f"text[{values[attribute][0]+1}].{attribute} is overwritten "
+                                f"by text[{c+1}] ({values[attribute][1]} -> {value})."
+                            )
+                    values[attribute] = (c, value)
+            resolved[char_id] = values
+
+        live_entries = {
+            entry
+            for values in resolved.values()
+            for entry, _ in values.values()
+        }
+        for c, text in enumerate(texts):
+            if c in live_entries:
+                continue
+
+            self._report_no_effect(file, f"text[{c+1}]")
+
+            # Entries that wrote values are overwritten by the last writers of them
+            char_ids = _to_list(text["index"])
+            overwriters = {
+                values[attribute][0]
+                for char_id, values in resolved.items()
+                if "*" in char_ids or char_id in char_ids
+                for attribute in self.TEXT_ATTRIBUTES
+                if text.get(attribute) is not None and attribute in values
+            }
+            if overwriters:
+                self.overwritten[file].setdefault("text", {})[c] = max(overwriters)
+
+        optimized: List[dict] = []
+
+        # Wildcard entry first, explicit entries overwrite it afterwards
+        wildcard_values = {
+            attribute: value for attribute, (_, value) in resolved["*"].items()
+        }
+        wildcard_sources = {c for c, _ in resolved["*"].values()}
+        if wildcard_values:
+            optimized.append({
+                "index": ["*"],
+                **wildcard_values,
+                "_sources": wildcard_sources,
+            })
+
+        groups: Dict[Tuple, List[str]] = {}
+        sources: Dict[Tuple, set] = {}
+        for char_id in explicit_ids:
+            overrides = tuple(
+                (attribute, value)
+                for attribute, (_, value) in resolved[char_id].items()
+                if wildcard_values.get(attribute) != value
+            )
+            # Explicit values equal to the wildcard values are written by it
+            wildcard_sources.update(
+                c
+                for attribute, (c, value) in resolved[char_id].items()
+                if wildcard_values.get(attribute) == value
+            )
+            if overrides:
+                groups.setdefault(overrides, []).append(char_id)
+                sources.setdefault(overrides, set()).update(
+                    resolved[char_id][attribute][0] for attribute, _ in overrides
+                )
+
+        if wildcard_values:
+            optimized[0]["_sources"] = sorted(wildcard_sources)
+
+        for overrides, char_ids in groups.items():
+            optimized.append({
+                "index": char_ids,
+                **dict(overrides),
+                "_sources": sorted(sources[overrides]),
+            })
+
+        return optimized
+
+    def _optimize_shapes(self, file: str, shapes: List[dict]):
+        # Final shape bounds for every shape id
+        resolved: Dict[str, Tuple[object, Dict[str, Tuple[int, object]]]] = {}
+        for c, shape in enumerate(shapes):
+            if not shape.get("shapeBounds"):
+                continue
+
+            for index in shape["index"]:
+                bounds = resolved.setdefault(str(index), (index, {}))[1]
+                for key, value in shape["shapeBounds"].items():
+                    if key in bounds and str(bounds[key][1]).lower() != str(value).lower():
+                        self._report_conflict(
+                            file,
+                            f"shapes[{bounds[key][0]+1}].shapeBounds.{key} is overwritten "
+                            f"by shapes[{c+1}] for shape id '{index}'."
+                        )
+                    bounds[key] = (c, value)
+
+        # Entries whose shape bounds are all overwritten by later entries
+        live_entries = {c for _, bounds in resolved.values() for c, _ in bounds.values()}
+        for c, shape in enumerate(shapes):
+            if not shape.get("shapeBounds") or c in live_entries:
+                continue
+
+            self.overwritten[file].setdefault("shapes", {})[c] = max(
+                resolved[str(index)][1][key][0]
+                for index in shape["index"]
+                for key in shape["shapeBounds"]
+            )
+
+        groups: Dict[Tuple, List[object]] = {}
+        sources: Dict[Tuple, set] = {}
+        for index, bounds in resolved.values():
+            values = tuple((key, value) for key, (_, value) in bounds.items())
+            groups.setdefault(values, []).append(index)
+            sources.setdefault(values, set()).update(c for c, _ in bounds.values())
+
+        # Only shape bounds are patched in XML,
+        # shape files are replaced with the original patch data
+        return [
+            {"index": indexes, "shapeBounds": dict(values), "_sources": sorted(sources[values])}
+            for values, indexes in groups.items()
+        ]
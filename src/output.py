@@ -0,0 +1,117 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains OutputWriter class.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+from pathlib import Path
+
+import errors
+from main import MainApp
+
+
+class OutputWriter:
+    """
+    Class for writing patched files to their output location.
+
+    Files that are identical to the existing output are not touched
+    so that their modification time stays the same.
+    Changed files are written to a temporary file next to the output
+    and then renamed into place atomically.
+    """
+
+    written: int = 0
+    unchanged: int = 0
+
+    def __init__(self, app: MainApp, use_hardlinks: bool = True):
+        self.app = app
+        self.use_hardlinks = use_hardlinks
+
+        self.log = logging.getLogger(self.__repr__())
+        self.log.addHandler(self.app.log_str)
+        self.log.setLevel(self.app.log.level)
+
+    def __repr__(self):
+        return "OutputWriter"
+
+    @staticmethod
+    def hash_file(path: Path):
+        """
+        Returns SHA-256 hex digest of file at <path>.
+        """
+
+        with open(path, "rb") as file:
+            return hashlib.file_digest(file, "sha256").hexdigest()
+
+    def is_unchanged(self, src: Path, dest: Path):
+        """
+        Checks if <dest> already exists with the same content as <src>.
+        """
+
+        if not dest.is_file():
+            return False
+
+        if src.stat().st_size != dest.stat().st_size:
+            return False
+
+        return self.hash_file(src) == self.hash_file(dest)
+
+    def write(self, src: Path, dest: Path):
+        """
+        Writes <src> to <dest> if their contents differ.
+        Returns True if file was written.
+
+        Raises OutputWriteError if <src> does not exist.
+        """
+
+        if not src.is_file():
+            raise errors.OutputWriteError(
+                f"Failed to write '{dest.name}': '{src}' does not exist!"
+            )
+
+        os.makedirs(dest.parent, exist_ok=True)
+
+        if self.is_unchanged(src, dest):
+            self.log.info(f"'{dest.name}' is unchanged. Skipped writing.")
+            self.unchanged += 1
+            return False
+
+        if dest.is_file():
+            self.log.warning("Existing file gets overwritten!")
+
+        # Temp file has to be in the same folder for an atomic rename
+        tmp_path = dest.with_name(f".{dest.name}.{os.getpid()}.tmp")
+        try:
+            if tmp_path.is_file():
+                os.remove(tmp_path)
+
+            linked = False
+            if self.use_hardlinks:
+                try:
+                    os.link(src, tmp_path)
+                    linked = True
+                except OSError:
+                    pass
+
+            if not linked:
+                shutil.copyfile(src, tmp_path)
+
+            os.replace(tmp_path, dest)
+        finally:
+            if tmp_path.is_file():
+                os.remove(tmp_path)
+
+        self.written += 1
+        return True
+
+    def summary(self):
+        """
+        Returns summary of written and unchanged files.
+        """
+
+        return f"{self.written} written, {self.unchanged} unchanged"
@@ -6,23 +6,55 @@ Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
 """
 
 
-import html
+import hashlib
 import logging
 import os
-import re
-import shutil
-import tempfile as tmp
-import xml.etree.ElementTree as ET
-from pathlib import Path
-from typing import Dict, List
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from pathlib import Path, PureWindowsPath
+from typing import Dict, List, Tuple
 
 import jstyleson as json
-from bethesda_structs.archive.bsa import BSAArchive
+import psutil
 
+import bsa
 import errors
 import ffdec
+import operations
+import output
+import store
 import utils
+import xml_backend
+from compressor import SWFCompressor
+from delta import SWFDelta
 from main import MainApp
+from optimizer import PatchOptimizer
+from pipeline import Pipeline, Stage
+from stats import PatchStats
+from swf import SWFFile
+from timings import RunProgress, TimingDatabase, format_duration
+from workspace import Workspace
+
+
+class PatchItem:
+    """
+    Class for a SWF file passing through the patch stages.
+    """
+
+    swf_path: Path = None
+    xml_file: Path = None
+    patched_swf: Path = None
+    ffdec_interface: ffdec.FFDec = None
+    precompiled: bool = False
+
+    def __init__(self, name: str, patch_data: dict, number: int = 1):
+        self.name = name
+        self.patch_data = patch_data
+        self.number = number
+
+    def __repr__(self):
+        return f"PatchItem({self.name})"
 
 
 class Patcher:
@@ -33,20 +65,74 @@ class Patcher:
     patch_data: dict = None
     patch_path: Path = None
     racemenu_path: Path = None
-    ffdec_interface: ffdec.FFDec = None
+    ffdec_interfaces: List[ffdec.FFDec] = None
+    pipeline: Pipeline = None
+    optimizer: PatchOptimizer = None
     patch_dir: Path = None
     tmpdir: Path = None
-
-    def __init__(self, app: MainApp, patch_path: Path, racemenu_path: Path):
+    extract_path: Path = None
+    workspace: Workspace = None
+    output_path: Path = None
+    writer: output.OutputWriter = None
+    bsa_writer: bsa.BSAWriter = None
+    extractor: bsa.BSAExtractor = None
+    compressor: SWFCompressor = None
+    xml: xml_backend.XMLBackend = None
+    output_store: store.OutputStore = None
+    outputs: Dict[str, Path] = None
+    source_hashes: Dict[str, str] = None
+    report_path: Path = None
+    entry_stats: Dict[str, List[dict]] = None
+    shards: int = None
+    timings: TimingDatabase = None
+    progress: RunProgress = None
+    executor: ProcessPoolExecutor = None
+    # Minimum number of top level tags per shard
+    MIN_SHARD_SIZE: int = 500
+    cancelled: bool = False
+
+    def __init__(
+        self,
+        app: MainApp,
+        patch_path: Path,
+        racemenu_path: Path,
+        output_bsa: bool = False,
+        compress_bsa: bool = True,
+        patch_data: dict = None,
+        compression: str = None,
+        shards: int = None
+    ):
         self.app = app
         self.patch_path = patch_path
         self.racemenu_path = racemenu_path
+        self.output_path = Path(".").resolve().parent
+        self.output_bsa = output_bsa
+        self.compress_bsa = compress_bsa
+        self.ffdec_interfaces = []
+        self.optimizer = PatchOptimizer(self.app)
+        self.xml = xml_backend.get_backend()
+        if compression is not None:
+            self.compressor = SWFCompressor.from_string(self.app, compression)
+        self.output_store = store.OutputStore(self.app)
+        self.timings = TimingDatabase(self.app)
+        self.outputs = {}
+        self.source_hashes = {}
+        self.report_path = (Path(".") / "reports").resolve()
+        self.entry_stats = {}
+
+        # Number of processes for patching the tags of large SWFs, 0 for all cores
+        if shards is None and os.environ.get("DRIP_SHARDS"):
+            shards = int(os.environ["DRIP_SHARDS"])
+        self.shards = os.cpu_count() if shards == 0 else shards
 
         self.log = logging.getLogger(self.__repr__())
         self.log.addHandler(self.app.log_str)
         self.log.setLevel(self.app.log.level)
 
-        self.load_patch_data()
+        if patch_data is None:
+            self.load_patch_data()
+        else:
+            self.patch_data = patch_data
 
     def __repr__(self):
         return "Patcher"
@@ -67,7 +153,8 @@ class Patcher:
 
         self.log.info("Loaded patch!")
 
-    def _extract_bsa(self):
+    def _extract_bsa(self, files: List[str] = None):
+        # Extracts <files> (defaults to all files in patch data)
         bsa_path = self.racemenu_path / "RaceMenu.bsa"
         if not bsa_path.is_file():
             self.log.error("RaceMenu.bsa could not be found!")
@@ -77,221 +164,125 @@ class Patcher:
 
         output_path = self.tmpdir / bsa_path.stem
         
-        os.mkdir(output_path)
-        archive = BSAArchive.parse_file(str(bsa_path))
-        archive.extract(output_path)
+        os.makedirs(output_path, exist_ok=True)
+        # Reuse already parsed archive if available
+        if self.extractor is None:
+            self.extractor = bsa.BSAExtractor(bsa_path, self.app)
+        if files is None:
+            files = list(self.patch_data)
+        self.extractor.extract(
+            output_path,
+            [f"interface/{file}" for file in files]
+        )
 
         self.log.debug("Extracted BSA.")
         return output_path
 
-    def _patch_xml(self, xml_file: Path, patch_data: dict):
+    def _patch_xml(self, xml_file: Path, patch_data: dict, stats: PatchStats = None):
+        if stats is None:
+            stats = PatchStats(xml_file.stem)
+
         self.log.info("Reading XML file...")
 
-        xml_data = ET.parse(str(xml_file))
-        xml_root = xml_data.getroot()
+        xml = self.xml
+        xml_data = xml.parse(xml_file)
+        xml_root = xml.get_root(xml_data)
         xml_tags = xml_root[1]
 
         self.log.info("Patching XML file...")
 
+        # Original display rect for transforms anchored to screen edges
+        original_rect = dict(xml_root[0].attrib)
+
         # Patch header
         if header:= patch_data.get("header", {}):
-            display_rect = header.get("displayRect", None)
-
-            if display_rect is not None:
-                display_rect_item = xml_root[0]
-
-                for key, value in display_rect.items():
-                    display_rect_item.attrib[key] = value
-
-        # Patch shape bounds
-        for c, shape in enumerate(patch_data.get("shapes", [])):
-            if not shape.get("shapeBounds"):
-                continue
-            self.log.info(f"Patching shape bounds of shape {c}...")
-            for index in shape["index"]:
-                id = index
-                shape_item = xml_tags.find(f"./item[@shapeId='{id}']")
-                if shape_item is None:
-                    self.log.warning(
-                        f"Failed to patch shape with id '{id}': Shape not found in XML!"
-                    )
-                    continue
-                bonds_item = shape_item.find(f"./shapeBounds")
-                if bonds_item is None:
-                    self.log.warning(
-                        f"Failed to patch shape with id '{id}': Shape has no shape bounds!"
-                    )
-                    continue
-                for key, value in shape["shapeBounds"].items():
-                    bonds_item.attrib[key] = str(value).lower()
-
-        # Patch sprites
-        for c, sprite in enumerate(patch_data.get("sprites", [])):
-            sprite_id = sprite["SpriteID"]
-
-            if sprite_id == "*":
-                sprite_items = xml_tags.findall(
-                    f"./item[@type='DefineSpriteTag'][@spriteId]"
-                )
-            else:
-                sprite_items = xml_tags.findall(
-                    f"./item[@type='DefineSpriteTag'][@spriteId='{sprite_id}']"
+            with stats.measure("header") as entry:
+                display_rect = header.get("displayRect", None)
+
+                if display_rect is not None:
+                    display_rect_item = xml_root[0]
+                    entry.matched += 1
+
+                    for key, value in display_rect.items():
+                        display_rect_item.attrib[key] = value
+                    entry.written += len(display_rect)
+
+        # Transforms depend on the display rect which is not part of the tags
+        if transforms := patch_data.get("transforms", []):
+            patch_data = dict(
+                patch_data,
+                transforms=operations.resolve_transforms(
+                    transforms, xml_root[0], original_rect, self.log
                 )
+            )
 
-            for sprite_item in sprite_items:
-                self._patch_sprite(sprite_item, sprite)
-
-        # Patch texts
-        for c, text in enumerate(patch_data.get("text", [])):
-            char_ids = text["index"]
-            self.log.info(f"Patching text {c+1} of {len(patch_data['text'])}...")
-            font_id = text.get("font", None)
-            outlines = text.get("useOutlines", None)
-            hex_color = text.get("color", None)
-            rgb_color = utils.hex_to_rgb(hex_color) if hex_color is not None else None
-
-            text_items = []
-            if "*" in char_ids:
-                text_items = xml_tags.findall(
-                    f"./item[@type='DefineEditTextTag'][@characterID]"
-                )
-                if not text_items:
-                    self.log.warning(
-                        f"Failed to patch texts: Found no text items in XML!"
-                    )
-            else:
-                for char_id in char_ids:
-                    text_items += xml_tags.findall(
-                        f"./item[@type='DefineEditTextTag'][@characterID='{char_id}']"
-                    )
-                    if not text_items:
-                        self.log.warning(
-                            f"Failed to patch text with character id '{char_id}': Text not found in XML!"
-                        )
-                        continue
-
-            for text_item in text_items:
-                # Patch font id
-                if font_id is not None:
-                    text_item.attrib["fontId"] = str(font_id)
-
-                # Patch outlines
-                if outlines is not None:
-                    text_item.attrib["useOutlines"] = str(outlines).lower()
-
-                # Patch color
-                if hex_color is not None:
-                    # Patch initial text
-                    init_text = text_item.attrib["initialText"]
-                    init_text_dec = html.unescape(init_text)
-                    init_text_dec = re.sub('color="(.*?)"', f'color="#{hex_color[0:6]}"', init_text_dec)
-                    # init_text_enc = html.escape(init_text_dec)
-                    init_text_enc = init_text_dec
-                    text_item.attrib["initialText"] = init_text_enc
-
-                    # Patch textColor tag
-                    text_color = text_item.find("./textColor[@type='RGBA']")
-                    text_color.attrib["red"] = str(rgb_color[0])
-                    text_color.attrib["green"] = str(rgb_color[1])
-                    text_color.attrib["blue"] = str(rgb_color[2])
-                    text_color.attrib["alpha"] = str(rgb_color[3])
+        shards = self._get_shard_count(len(xml_tags))
+        if shards > 1:
+            self._patch_shards(xml_data, xml_tags, patch_data, original_rect, stats, shards, xml_file)
+        else:
+            operations.patch_tags(xml, xml_tags, patch_data, original_rect, stats, self.log)
 
-        self.log.info("Writing XML file...")
-        with open(xml_file, "wb") as file:
-            xml_data.write(file, encoding="utf8")
+            self.log.info("Writing XML file...")
+            xml.write(xml_data, xml_file)
 
         # Optional debug XML file
         # _debug_xml = (Path(".") / f"{xml_file.stem}.xml").resolve()
-        # with open(_debug_xml, "wb") as file:
-        #     xml_data.write(_debug_xml, encoding="utf8")
+        # xml.write(xml_data, _debug_xml)
         # self.log.debug(f"Debug written to '{_debug_xml}'.")
 
         self.log.info("Patched XML file.")
 
-    def _patch_sprite(self, sprite_item: ET.Element, sprite_data: dict):
-        sprite_id = sprite_data["SpriteID"]
-        char_ids: List[str] = sprite_data["CharacterID"]
-        depths: List[str] = sprite_data["Depth"]
-
-        self.log.info(f"Patching sprite with id '{sprite_id}', character ids {', '.join(char_ids)} for depths {', '.join(depths)}...")
-
-        # Get sub tags
-        sub_tags: List[ET.Element] = []
-        if "*" in char_ids and "*" in depths:
-            sub_tags = sprite_item.findall(
-                f"./subTags/item[@characterId][@depth]"
-            )
-        elif "*" not in char_ids and "*" in depths:
-            for char_id in char_ids:
-                sub_tags += sprite_item.findall(
-                    f"./subTags/item[@characterId='{char_id}'][@depth]"
-                )
-        elif "*" in char_ids and "*" not in depths:
-            for depth in depths:
-                sub_tags += sprite_item.findall(
-                    f"./subTags/item[@characterId][@depth='{depth}']"
-                )
-        else:
-            for char_id in char_ids:
-                for depth in depths:
-                    sub_tags += sprite_item.findall(
-                        f"./subTags/item[@characterId='{char_id}'][@depth='{depth}']"
-                    )
-
-        # Patch matrix
-        if sprite_data.get("MATRIX"):
-            matrix_items: List[ET.Element] = []
-
-            for sub_tag in sub_tags:
-                matrix_items += sub_tag.findall("./matrix")
-
-            if not matrix_items:
-                self.log.warning(
-                    f"Failed to patch sprite: No matrix found!"
-                )
-            else:
-                for matrix_item in matrix_items:
-                    for key, value in sprite_data["MATRIX"].items():
-                        matrix_item.attrib[key] = str(value).lower()
-        
-        # Patch color transforms
-        if sprite_data.get("colorTransform"):
-            transform_items: List[ET.Element] = []
-
-            for sub_tag in sub_tags:
-                transform_items += sub_tag.findall("./colorTransform")
-
-            if not transform_items:
-                self.log.debug(f"Creating color transform items...")
-
-                transform_item = ET.Element(
-                    "colorTransform",
-                    {
-                        "type": "CXFORMWITHALPHA",
-                        "alphaAddTerm": "0",
-                        "alphaMultTerm": "0",
-                        "blueAddTerm": "0",
-                        "blueMultTerm": "0",
-                        "greenAddTerm": "0",
-                        "greenMultTerm": "0",
-                        "hasAddTerms": "false",
-                        "hasMultTerms": "false",
-                        "nbits": "10",
-                        "redAddTerm": "0",
-                        "redMultTerm": "0"
-                    }
-                )
+        return stats
+
+    def _get_shard_count(self, tag_count: int):
+        if not self.shards:
+            return 1
+
+        return max(1, min(self.shards, tag_count // self.MIN_SHARD_SIZE))
+
+    def _patch_shards(
+        self,
+        xml_data,
+        xml_tags: xml_backend.Element,
+        patch_data: dict,
+        original_rect: Dict[str, str],
+        stats: PatchStats,
+        count: int,
+        xml_file: Path
+    ):
+        xml = self.xml
+
+        self.log.info(f"Patching {len(xml_tags)} tags in {count} shards...")
+        shards = operations.split_shards(xml, xml_tags, count)
+
+        with ProcessPoolExecutor(count) as self.executor:
+            if self.cancelled:
+                raise errors.PatchCancelledError("Patch cancelled!")
+
+            results = list(self.executor.map(
+                operations.patch_shard,
+                repeat(xml.name),
+                shards,
+                repeat(patch_data),
+                repeat(original_rect)
+            ))
+        self.executor = None
+
+        stats.merge([entries for _, entries, _ in results])
+
+        # Elements are only missing if no shard found them
+        warnings: Dict[Tuple[str, bool], int] = {}
+        for _, _, shard_warnings in results:
+            for warning in dict.fromkeys(shard_warnings):
+                warnings[warning] = warnings.get(warning, 0) + 1
+        for (message, missing), found in warnings.items():
+            if not missing or found == len(results):
+                self.log.warning(message)
 
-                for sub_tag in sub_tags:
-                    sub_tag.append(transform_item)
-                    sub_tag.attrib["placeFlagHasColorTransform"] = "true"
-                    transform_items.append(sub_tag.find("./colorTransform"))
-            
-            for transform_item in transform_items:
-                for key, value in sprite_data["colorTransform"].items():
-                    transform_item.attrib[key] = str(value).lower()
+        self.log.info("Writing XML file...")
+        xml.write_shards(xml_data, xml_tags, [patched for patched, _, _ in results], xml_file)
 
-    def _patch_shapes(self, patch_data: dict):
+    def _patch_shapes(self, patch_data: dict, ffdec_interface: ffdec.FFDec):
         shapes: Dict[Path, List[int]] = {}
         for shape_data in patch_data.get("shapes", []):
             shape_path = self.patch_path / shape_data["filePath"]
@@ -300,50 +291,301 @@ class Patcher:
             else:
                 shapes[shape_path] = shape_data["index"]
 
-        self.ffdec_interface.replace_shapes(shapes)                
+        ffdec_interface.replace_shapes(shapes)                
 
-    def _patch_swf(self, swf_path: Path, patch_data: dict):
+    @staticmethod
+    def _needs_xml(patch_data: dict):
+        for shape in patch_data.get("shapes", []):
+            if shape.get("shapeBounds", None):
+                return True
+
+        return bool(
+            patch_data.get("text")
+            or patch_data.get("sprites")
+            or patch_data.get("header")
+            or patch_data.get("transforms")
+        )
+
+    def _get_ffdec(self, item: PatchItem):
         # 2) Initialize FFDec interface
-        self.ffdec_interface = ffdec.FFDec(swf_path, self.app)
+        if item.ffdec_interface is None:
+            item.ffdec_interface = ffdec.FFDec(item.swf_path, self.app)
+            self.ffdec_interfaces.append(item.ffdec_interface)
+
+        return item.ffdec_interface
+
+    def _stage_extract(self, item: PatchItem):
+        # 1) Take SWF extracted from RaceMenu BSA
+        self.log.info(f"Patching file '{item.name}'... ({item.number}/{len(self.patch_data)})")
+        swf_path = self.extract_path / "interface" / item.name
+        self.source_hashes[item.name] = output.OutputWriter.hash_file(swf_path)
+        if self.progress is not None:
+            self.progress.set_size(item.name, swf_path.stat().st_size)
+
+        # Process SWF in RAM if it fits into the budget
+        work_path = self.workspace.get_dir(item.name, Workspace.estimate_size(swf_path))
+        item.swf_path = Workspace.move(swf_path, work_path / item.name)
 
-        _xml: bool = False
+        item.patched_swf = self._apply_compiled(item.swf_path, item.patch_data)
+        item.precompiled = item.patched_swf is not None
 
+        return item
+
+    def _stage_shapes(self, item: PatchItem):
         # 3) Patch shapes into SWF
-        if patch_data.get("shapes") is not None:
-            self._patch_shapes(patch_data)
+        if item.patched_swf is None and item.patch_data.get("shapes") is not None:
+            self.log.info(f"Patching shapes of '{item.name}'...")
+            self._patch_shapes(item.patch_data, self._get_ffdec(item))
+
+        return item
+
+    def _stage_swf2xml(self, item: PatchItem):
+        # 4) Convert SWF to XML if XML has to be patched
+        if item.patched_swf is None and self._needs_xml(item.patch_data):
+            self.log.info(f"Converting '{item.name}' to XML...")
+            item.xml_file = self._get_ffdec(item).swf2xml()
+
+        return item
+
+    def _stage_patch_xml(self, item: PatchItem):
+        # 5) Patch XML with optimized patch data
+        if item.xml_file is not None:
+            self.log.info(f"Patching XML of '{item.name}'...")
+            patch_data = self.optimizer.optimize(item.name, item.patch_data)
+            stats = self._patch_xml(item.xml_file, patch_data, PatchStats(item.name))
+            self._report_stats(stats, item.patch_data)
+
+        return item
+
+    def _report_stats(self, stats: PatchStats, patch_data: dict):
+        # Entries removed by the optimizer did not match anything
+        stats.add_unused(patch_data, self.optimizer.overwritten.get(stats.file))
+        stats.log_table(self.log)
+        self.entry_stats[stats.file] = stats.to_dict()
+
+        if self.report_path is not None:
+            report_file = self.report_path / self.patch_path.name / f"{stats.file}.json"
+            stats.write(report_file)
+            self.log.debug(f"Wrote entry stats to '{report_file}'.")
+
+    def _stage_xml2swf(self, item: PatchItem):
+        # 6) Convert XML back to SWF
+        if item.patched_swf is None:
+            if item.xml_file is not None:
+                self.log.info(f"Converting '{item.name}' back to SWF...")
+                item.patched_swf = self._get_ffdec(item).xml2swf(item.xml_file).resolve()
+            else:
+                item.patched_swf = item.swf_path.resolve()
 
-            for shape in patch_data["shapes"]:
-                if shape.get("shapeBounds", None):
-                    _xml = True
-                    break
+        return item
 
-        if not _xml:
-            _xml = patch_data.get("text") or patch_data.get("sprites") or patch_data.get("header")
+    def _stage_compress(self, item: PatchItem):
+        # 7) Recompress patched SWF if enabled
+        if self.compressor is not None:
+            item.patched_swf = self.compressor.recompress(item.patched_swf)
 
-        # 4) Check if XML has to be done
-        if _xml:
-            # 4) Convert SWF to XML
-            xml_file = self.ffdec_interface.swf2xml()
+        return item
 
-            # 5) Patch XML
-            self._patch_xml(xml_file, patch_data)
+    def _stage_write(self, item: PatchItem):
+        # 8) Write output
+        self._write_output(item.name, item.patched_swf)
 
-            # 6) Convert XML back to SWF
-            patched_swf = self.ffdec_interface.xml2swf(xml_file).resolve()
-        else:
-            patched_swf = swf_path.resolve()
+        return item
+
+    def _patch_swf(self, swf_path: Path, patch_data: dict):
+        item = PatchItem(swf_path.name, patch_data)
+        item.swf_path = swf_path
+
+        self._stage_shapes(item)
+        self._stage_swf2xml(item)
+        self._stage_patch_xml(item)
+        self._stage_xml2swf(item)
+
+        return item.patched_swf
+
+    def _write_output(self, file: str, patched_swf: Path):
+        # 8) Copy patched SWF to current directory
+        # or add it to output BSA
+        rel_path = Path("interface") / file
+        if self.bsa_writer is not None:
+            self.bsa_writer.add_file(str(rel_path), patched_swf)
+            return
 
-        # 7) Copy patched SWF to current directory
-        output_path = Path(".").resolve().parent / swf_path.relative_to(self.tmpdir / "RaceMenu")
+        output_path = self.output_path / rel_path
         self.log.info(f"Writing output to '{output_path}'")
         output_path = output_path.resolve()
-        os.makedirs(output_path.parent, exist_ok=True)
-        if output_path.is_file():
-            self.log.warning("Existing file gets overwritten!")
-            os.remove(output_path)
-        shutil.copyfile(
-            patched_swf,
-            output_path
+        self.writer.write(patched_swf, output_path)
+        self.outputs[rel_path.as_posix()] = patched_swf
+
+    def _get_patch_hash(self, patch_data: dict):
+        # Hash of patch data and all shape files used by it
+        patch_hash = hashlib.sha256(
+            json.dumps(patch_data, sort_keys=True).encode()
+        )
+
+        for shape_data in patch_data.get("shapes", []):
+            shape_path = self.patch_path / shape_data["filePath"]
+            if shape_path.is_file():
+                patch_hash.update(shape_path.read_bytes())
+
+        return patch_hash.hexdigest()
+
+    def _apply_compiled(self, swf_path: Path, patch_data: dict):
+        compiled_path = self.patch_path / "compiled"
+        if not compiled_path.is_dir():
+            return None
+
+        source_data = swf_path.read_bytes()
+        source_hash = hashlib.sha256(source_data).hexdigest()
+        delta_file = compiled_path / SWFDelta.get_file_name(swf_path.name, source_hash)
+
+        if not delta_file.is_file():
+            self.log.info(
+                "Found no precompiled patch for this RaceMenu version. "
+                "Falling back to full patching..."
+            )
+            return None
+
+        self.log.info("Applying precompiled patch...")
+        try:
+            delta = SWFDelta.load(delta_file)
+
+            if delta.patch_hash != self._get_patch_hash(patch_data):
+                self.log.warning(
+                    "Precompiled patch is outdated. Falling back to full patching..."
+                )
+                return None
+
+            target = delta.apply(source_data)
+        except errors.InvalidPatchError as ex:
+            self.log.warning(
+                f"Failed to apply precompiled patch: {ex} Falling back to full patching..."
+            )
+            return None
+
+        patched_swf = swf_path.with_suffix(".compiled.swf")
+        patched_swf.write_bytes(target.to_bytes())
+
+        self.log.info("Applied precompiled patch.")
+        return patched_swf
+
+    def is_precompiled(self):
+        """
+        Checks if there is an up-to-date precompiled patch
+        for the RaceMenu version of every SWF file in patch.
+        """
+
+        compiled_path = self.patch_path / "compiled"
+        bsa_path = self.racemenu_path / "RaceMenu.bsa"
+        if not compiled_path.is_dir() or not bsa_path.is_file():
+            return False
+
+        if self.extractor is None:
+            self.extractor = bsa.BSAExtractor(bsa_path, self.app)
+        sources = self.extractor.read(
+            [f"interface/{file}" for file in self.patch_data]
+        )
+
+        for file, patch_data in self.patch_data.items():
+            source_data = sources.get(str(PureWindowsPath("interface", file)).lower())
+            if source_data is None:
+                return False
+
+            source_hash = hashlib.sha256(source_data).hexdigest()
+            delta_file = compiled_path / SWFDelta.get_file_name(Path(file).name, source_hash)
+            if not delta_file.is_file():
+                return False
+
+            try:
+                delta = SWFDelta.load(delta_file)
+            except errors.InvalidPatchError:
+                return False
+
+            if delta.patch_hash != self._get_patch_hash(patch_data):
+                return False
+
+        return True
+
+    def cancel(self):
+        """
+        Cancels patching after the current step and kills FFDec
+        and the worker processes of sharded patching if running.
+        """
+
+        self.cancelled = True
+
+        if self.pipeline is not None:
+            self.pipeline.abort(errors.PatchCancelledError("Patch cancelled!"))
+
+        for ffdec_interface in list(self.ffdec_interfaces):
+            if ffdec_interface._pid is not None:
+                utils.kill_child_process(ffdec_interface._pid)
+                self.log.info(f"Killed FFDec with pid {ffdec_interface._pid}.")
+                ffdec_interface._pid = None
+
+        # Killed workers make the pool raise BrokenProcessPool in the patcher thread
+        executor = self.executor
+        if executor is not None:
+            for pid in list(executor._processes or []):
+                try:
+                    utils.kill_child_process(pid)
+                except psutil.NoSuchProcess:
+                    continue
+                self.log.info(f"Killed worker process with pid {pid}.")
+
+    def _write_bsa(self):
+        bsa_path = self.tmpdir / f"{self.patch_path.name}.bsa"
+        self.bsa_writer.write(bsa_path)
+
+        if not self.bsa_writer.verify(bsa_path):
+            raise errors.BSAWriteError(f"Failed to verify '{bsa_path.name}'!")
+
+        output_path = self.output_path / bsa_path.name
+        self.log.info(f"Writing output to '{output_path}'")
+        self.writer.write(bsa_path, output_path.resolve())
+        self.outputs[bsa_path.name] = bsa_path
+        self.log.info(
+            "The BSA archive is only loaded by the game "
+            "if a plugin with the same name is enabled."
+        )
+
+    def _stage_started(self, stage: Stage, item: PatchItem):
+        if self.progress is not None:
+            self.progress.start(item.name, stage.name)
+
+    def _stage_finished(self, stage: Stage, item: PatchItem, duration: float):
+        if self.progress is not None:
+            self.progress.finish(
+                item.name, stage.name, duration, skipped=not self._did_work(stage, item)
+            )
+
+    def _did_work(self, stage: Stage, item: PatchItem):
+        # Stages without work for <item>, for eg. because of a precompiled patch,
+        # take no time and must not be used for time estimates
+        match stage.name:
+            case "shapes":
+                return not item.precompiled and item.patch_data.get("shapes") is not None
+            case "swf2xml" | "patch_xml" | "xml2swf":
+                return item.xml_file is not None
+            case "compress":
+                return self.compressor is not None
+
+        return True
+
+    def _store_run(self):
+        # Combined hashes of all patched files and their RaceMenu originals
+        patch_hash = hashlib.sha256()
+        racemenu_hash = hashlib.sha256()
+        for file in sorted(self.patch_data):
+            patch_hash.update(self._get_patch_hash(self.patch_data[file]).encode())
+            racemenu_hash.update(self.source_hashes.get(file, "").encode())
+
+        self.output_store.add_run(
+            self.outputs,
+            self.output_path,
+            self.patch_path.name,
+            patch_hash.hexdigest(),
+            racemenu_hash.hexdigest()
         )
 
     def patch(self):
@@ -355,25 +597,139 @@ class Patcher:
             4. Convert SWF to XML.
             5. Patch XML.
             6. Convert XML back to SWF.
-            7. Copy SWF to current directory.
+            7. Recompress SWF if enabled.
+            8. Copy SWF to current directory if it changed.
+            9. Pack SWFs into a BSA archive if enabled.
+            10. Record output in the output store.
+
+        Steps 2-6 are skipped for SWFs with a matching precompiled patch.
+        Step 1 extracts all SWFs at once, steps 2-8 run as a pipeline,
+        so while one SWF is processed by one step,
+        the next SWF is already processed by the previous step.
         """
 
         self.log.info("Patching RaceMenu...")
+        start = time.perf_counter()
+
+        self.writer = output.OutputWriter(self.app)
+        self.outputs = {}
+        self.source_hashes = {}
+        if self.output_bsa:
+            self.bsa_writer = bsa.BSAWriter(self.app, compressed=self.compress_bsa)
 
         # 0) Create Temp folder
-        with tmp.TemporaryDirectory(prefix="DRIP_") as tmpdir:
-            self.tmpdir = Path(tmpdir).resolve()
+        with Workspace(self.app) as self.workspace:
+            self.tmpdir = self.workspace.path
+
+            # 1-8) Patch SWFs according to patch data
+            self.pipeline = Pipeline(
+                self.app,
+                [
+                    Stage("extract", self._stage_extract),
+                    Stage("shapes", self._stage_shapes),
+                    Stage("swf2xml", self._stage_swf2xml),
+                    Stage("patch_xml", self._stage_patch_xml),
+                    Stage("xml2swf", self._stage_xml2swf),
+                    Stage("compress", self._stage_compress),
+                    Stage("write", self._stage_write),
+                ],
+                on_start=self._stage_started,
+                on_finish=self._stage_finished
+            )
+            if self.timings is not None:
+                self.progress = RunProgress(
+                    self.app,
+                    self.timings,
+                    self.patch_data,
+                    [stage.name for stage in self.pipeline.stages]
+                )
+                if (remaining := self.progress.get_remaining()) is not None:
+                    self.log.info(f"Estimated time: about {format_duration(remaining)}.")
+            if self.cancelled:
+                raise errors.PatchCancelledError("Patch cancelled!")
+
+            # 1) Extract all SWFs at once with the parallel extractor
+            self.extract_path = self._extract_bsa()
+
+            self.log.info(f"Patching {len(self.patch_data)} file(s)...")
+            self.pipeline.run(
+                PatchItem(file, patch_data, c + 1)
+                for c, (file, patch_data) in enumerate(self.patch_data.items())
+            )
+            self.pipeline.log_stats()
+
+            # 9) Pack patched SWFs into BSA
+            if self.bsa_writer is not None:
+                self._write_bsa()
+
+            # 10) Record output for later rollback
+            if self.output_store is not None:
+                self._store_run()
+
+        # Record stage durations for time estimates of later runs
+        if self.progress is not None:
+            self.timings.add_run(
+                self.patch_path.name,
+                self.progress.samples,
+                time.perf_counter() - start
+            )
+
+        if self.compressor is not None:
+            self.log.info(f"Compression: {self.compressor.get_summary()}.")
+        self.log.info(f"Output: {self.writer.summary()}.")
+        self.log.info("Patch complete!")
+        self.app.done_signal.emit()
+
+    def compile(self):
+        """
+        Compiles patch for the selected RaceMenu version:
+            1. Extract RaceMenu BSA to a temp folder.
+            2. Patch every SWF with the full process.
+            3. Write tag-level differences between original
+               and patched SWF to the "compiled" folder of the patch.
+
+        The compiled patch is applied instead of the full process
+        if the RaceMenu SWF and the patch are unchanged.
+        """
+
+        self.log.info("Compiling patch...")
+
+        compiled_path = self.patch_path / "compiled"
+        os.makedirs(compiled_path, exist_ok=True)
+
+        with Workspace(self.app) as self.workspace:
+            self.tmpdir = self.workspace.path
 
-            # 1) Extract RaceMenu BSA to Temp folder
             bsa_path = self._extract_bsa()
 
-            # 2) Patch SWFs according to patch data
             for c, (file, patch_data) in enumerate(self.patch_data.items()):
                 file: Path = bsa_path / "interface" / file
-                self.log.info(f"Patching file '{file.name}'... ({c+1}/{len(self.patch_data)})")
+                self.log.info(f"Compiling file '{file.name}'... ({c+1}/{len(self.patch_data)})")
 
-                self._patch_swf(file, patch_data)
+                work_path = self.workspace.get_dir(file.name, Workspace.estimate_size(file))
+                file = Workspace.move(file, work_path / file.name)
 
-        self.log.info("Patch complete!")
+                source_data = file.read_bytes()
+                patched_swf = self._patch_swf(file, patch_data)
+
+                target = SWFFile.from_file(patched_swf)
+                delta = SWFDelta.create(
+                    source_data, target, self._get_patch_hash(patch_data)
+                )
+
+                # Make sure that delta reproduces patched SWF
+                delta.apply(source_data)
+
+                delta_file = compiled_path / SWFDelta.get_file_name(
+                    file.name, delta.source_hash
+                )
+                delta.dump(delta_file)
+
+                self.log.info(
+                    f"Wrote '{delta_file.name}' with {len(delta.tags)} "
+                    f"new tag(s) of {len(target.tags)} ({delta_file.stat().st_size} bytes)."
+                )
+
+        self.log.info("Compilation complete!")
         self.app.done_signal.emit()
 
@@ -0,0 +1,244 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains Pipeline class for running patch stages concurrently.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable, List
+
+from main import MainApp
+
+
+class Stage:
+    """
+    Class for a single pipeline stage and its statistics.
+    """
+
+    # Total time spent processing items
+    busy_time: float = 0
+    # Total time spent waiting for items
+    idle_time: float = 0
+    processed: int = 0
+    max_depth: int = 0
+
+    def __init__(self, name: str, func: Callable[[Any], Any], workers: int = 1):
+        self.name = name
+        self.func = func
+        self.workers = workers
+
+        self._depth_samples: List[int] = []
+
+    def __repr__(self):
+        return f"Stage({self.name})"
+
+    def sample_depth(self, depth: int):
+        self._depth_samples.append(depth)
+        self.max_depth = max(self.max_depth, depth)
+
+    @property
+    def mean_depth(self):
+        if not self._depth_samples:
+            return 0
+        return sum(self._depth_samples) / len(self._depth_samples)
+
+    def get_stats(self):
+        """
+        Returns statistics of stage as dictionary.
+        """
+
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "processed": self.processed,
+            "busy_time": self.busy_time,
+            "idle_time": self.idle_time,
+            "max_queue_depth": self.max_depth,
+            "mean_queue_depth": self.mean_depth,
+        }
+
+
+class Pipeline:
+    """
+    Class for running items through a chain of stages.
+
+    Every stage runs in its own worker thread(s) and stages are connected
+    by bounded queues, so that an item can be processed by one stage while
+    the next item is processed by the previous stage.
+    The total runtime is therefore limited by the slowest stage
+    instead of the sum of all stages.
+
+    <on_start> and <on_finish> are called with the stage and the item
+    before and after an item is processed by a stage.
+    """
+
+    _SENTINEL = object()
+
+    error: BaseException = None
+
+    def __init__(
+        self,
+        app: MainApp,
+        stages: List[Stage],
+        queue_size: int = 2,
+        on_start: Callable[[Stage, Any], None] = None,
+        on_finish: Callable[[Stage, Any, float], None] = None
+    ):
+        self.app = app
+        self.stages = stages
+        self.queue_size = queue_size
+        self.on_start = on_start
+        self.on_finish = on_finish
+
+        self.log = logging.getLogger(self.__repr__())
+        self.log.addHandler(self.app.log_str)
+        self.log.setLevel(self.app.log.level)
+
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "Pipeline"
+
+    def abort(self, error: BaseException):
+        """
+        Stops processing of further items and
+        raises <error> at the end of run().
+        """
+
+        with self._lock:
+            if self.error is None:
+                self.error = error
+
+    def _work(
+        self,
+        stage: Stage,
+        in_queue: queue.Queue,
+        out_queue: queue.Queue,
+        next_workers: int,
+        remaining: List[int]
+    ):
+        while True:
+            start = time.perf_counter()
+            item = in_queue.get()
+            waited = time.perf_counter() - start
+
+            with self._lock:
+                stage.idle_time += waited
+
+            if item is self._SENTINEL:
+                break
+
+            # Skip items after an error but keep draining the queue
+            if self.error is not None:
+                continue
+
+            start = time.perf_counter()
+            try:
+                if self.on_start is not None:
+                    self.on_start(stage, item)
+                item = stage.func(item)
+                if self.on_finish is not None:
+                    self.on_finish(stage, item, time.perf_counter() - start)
+            except BaseException as ex:
+                self.abort(ex)
+                continue
+            finally:
+                with self._lock:
+                    stage.busy_time += time.perf_counter() - start
+
+            with self._lock:
+                stage.processed += 1
+
+            out_queue.put(item)
+
+        # Last worker of stage passes end of input to next stage
+        with self._lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+
+        if last:
+            for _ in range(next_workers):
+                out_queue.put(self._SENTINEL)
+
+    def run(self, items: Iterable):
+        """
+        Runs <items> through all stages and returns processed items
+        in the order they were finished.
+        """
+
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        results: List[Any] = []
+        # Output of last stage is unbounded
+        queues.append(queue.Queue())
+
+        threads: List[threading.Thread] = []
+        for c, stage in enumerate(self.stages):
+            next_workers = self.stages[c + 1].workers if c + 1 < len(self.stages) else 1
+            remaining = [stage.workers]
+
+            for w in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(stage, queues[c], queues[c + 1], next_workers, remaining),
+                    name=f"{stage.name}-{w}",
+                    daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+
+        # Feed input items
+        for item in items:
+            if self.error is not None:
+                break
+            queues[0].put(item)
+            self.stages[0].sample_depth(queues[0].qsize())
+        for _ in range(self.stages[0].workers):
+            queues[0].put(self._SENTINEL)
+
+        # Sample queue depths while collecting results
+        while True:
+            for stage, stage_queue in zip(self.stages[1:], queues[1:]):
+                stage.sample_depth(stage_queue.qsize())
+
+            try:
+                item = queues[-1].get(timeout=0.05)
+            except queue.Empty:
+                continue
+
+            if item is self._SENTINEL:
+                break
+            results.append(item)
+
+        for thread in threads:
+            thread.join()
+
+        if self.error is not None:
+            raise self.error
+
+        return results
+
+    def get_stats(self):
+        """
+        Returns statistics of all stages.
+        """
+
+        return [stage.get_stats() for stage in self.stages]
+
+    def log_stats(self):
+        """
+        Logs statistics of all stages as table.
+        """
+
+        self.log.info("Stage statistics:")
+        self.log.info(
+            f"{'Stage':<12} {'Items':>5} {'Busy (s)':>9} {'Idle (s)':>9} {'Max queue':>9} {'Mean queue':>10}"
+        )
+        for stage in self.stages:
+            self.log.info(
+                f"{stage.name:<12} {stage.processed:>5} {stage.busy_time:>9.3f} "
+                f"{stage.idle_time:>9.3f} {stage.max_depth:>9} {stage.mean_depth:>10.2f}"
+            )
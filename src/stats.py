@@ -0,0 +1,201 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains EntryStats and PatchStats classes for per-entry cost reports.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List
+
+
+class EntryStats:
+    """
+    Class for the cost and hit counts of one patch entry.
+
+    <sources> are the indexes of the entries in patch.json
+    the (optimized) entry was created from.
+    <overwritten_by> is the index of the entry in patch.json that
+    overwrites all values of an entry removed by the optimizer.
+    """
+
+    def __init__(self, section: str, sources: List[int] = None):
+        self.section = section
+        self.sources = sources or []
+        self.matched = 0
+        self.written = 0
+        self.created = 0
+        self.time = 0.0
+        self.overwritten_by: int = None
+
+    def __repr__(self):
+        return f"EntryStats({self.name})"
+
+    @property
+    def name(self):
+        """
+        Name of entry like in optimizer warnings, for eg. "sprites[1+3]".
+        """
+
+        if not self.sources:
+            return self.section
+
+        return f"{self.section}[{'+'.join(str(c+1) for c in self.sources)}]"
+
+    def merge(self, other: "EntryStats"):
+        """
+        Adds counts and time of <other> for the same entry.
+        """
+
+        self.matched += other.matched
+        self.written += other.written
+        self.created += other.created
+        self.time += other.time
+
+    @contextmanager
+    def measure(self):
+        """
+        Adds the time spent in the with block.
+        """
+
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.time += time.perf_counter() - start
+
+    def to_dict(self):
+        """
+        Returns stats as dictionary.
+        """
+
+        return {
+            "entry": self.name,
+            "section": self.section,
+            "sources": [c + 1 for c in self.sources],
+            "matched": self.matched,
+            "written": self.written,
+            "created": self.created,
+            "time": self.time,
+            "overwritten_by": (
+                None if self.overwritten_by is None else self.overwritten_by + 1
+            ),
+        }
+
+
+class PatchStats:
+    """
+    Class for collecting the stats of all patch entries of an SWF file.
+    """
+
+    def __init__(self, file: str):
+        self.file = file
+        self.entries: List[EntryStats] = []
+
+    def __repr__(self):
+        return f"PatchStats({self.file})"
+
+    def add(self, section: str, sources: List[int] = None):
+        """
+        Adds and returns stats for an entry of <section>.
+        """
+
+        entry = EntryStats(section, sources)
+        self.entries.append(entry)
+        return entry
+
+    @contextmanager
+    def measure(self, section: str, sources: List[int] = None):
+        """
+        Adds stats for an entry of <section> and adds
+        the time spent in the with block to it.
+        """
+
+        with self.add(section, sources).measure() as entry:
+            yield entry
+
+    def merge(self, shard_entries: List[List[EntryStats]]):
+        """
+        Adds stats of the same entries applied to several shards.
+        """
+
+        for entries in zip(*shard_entries):
+            for entry in entries[1:]:
+                entries[0].merge(entry)
+            self.entries.append(entries[0])
+
+    def add_unused(self, patch_data: dict, overwritten: Dict[str, Dict[int, int]] = None):
+        """
+        Adds empty stats for every entry in original <patch_data>
+        that was removed by the optimizer.
+        <overwritten> maps the indexes of removed entries to the index
+        of an entry overwriting them by section (see PatchOptimizer).
+        """
+
+        if overwritten is None:
+            overwritten = {}
+
+        for section in ("shapes", "sprites", "text", "transforms"):
+            used = {
+                c
+                for entry in self.entries
+                if entry.section == section
+                for c in entry.sources
+            }
+            for c, entry_data in enumerate(patch_data.get(section, [])):
+                if c in used:
+                    continue
+
+                # Shapes without shape bounds are only replaced by FFDec
+                if section == "shapes" and not entry_data.get("shapeBounds"):
+                    continue
+
+                entry = self.add(section, [c])
+                entry.overwritten_by = overwritten.get(section, {}).get(c)
+
+    def get_sorted(self):
+        """
+        Returns stats sorted by time, most expensive entries first.
+        """
+
+        return sorted(self.entries, key=lambda entry: (-entry.time, -entry.matched))
+
+    def to_dict(self):
+        """
+        Returns stats of all entries as list of dictionaries.
+        """
+
+        return [entry.to_dict() for entry in self.get_sorted()]
+
+    def log_table(self, log: logging.Logger):
+        """
+        Logs stats as table to <log>.
+        """
+
+        log.info(f"Entry stats of '{self.file}':")
+        log.info(
+            f"{'Entry':<24} {'Matched':>8} {'Written':>8} {'Created':>8} {'Time (s)':>9}"
+        )
+        for entry in self.get_sorted():
+            note = ""
+            if entry.overwritten_by is not None:
+                note = f"  (overwritten by {entry.section}[{entry.overwritten_by + 1}])"
+
+            log.info(
+                f"{entry.name[:24]:<24} {entry.matched:>8} {entry.written:>8} "
+                f"{entry.created:>8} {entry.time:>9.4f}{note}"
+            )
+
+    def write(self, report_file: Path):
+        """
+        Writes stats to JSON file at <report_file>.
+        """
+
+        os.makedirs(report_file.parent, exist_ok=True)
+        with open(report_file, "w", encoding="utf8") as file:
+            json.dump({"file": self.file, "entries": self.to_dict()}, file, indent=4)
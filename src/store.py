@@ -0,0 +1,246 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains OutputStore class.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import errors
+import output
+from main import MainApp
+
+
+class OutputStore:
+    """
+    Class for a content-addressed store of produced output files.
+
+    Every patch run is recorded as a manifest that maps the output files
+    to their stored content. Identical files are only stored once.
+    Restoring a run replaces the current output files with the stored ones
+    without running the patcher again.
+    """
+
+    # Limits for stored runs, oldest runs are evicted first
+    max_runs: int = 20
+    max_size: int = 1024 * 1024 * 1024
+
+    def __init__(self, app: MainApp, store_path: Path = None):
+        self.app = app
+        self.store_path = store_path or (Path(".") / "output_store").resolve()
+        self.objects_path = self.store_path / "objects"
+        self.runs_path = self.store_path / "runs"
+
+        self.log = logging.getLogger(self.__repr__())
+        self.log.addHandler(self.app.log_str)
+        self.log.setLevel(self.app.log.level)
+
+    def __repr__(self):
+        return "OutputStore"
+
+    def _get_object_path(self, file_hash: str):
+        return self.objects_path / file_hash[:2] / file_hash
+
+    def add_run(
+        self,
+        files: Dict[str, Path],
+        output_path: Path,
+        patch_name: str,
+        patch_hash: str,
+        racemenu_hash: str
+    ):
+        """
+        Stores <files> (paths relative to <output_path> mapped to produced files)
+        as new run and returns its id.
+        """
+
+        stored: Dict[str, str] = {}
+        for rel_path, file in files.items():
+            file_hash = output.OutputWriter.hash_file(file)
+            object_path = self._get_object_path(file_hash)
+
+            if not object_path.is_file():
+                os.makedirs(object_path.parent, exist_ok=True)
+                tmp_path = object_path.with_suffix(".tmp")
+                shutil.copyfile(file, tmp_path)
+                os.replace(tmp_path, object_path)
+
+            stored[rel_path] = file_hash
+
+        timestamp = time.time()
+        run_id = time.strftime("%Y%m%d-%H%M%S", time.localtime(timestamp))
+        c = 1
+        while (self.runs_path / f"{run_id}.json").is_file():
+            c += 1
+            run_id = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(timestamp))}-{c}"
+
+        manifest = {
+            "id": run_id,
+            "timestamp": timestamp,
+            "patch": patch_name,
+            "patch_hash": patch_hash,
+            "racemenu_hash": racemenu_hash,
+            "output_path": str(output_path),
+            "files": stored,
+        }
+        os.makedirs(self.runs_path, exist_ok=True)
+        with open(self.runs_path / f"{run_id}.json", "w", encoding="utf8") as file:
+            json.dump(manifest, file, indent=4)
+
+        self.log.info(f"Stored output as run '{run_id}'.")
+
+        self.evict()
+
+        return run_id
+
+    def get_runs(self):
+        """
+        Returns manifests of all stored runs, oldest first.
+        """
+
+        runs: List[dict] = []
+        if self.runs_path.is_dir():
+            for manifest_file in self.runs_path.glob("*.json"):
+                with open(manifest_file, "r", encoding="utf8") as file:
+                    runs.append(json.load(file))
+
+        return sorted(runs, key=lambda run: run["timestamp"])
+
+    def get_run(self, run_id: str):
+        """
+        Returns manifest of run with <run_id>.
+        """
+
+        manifest_file = self.runs_path / f"{run_id}.json"
+        if not manifest_file.is_file():
+            raise errors.RunNotFoundError(f"Run '{run_id}' does not exist!")
+
+        with open(manifest_file, "r", encoding="utf8") as file:
+            return json.load(file)
+
+    def _get_size(self):
+        return sum(
+            file.stat().st_size
+            for file in self.objects_path.glob("*/*")
+            if file.is_file()
+        )
+
+    def evict(self):
+        """
+        Removes oldest runs until store is within its limits
+        and deletes files that are no longer used by any run.
+        The newest run is always kept.
+        """
+
+        runs = self.get_runs()
+
+        while len(runs) > 1 and (
+            len(runs) > self.max_runs or self._get_size() > self.max_size
+        ):
+            run = runs.pop(0)
+            os.remove(self.runs_path / f"{run['id']}.json")
+            self.log.info(f"Evicted run '{run['id']}'.")
+            self._collect_garbage(runs)
+
+    def _collect_garbage(self, runs: List[dict]):
+        used = {
+            file_hash
+            for run in runs
+            for file_hash in run["files"].values()
+        }
+
+        for object_path in self.objects_path.glob("*/*"):
+            if object_path.name not in used:
+                os.remove(object_path)
+
+    def restore(self, run_id: str, output_path: Path = None):
+        """
+        Restores output files of run with <run_id> to <output_path>
+        (defaults to output path of run).
+        Output files of stored runs that are not part of
+        the restored run are removed.
+        """
+
+        run = self.get_run(run_id)
+        output_path = output_path or Path(run["output_path"])
+
+        self.log.info(f"Restoring run '{run_id}' to '{output_path}'...")
+
+        self._remove_outputs(output_path, exclude=set(run["files"]))
+
+        # Copies so that changes to restored files cannot corrupt stored objects
+        writer = output.OutputWriter(self.app, use_hardlinks=False)
+        for rel_path, file_hash in run["files"].items():
+            object_path = self._get_object_path(file_hash)
+            if not object_path.is_file() or output.OutputWriter.hash_file(object_path) != file_hash:
+                raise errors.RunNotFoundError(f"Stored file of '{rel_path}' is missing or corrupted!")
+
+            writer.write(object_path, output_path / rel_path)
+
+        # Restored run becomes the latest run
+        run["timestamp"] = time.time()
+        with open(self.runs_path / f"{run_id}.json", "w", encoding="utf8") as file:
+            json.dump(run, file, indent=4)
+
+        self.log.info(f"Restored run '{run_id}': {writer.summary()}.")
+
+    def restore_vanilla(self, output_path: Path = None):
+        """
+        Removes output files of all stored runs from <output_path>
+        (defaults to output path of latest run) so that the
+        original files from RaceMenu's BSA are used again.
+        """
+
+        runs = self.get_runs()
+        if not runs:
+            self.log.info("There is no stored run to remove.")
+            return
+
+        output_path = output_path or Path(runs[-1]["output_path"])
+        self._remove_outputs(output_path)
+
+        self.log.info("Restored vanilla RaceMenu.")
+
+    def _remove_outputs(self, output_path: Path, exclude: set = None):
+        if exclude is None:
+            exclude = set()
+
+        runs = self.get_runs()
+        if not runs:
+            return
+
+        # Runs with different layouts (loose files or BSA)
+        # may have written different files to the same folder
+        output_runs = [
+            run for run in runs
+            if Path(run["output_path"]).resolve() == output_path.resolve()
+        ] or runs[-1:]
+
+        # Hashes of every stored version of each file
+        outputs: Dict[str, set] = {}
+        for run in output_runs:
+            for rel_path, file_hash in run["files"].items():
+                outputs.setdefault(rel_path, set()).add(file_hash)
+
+        for rel_path, file_hashes in outputs.items():
+            if rel_path in exclude:
+                continue
+
+            file = output_path / rel_path
+            if not file.is_file():
+                continue
+
+            # Do not delete files that were modified by someone else
+            if output.OutputWriter.hash_file(file) not in file_hashes:
+                self.log.warning(f"'{rel_path}' was modified and is kept.")
+                continue
+
+            os.remove(file)
+            self.log.info(f"Removed '{rel_path}'.")
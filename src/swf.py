@@ -0,0 +1,202 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains SWF container class.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+import hashlib
+import lzma
+import struct
+import zlib
+from pathlib import Path
+from typing import List
+
+import errors
+
+
+class SWFFile:
+    """
+    Class for SWF files on tag level.
+
+    Splits an SWF file into its header and its raw tags
+    without decoding the tags themselves.
+    """
+
+    UNCOMPRESSED = b"FWS"
+    ZLIB = b"CWS"
+    LZMA = b"ZWS"
+
+    signature: bytes = None
+    version: int = None
+    header: bytes = None
+    tags: List[bytes] = None
+    trailer: bytes = b""
+
+    def __init__(
+        self,
+        signature: bytes,
+        version: int,
+        header: bytes,
+        tags: List[bytes],
+        trailer: bytes = b""
+    ):
+        self.signature = signature
+        self.version = version
+        self.header = header
+        self.tags = tags
+        self.trailer = trailer
+
+    def __repr__(self):
+        return "SWFFile"
+
+    @staticmethod
+    def decompress(data: bytes):
+        """
+        Returns uncompressed body (everything after the first 8 bytes)
+        of SWF <data>.
+        """
+
+        signature = data[:3]
+        length = struct.unpack_from("<I", data, 4)[0] - 8
+
+        match signature:
+            case SWFFile.UNCOMPRESSED:
+                return data[8:]
+
+            case SWFFile.ZLIB:
+                return zlib.decompress(data[8:])
+
+            case SWFFile.LZMA:
+                # LZMA properties are stored in front of the raw stream
+                props = data[12:17]
+                lc_lp_pb = props[0]
+                dict_size = struct.unpack_from("<I", props, 1)[0]
+                lzma_filter = {
+                    "id": lzma.FILTER_LZMA1,
+                    "dict_size": dict_size,
+                    "lc": lc_lp_pb % 9,
+                    "lp": (lc_lp_pb // 9) % 5,
+                    "pb": lc_lp_pb // 45,
+                }
+                decompressor = lzma.LZMADecompressor(
+                    lzma.FORMAT_RAW, filters=[lzma_filter]
+                )
+                return decompressor.decompress(data[17:], max_length=length)
+
+        raise errors.InvalidSWFFileError(f"Unknown SWF signature: {signature!r}")
+
+    @staticmethod
+    def compress(signature: bytes, version: int, body: bytes, level: int = 9):
+        """
+        Returns complete SWF file with <body> compressed according to <signature>.
+        """
+
+        length = struct.pack("<I", len(body) + 8)
+
+        match signature:
+            case SWFFile.UNCOMPRESSED:
+                return signature + bytes([version]) + length + body
+
+            case SWFFile.ZLIB:
+                return signature + bytes([version]) + length + zlib.compress(body, level)
+
+            case SWFFile.LZMA:
+                compressed = lzma.compress(
+                    body,
+                    format=lzma.FORMAT_ALONE,
+                    preset=level
+                )
+                # Replace 8 byte size field of .lzma header by SWF's 4 byte field
+                props = compressed[:5]
+                compressed = compressed[13:]
+                return (
+                    signature
+                    + bytes([version])
+                    + length
+                    + struct.pack("<I", len(compressed))
+                    + props
+                    + compressed
+                )
+
+        raise errors.InvalidSWFFileError(f"Unknown SWF signature: {signature!r}")
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        """
+        Parses SWF file from <data>.
+        """
+
+        if len(data) < 8:
+            raise errors.InvalidSWFFileError("File is too small!")
+
+        signature = data[:3]
+        version = data[3]
+        body = cls.decompress(data)
+
+        # Frame size RECT, frame rate and frame count
+        nbits = body[0] >> 3
+        rect_size = (5 + 4 * nbits + 7) // 8
+        header_size = rect_size + 4
+        header = body[:header_size]
+
+        tags: List[bytes] = []
+        offset = header_size
+        while offset + 2 <= len(body):
+            code_and_length = struct.unpack_from("<H", body, offset)[0]
+            code = code_and_length >> 6
+            length = code_and_length & 0x3F
+            tag_size = 2
+            if length == 0x3F:
+                length = struct.unpack_from("<I", body, offset + 2)[0]
+                tag_size += 4
+            tag_size += length
+
+            if offset + tag_size > len(body):
+                raise errors.InvalidSWFFileError("Tag exceeds end of file!")
+
+            tags.append(body[offset:offset + tag_size])
+            offset += tag_size
+
+            # End tag
+            if code == 0:
+                break
+
+        return cls(signature, version, header, tags, body[offset:])
+
+    @classmethod
+    def from_file(cls, path: Path):
+        """
+        Parses SWF file at <path>.
+        """
+
+        return cls.from_bytes(path.read_bytes())
+
+    def get_body(self):
+        """
+        Returns uncompressed body of SWF file.
+        """
+
+        return self.header + b"".join(self.tags) + self.trailer
+
+    def digest(self):
+        """
+        Returns SHA-256 hex digest of uncompressed SWF file.
+        This is independent from the compression used.
+        """
+
+        data = bytes([self.version]) + self.get_body()
+        return hashlib.sha256(data).hexdigest()
+
+    def to_bytes(self, signature: bytes = None, level: int = 9):
+        """
+        Returns SWF file compressed according to <signature>
+        (defaults to original compression).
+        """
+
+        return self.compress(
+            signature or self.signature,
+            self.version,
+            self.get_body(),
+            level
+        )
@@ -0,0 +1,418 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains TimingDatabase and RunProgress classes for run time predictions.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+import hashlib
+import logging
+import math
+import os
+import platform
+import sqlite3
+import statistics
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import psutil
+
+from main import MainApp
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp REAL NOT NULL,
+    machine TEXT NOT NULL,
+    patch TEXT NOT NULL,
+    files INTEGER NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stages (
+    run INTEGER NOT NULL,
+    machine TEXT NOT NULL,
+    file TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    swf_size INTEGER NOT NULL,
+    op_count INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    outlier INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS stages_by_stage ON stages (machine, stage);
+CREATE INDEX IF NOT EXISTS stages_by_file ON stages (machine, file);
+"""
+
+# Duration of a stage for a file:
+# (file, stage, SWF size, number of patch entries, duration, outlier)
+Sample = Tuple[str, str, int, int, float, bool]
+
+
+def get_op_count(patch_data: dict):
+    """
+    Returns number of patch entries in <patch_data> of an SWF file.
+    """
+
+    return sum(
+        len(patch_data.get(section) or [])
+        for section in ("shapes", "sprites", "text", "transforms")
+    ) + bool(patch_data.get("header"))
+
+
+def format_duration(seconds: float):
+    """
+    Returns <seconds> as short text, for eg. "45 s" or "2:05 min".
+    """
+
+    seconds = round(seconds)
+    if seconds < 60:
+        return f"{seconds} s"
+
+    return f"{seconds // 60}:{seconds % 60:02} min"
+
+
+class TimingDatabase:
+    """
+    Class for a local SQLite database with the stage durations of previous runs.
+
+    Durations are stored per SWF file and stage together with the size
+    of the SWF file, its number of patch entries and a fingerprint
+    of the machine. Predictions only use samples of the same machine.
+    """
+
+    # Number of runs kept per machine, older runs are removed
+    max_runs: int = 200
+    # Number of most similar samples a prediction is based on
+    neighbours: int = 5
+    # A duration is an outlier if it exceeds the prediction by this factor
+    # and by at least the margin (in seconds)
+    outlier_factor: float = 3.0
+    outlier_margin: float = 5.0
+
+    def __init__(self, app: MainApp, db_path: Path = None):
+        self.app = app
+        self.db_path = db_path or (Path(".") / "timings.db").resolve()
+        self.machine = self.get_fingerprint()
+
+        self.log = logging.getLogger(self.__repr__())
+        self.log.addHandler(self.app.log_str)
+        self.log.setLevel(self.app.log.level)
+
+        self._connection: sqlite3.Connection = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "TimingDatabase"
+
+    @staticmethod
+    def get_fingerprint():
+        """
+        Returns fingerprint of the hardware of this machine.
+        """
+
+        memory = round(psutil.virtual_memory().total / 1024 / 1024 / 1024)
+        values = (
+            platform.system(),
+            platform.machine(),
+            platform.processor(),
+            os.cpu_count(),
+            memory,
+        )
+        return hashlib.sha256(repr(values).encode()).hexdigest()[:16]
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._connection.executescript(SCHEMA)
+
+        return self._connection
+
+    def close(self):
+        """
+        Closes database connection.
+        """
+
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def add_run(self, patch_name: str, samples: List[Sample], duration: float):
+        """
+        Stores stage durations in <samples> of a finished run.
+        """
+
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                cursor = connection.execute(
+                    "INSERT INTO runs (timestamp, machine, patch, files, duration) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (
+                        time.time(),
+                        self.machine,
+                        patch_name,
+                        len({sample[0] for sample in samples}),
+                        duration,
+                    )
+                )
+                connection.executemany(
+                    "INSERT INTO stages (run, machine, file, stage, swf_size, op_count, duration, outlier) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (cursor.lastrowid, self.machine, *sample)
+                        for sample in samples
+                    ]
+                )
+
+                # Remove oldest runs of this machine
+                connection.execute(
+                    "DELETE FROM runs WHERE machine = ? AND id NOT IN "
+                    "(SELECT id FROM runs WHERE machine = ? ORDER BY id DESC LIMIT ?)",
+                    (self.machine, self.machine, self.max_runs)
+                )
+                connection.execute(
+                    "DELETE FROM stages WHERE run NOT IN (SELECT id FROM runs)"
+                )
+
+        self.log.debug(f"Stored {len(samples)} stage duration(s).")
+
+    def get_size(self, file: str) -> Optional[int]:
+        """
+        Returns last known size of SWF <file> or None.
+        """
+
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT swf_size FROM stages WHERE machine = ? AND file = ? "
+                "ORDER BY rowid DESC LIMIT 1",
+                (self.machine, file)
+            ).fetchone()
+
+        return row[0] if row is not None else None
+
+    def predict(self, stage: str, swf_size: int, op_count: int) -> Optional[float]:
+        """
+        Returns predicted duration of <stage> for an SWF file with <swf_size>
+        and <op_count> patch entries or None if there are no samples.
+
+        Uses the median of the most similar samples
+        scaled to the size of the file. Newer samples are preferred,
+        so single outliers do not change the prediction
+        while a lasting change of the durations becomes the new baseline.
+        """
+
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT swf_size, op_count, duration FROM stages "
+                "WHERE machine = ? AND stage = ? "
+                "ORDER BY rowid DESC LIMIT 1000",
+                (self.machine, stage)
+            ).fetchall()
+
+        if not rows:
+            return None
+
+        def distance(row: tuple):
+            return (
+                abs(math.log1p(swf_size) - math.log1p(row[0]))
+                + abs(math.log1p(op_count) - math.log1p(row[1]))
+            )
+
+        # Rows are sorted from newest to oldest and sorting is stable,
+        # so newer samples are preferred at equal distance
+        nearest = sorted(rows, key=distance)[:self.neighbours]
+        return statistics.median(
+            duration * (swf_size + 1) / (size + 1)
+            for size, _, duration in nearest
+        )
+
+    def is_outlier(self, duration: float, predicted: Optional[float]):
+        """
+        Checks if <duration> is much longer than <predicted>.
+        """
+
+        if predicted is None:
+            return False
+
+        return (
+            duration > predicted * self.outlier_factor
+            and duration - predicted > self.outlier_margin
+        )
+
+
+class RunProgress:
+    """
+    Class for the progress of a patch run.
+
+    Receives the start and end of every stage for every file,
+    estimates the remaining time from previous runs and
+    reports stages that take much longer than usual.
+    """
+
+    def __init__(
+        self,
+        app: MainApp,
+        timings: TimingDatabase,
+        patch_data: Dict[str, dict],
+        stages: List[str]
+    ):
+        self.app = app
+        self.timings = timings
+        self.stages = stages
+        self.op_counts = {
+            file: get_op_count(file_data)
+            for file, file_data in patch_data.items()
+        }
+        self.sizes = {file: timings.get_size(file) for file in patch_data}
+
+        self.log = logging.getLogger(self.__repr__())
+        self.log.addHandler(self.app.log_str)
+        self.log.setLevel(self.app.log.level)
+
+        self.predicted: Dict[Tuple[str, str], Optional[float]] = {}
+        self.running: Dict[Tuple[str, str], float] = {}
+        self.finished: Dict[Tuple[str, str], float] = {}
+        self.flagged = set()
+        self.samples: List[Sample] = []
+        self.start_time = time.perf_counter()
+        self._lock = threading.Lock()
+
+        for file in patch_data:
+            self._predict(file)
+
+    def __repr__(self):
+        return "RunProgress"
+
+    def _predict(self, file: str):
+        for stage in self.stages:
+            self.predicted[(file, stage)] = (
+                self.timings.predict(stage, self.sizes[file], self.op_counts[file])
+                if self.sizes[file] is not None else None
+            )
+
+    def set_size(self, file: str, swf_size: int):
+        """
+        Updates predictions of <file> with its actual size.
+        """
+
+        with self._lock:
+            self.sizes[file] = swf_size
+            self._predict(file)
+
+    def start(self, file: str, stage: str):
+        """
+        Marks <stage> of <file> as running.
+        """
+
+        with self._lock:
+            self.running[(file, stage)] = time.perf_counter()
+
+    def finish(self, file: str, stage: str, duration: float, skipped: bool = False):
+        """
+        Marks <stage> of <file> as finished after <duration> seconds.
+        Stages that were <skipped> are not stored as samples.
+        """
+
+        key = (file, stage)
+        with self._lock:
+            self.running.pop(key, None)
+            self.finished[key] = duration
+
+            if skipped:
+                return
+
+            predicted = self.predicted.get(key)
+            outlier = self.timings.is_outlier(duration, predicted)
+            if outlier and key not in self.flagged:
+                self.flagged.add(key)
+                self.log.warning(
+                    f"Stage '{stage}' of '{file}' took {format_duration(duration)} "
+                    f"instead of about {format_duration(predicted)}!"
+                )
+
+            self.samples.append((
+                file,
+                stage,
+                self.sizes[file] or 0,
+                self.op_counts[file],
+                duration,
+                outlier,
+            ))
+
+    def check_running(self):
+        """
+        Reports running stages that take much longer than usual,
+        for eg. because of a regression or a hanging FFDec process.
+        """
+
+        now = time.perf_counter()
+        with self._lock:
+            for key, start in self.running.items():
+                if key in self.flagged:
+                    continue
+
+                if self.timings.is_outlier(now - start, self.predicted.get(key)):
+                    self.flagged.add(key)
+                    file, stage = key
+                    self.log.warning(
+                        f"Stage '{stage}' of '{file}' is running for {format_duration(now - start)} "
+                        f"instead of about {format_duration(self.predicted[key])}!"
+                    )
+
+    def get_remaining(self) -> Optional[float]:
+        """
+        Returns estimated remaining time in seconds
+        or None if there are no samples for a remaining stage.
+        """
+
+        now = time.perf_counter()
+        by_stage: Dict[str, float] = {}
+        by_file: Dict[str, float] = {}
+        with self._lock:
+            for (file, stage), predicted in self.predicted.items():
+                if (file, stage) in self.finished:
+                    continue
+                if predicted is None:
+                    return None
+
+                remaining = predicted
+                if (file, stage) in self.running:
+                    remaining = max(0, predicted - (now - self.running[(file, stage)]))
+
+                by_stage[stage] = by_stage.get(stage, 0) + remaining
+                by_file[file] = by_file.get(file, 0) + remaining
+
+        # Stages run concurrently, so the slowest stage or
+        # the last file limits the remaining time
+        return max([0, *by_stage.values(), *by_file.values()])
+
+    def get_fraction(self):
+        """
+        Returns estimated progress between 0 and 1.
+        """
+
+        remaining = self.get_remaining()
+        if remaining is not None:
+            elapsed = time.perf_counter() - self.start_time
+            return elapsed / (elapsed + remaining) if elapsed + remaining > 0 else 1
+
+        with self._lock:
+            return len(self.finished) / max(1, len(self.predicted))
+
+    def get_stage_progress(self):
+        """
+        Returns number of finished files per stage.
+        """
+
+        total = len(self.op_counts)
+        with self._lock:
+            return {
+                stage: (
+                    len([key for key in self.finished if key[1] == stage]),
+                    total
+                )
+                for stage in self.stages
+            }
@@ -0,0 +1,148 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains MatrixBatch and RectBatch classes for bulk transforms.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+from typing import List, Sequence
+
+import numpy as np
+
+from xml_backend import Element
+
+
+# 1.0 as 16.16 fixed-point value used for scales and skews in SWF matrices
+FIXED_ONE = 65536
+
+
+class MatrixBatch:
+    """
+    Class for transforming many MATRIX elements at once.
+
+    The matrices are read into one array with the columns
+    scaleX, rotateSkew0, rotateSkew1, scaleY, translateX and translateY,
+    transformed with array operations and written back together.
+    """
+
+    def __init__(self, elements: List[Element]):
+        self.elements = elements
+        self.rows = {id(element): c for c, element in enumerate(elements)}
+
+        has_scale = [element.get("hasScale") == "true" for element in elements]
+        has_rotate = [element.get("hasRotate") == "true" for element in elements]
+        values = [
+            [
+                float(element.get("scaleX", FIXED_ONE)) if scale else FIXED_ONE,
+                float(element.get("rotateSkew0", 0)) if rotate else 0,
+                float(element.get("rotateSkew1", 0)) if rotate else 0,
+                float(element.get("scaleY", FIXED_ONE)) if scale else FIXED_ONE,
+                float(element.get("translateX", 0)),
+                float(element.get("translateY", 0)),
+            ]
+            for element, scale, rotate in zip(elements, has_scale, has_rotate)
+        ]
+
+        self.has_scale = np.array(has_scale, dtype=bool)
+        self.has_rotate = np.array(has_rotate, dtype=bool)
+        self.data = np.array(values, dtype=np.float64).reshape(-1, 6)
+        self.data[:, :4] /= FIXED_ONE
+        self.changed = np.zeros(len(elements), dtype=bool)
+
+    def get_rows(self, elements: List[Element]):
+        """
+        Returns unique row indexes of <elements>.
+        """
+
+        return np.unique(
+            np.array([self.rows[id(element)] for element in elements], dtype=np.intp)
+        )
+
+    def transform(
+        self,
+        rows: np.ndarray,
+        scale: Sequence[float] = (1, 1),
+        translate: Sequence[float] = (0, 0),
+        origin: Sequence[float] = (0, 0)
+    ):
+        """
+        Scales matrices in <rows> around <origin> and translates them afterwards.
+        The transform is applied in the coordinate space of the parent.
+        """
+
+        scale_x, scale_y = scale
+        data = self.data
+
+        data[rows, 0] *= scale_x
+        data[rows, 2] *= scale_x
+        data[rows, 1] *= scale_y
+        data[rows, 3] *= scale_y
+        data[rows, 4] = (data[rows, 4] - origin[0]) * scale_x + origin[0] + translate[0]
+        data[rows, 5] = (data[rows, 5] - origin[1]) * scale_y + origin[1] + translate[1]
+
+        self.changed[rows] = True
+
+    def write(self):
+        """
+        Writes changed matrices back to their elements.
+        """
+
+        rows = np.flatnonzero(self.changed)
+        fixed = np.rint(self.data[rows, :4] * FIXED_ONE).astype(np.int64)
+        translate = np.rint(self.data[rows, 4:]).astype(np.int64)
+        has_scale = self.has_scale[rows] | (fixed[:, 0] != FIXED_ONE) | (fixed[:, 3] != FIXED_ONE)
+        has_rotate = self.has_rotate[rows] | (fixed[:, 1] != 0) | (fixed[:, 2] != 0)
+
+        for row, values, (translate_x, translate_y), scale, rotate in zip(
+            rows.tolist(),
+            fixed.tolist(),
+            translate.tolist(),
+            has_scale.tolist(),
+            has_rotate.tolist()
+        ):
+            attrib = self.elements[row].attrib
+            attrib["translateX"] = str(translate_x)
+            attrib["translateY"] = str(translate_y)
+            if scale:
+                attrib["hasScale"] = "true"
+                attrib["scaleX"] = str(values[0])
+                attrib["scaleY"] = str(values[3])
+            if rotate:
+                attrib["hasRotate"] = "true"
+                attrib["rotateSkew0"] = str(values[1])
+                attrib["rotateSkew1"] = str(values[2])
+
+        return len(rows)
+
+
+class RectBatch:
+    """
+    Class for scaling many RECT elements (for eg. shape bounds) at once.
+    """
+
+    KEYS = ("Xmin", "Xmax", "Ymin", "Ymax")
+
+    def __init__(self, elements: List[Element]):
+        self.elements = elements
+        self.data = np.array(
+            [[float(element.get(key, 0)) for key in self.KEYS] for element in elements],
+            dtype=np.float64
+        ).reshape(-1, 4)
+
+    def scale(self, scale: Sequence[float]):
+        """
+        Scales all rects by <scale> relative to the origin.
+        """
+
+        self.data[:, :2] *= scale[0]
+        self.data[:, 2:] *= scale[1]
+
+    def write(self):
+        """
+        Writes rects back to their elements.
+        """
+
+        values = np.rint(self.data).astype(np.int64).tolist()
+        for element, rect in zip(self.elements, values):
+            for key, value in zip(self.KEYS, rect):
+                element.attrib[key] = str(value)
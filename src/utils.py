@@ -73,16 +73,6 @@ class StdoutHandler(qtc.QObject):
             pass
 
 
-def hex_to_rgb(value: str):
-    """
-    Converts hexadecimal color values
-    to a tuple containing the values in rgb.    
-    """
-
-    value = value.lstrip('#')
-    lv = len(value)
-    return tuple(int(value[i:i + lv // 3], 16) for i in range(0, lv, lv // 3))
-
 def lower_dict(nested_dict: dict):
     new_dict = {}
 
@@ -0,0 +1,201 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains PatchWatcher class for patch authors.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict
+
+import jstyleson as json
+
+import output
+from main import MainApp
+from patcher import PatchItem, Patcher
+from workspace import Workspace
+
+
+class PatchWatcher:
+    """
+    Class for watch mode.
+
+    Watches the patch folder and re-applies the patch when patch.json
+    or a shape file changes. Only SWFs whose patch data or shape files
+    changed are re-patched. The shape-replaced SWF and its XML are
+    cached, so that changes that do not affect shapes only cost
+    the XML patch and the conversion back to SWF.
+
+    All entries of a changed SWF are applied again to the cached XML
+    instead of only the changed entries, since changed or removed entries
+    cannot be undone in an already patched XML. Applying the entries
+    is cheap compared to reading and writing the XML and xml2swf.
+    """
+
+    # Seconds between two scans of the patch folder
+    interval: float = 0.5
+
+    def __init__(self, app: MainApp, patcher: Patcher):
+        self.app = app
+        self.patcher = patcher
+
+        self.log = logging.getLogger(self.__repr__())
+        self.log.addHandler(self.app.log_str)
+        self.log.setLevel(self.app.log.level)
+
+        self._stop_event = threading.Event()
+
+        # Hashes of last applied patch data and shapes by SWF
+        self.applied: Dict[str, str] = {}
+        self.shape_keys: Dict[str, str] = {}
+
+    def __repr__(self):
+        return "PatchWatcher"
+
+    def stop(self):
+        """
+        Stops watching after the current step.
+        """
+
+        self._stop_event.set()
+        self.patcher.cancel()
+
+    def _scan(self):
+        # Modification times of all files in patch folder
+        files: Dict[Path, int] = {}
+        for file in self.patcher.patch_path.rglob("*"):
+            if file.is_file() and "compiled" not in file.relative_to(self.patcher.patch_path).parts:
+                files[file] = file.stat().st_mtime_ns
+
+        return files
+
+    def _get_shape_key(self, patch_data: dict):
+        shape_hash = hashlib.sha256()
+
+        for shape_data in patch_data.get("shapes", []):
+            shape_hash.update(
+                json.dumps([shape_data["filePath"], shape_data["index"]]).encode()
+            )
+            shape_path = self.patcher.patch_path / shape_data["filePath"]
+            if shape_path.is_file():
+                shape_hash.update(shape_path.read_bytes())
+
+        return shape_hash.hexdigest()
+
+    def _apply(self, file: str, patch_data: dict):
+        bsa_path = self.patcher.tmpdir / "RaceMenu"
+        source = bsa_path / "interface" / file
+        if not source.is_file():
+            self.patcher._extract_bsa([file])
+
+        cache_path = self.patcher.workspace.get_dir(
+            f"cache/{file}", Workspace.estimate_size(source)
+        )
+        shaped = cache_path / "shaped" / source.name
+        shaped_xml = shaped.with_suffix(".xml")
+
+        # Replace shapes only if shapes changed
+        shape_key = self._get_shape_key(patch_data)
+        if self.shape_keys.get(file) != shape_key:
+            if file in self.shape_keys:
+                self.log.info(f"Shapes of '{file}' changed. Rebuilding cache...")
+            else:
+                self.log.debug(f"Building cache for '{file}'...")
+            shutil.rmtree(cache_path, ignore_errors=True)
+            os.makedirs(shaped.parent)
+            shutil.copyfile(source, shaped)
+
+            item = PatchItem(file, patch_data)
+            item.swf_path = shaped
+            self.patcher._stage_shapes(item)
+            self.shape_keys[file] = shape_key
+
+        item = PatchItem(file, patch_data)
+        if self.patcher._needs_xml(patch_data):
+            # Convert only once per shape change
+            if not shaped_xml.is_file():
+                shaped_item = PatchItem(file, patch_data)
+                shaped_item.swf_path = shaped
+                self.patcher._get_ffdec(shaped_item).swf2xml()
+
+            work_path = cache_path / "work"
+            os.makedirs(work_path, exist_ok=True)
+            item.swf_path = work_path / source.name
+            # XML file is replaced when patched, so cached XML stays untouched
+            item.xml_file = Workspace.link(shaped_xml, work_path / shaped_xml.name)
+
+            self.patcher._stage_patch_xml(item)
+        else:
+            item.swf_path = shaped
+
+        self.patcher._stage_xml2swf(item)
+        self.patcher._write_output(file, item.patched_swf)
+        self.patcher.ffdec_interfaces.clear()
+
+    def _update(self):
+        try:
+            self.patcher.load_patch_data()
+        except Exception as ex:
+            self.log.error(f"Failed to load patch: {ex}")
+            return
+
+        for file, patch_data in self.patcher.patch_data.items():
+            key = hashlib.sha256(
+                json.dumps(patch_data, sort_keys=True).encode()
+                + self._get_shape_key(patch_data).encode()
+            ).hexdigest()
+
+            if self.applied.get(file) == key:
+                continue
+
+            self.log.info(f"Re-applying patch to '{file}'...")
+            start = time.time()
+            try:
+                self._apply(file, patch_data)
+            except Exception as ex:
+                if self._stop_event.is_set():
+                    return
+                self.log.error(f"Failed to patch '{file}': {ex}")
+                continue
+
+            self.applied[file] = key
+            self.log.info(f"Patched '{file}' in {(time.time() - start):.3f} second(s).")
+
+    def watch(self):
+        """
+        Patches RaceMenu and re-applies the patch on every change
+        until stop() is called.
+        """
+
+        self._stop_event.clear()
+        self.patcher.cancelled = False
+        # Output is copied since FFDec overwrites its cached SWFs in place
+        # on the next change which would change hard linked outputs as well
+        self.patcher.writer = output.OutputWriter(self.app, use_hardlinks=False)
+        self.patcher.bsa_writer = None
+
+        with Workspace(self.app) as self.patcher.workspace:
+            self.patcher.tmpdir = self.patcher.workspace.path
+            self.patcher._extract_bsa()
+
+            self.log.info(f"Watching '{self.patcher.patch_path}' for changes...")
+            files = None
+            try:
+                while not self._stop_event.is_set():
+                    current_files = self._scan()
+                    if current_files != files:
+                        files = current_files
+                        self._update()
+                        self.log.info("Waiting for changes...")
+
+                    self._stop_event.wait(self.interval)
+            except KeyboardInterrupt:
+                pass
+
+        self.log.info("Stopped watching.")
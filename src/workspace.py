@@ -0,0 +1,192 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains Workspace class for intermediate files.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict
+
+from main import MainApp
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# ioctl request for cloning a file on Linux (btrfs, XFS)
+FICLONE = 0x40049409
+
+
+class Workspace:
+    """
+    Class for the temporary folder with all intermediate files.
+
+    Uses a memory-backed folder (/dev/shm on Linux or a RAM disk
+    configured with the environment variable DRIP_RAM_PATH) if available.
+    Every SWF file reserves its estimated size (including its XML file)
+    from the RAM budget. SWF files that do not fit are processed
+    in a folder on disk instead.
+    """
+
+    # RAM budget in bytes, can be set with DRIP_RAM_BUDGET (in MB)
+    ram_budget: int = 1024 * 1024 * 1024
+    # Estimated size of FFDec's XML relative to the uncompressed SWF
+    XML_FACTOR: int = 20
+
+    path: Path = None
+    ram_path: Path = None
+    disk_path: Path = None
+
+    def __init__(self, app: MainApp, ram_path: Path = None, ram_budget: int = None):
+        self.app = app
+
+        self.log = logging.getLogger(self.__repr__())
+        self.log.addHandler(self.app.log_str)
+        self.log.setLevel(self.app.log.level)
+
+        if ram_path is None:
+            if os.environ.get("DRIP_RAM_PATH"):
+                ram_path = Path(os.environ["DRIP_RAM_PATH"])
+            elif Path("/dev/shm").is_dir():
+                ram_path = Path("/dev/shm")
+        self.ram_base = ram_path
+
+        if ram_budget is None and os.environ.get("DRIP_RAM_BUDGET"):
+            ram_budget = int(os.environ["DRIP_RAM_BUDGET"]) * 1024 * 1024
+        if ram_budget is not None:
+            self.ram_budget = ram_budget
+
+        self.used = 0
+        self.dirs: Dict[str, Path] = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "Workspace"
+
+    def __enter__(self):
+        self.disk_path = Path(tempfile.mkdtemp(prefix="DRIP_")).resolve()
+
+        if self.ram_base is not None and self.ram_budget > 0:
+            try:
+                self.ram_path = Path(
+                    tempfile.mkdtemp(prefix="DRIP_", dir=self.ram_base)
+                ).resolve()
+                free = shutil.disk_usage(self.ram_path).free
+                self.ram_budget = min(self.ram_budget, int(free * 0.8))
+            except OSError as ex:
+                self.log.debug(f"Failed to use '{self.ram_base}': {ex}")
+                self.ram_path = None
+
+        self.path = self.ram_path or self.disk_path
+        if self.ram_path is not None:
+            self.log.debug(
+                f"Using '{self.ram_path}' with a budget of "
+                f"{self.ram_budget // 1024 // 1024} MB."
+            )
+
+        return self
+
+    def __exit__(self, *args):
+        self.cleanup()
+
+    def cleanup(self):
+        """
+        Deletes all files of workspace.
+        """
+
+        for path in (self.ram_path, self.disk_path):
+            if path is not None and path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+
+    @classmethod
+    def estimate_size(cls, swf_path: Path):
+        """
+        Returns estimated size of all files created for SWF file at <swf_path>.
+        """
+
+        with open(swf_path, "rb") as file:
+            header = file.read(8)
+
+        # Uncompressed size is stored in the SWF header
+        length = struct.unpack_from("<I", header, 4)[0] if len(header) == 8 else 0
+        length = max(length, swf_path.stat().st_size)
+
+        # SWF, XML and temporary XML while it is rewritten
+        return length * (2 * cls.XML_FACTOR + 2)
+
+    def get_dir(self, name: str, size: int):
+        """
+        Returns folder for <name> and reserves <size> bytes in RAM
+        if within budget. Returns the same folder for the same <name>.
+        """
+
+        with self._lock:
+            if name in self.dirs:
+                return self.dirs[name]
+
+            if self.ram_path is not None and self.used + size <= self.ram_budget:
+                self.used += size
+                path = self.ram_path / "work" / name
+            else:
+                if self.ram_path is not None:
+                    self.log.debug(f"'{name}' exceeds RAM budget. Using disk...")
+                path = self.disk_path / "work" / name
+
+            os.makedirs(path, exist_ok=True)
+            self.dirs[name] = path
+            return path
+
+    @staticmethod
+    def move(src: Path, dest: Path):
+        """
+        Moves <src> to <dest> and returns <dest>.
+        """
+
+        os.makedirs(dest.parent, exist_ok=True)
+        shutil.move(src, dest)
+        return dest
+
+    @staticmethod
+    def _reflink(src: Path, dest: Path):
+        if fcntl is None:
+            return False
+
+        try:
+            with open(src, "rb") as src_file, open(dest, "wb") as dest_file:
+                fcntl.ioctl(dest_file.fileno(), FICLONE, src_file.fileno())
+            return True
+        except OSError:
+            if dest.is_file():
+                os.remove(dest)
+            return False
+
+    @classmethod
+    def link(cls, src: Path, dest: Path):
+        """
+        Makes read-only input <src> available at <dest> by cloning or
+        hard-linking it if possible and copying it otherwise.
+        <dest> must only be replaced and never be modified in place.
+        """
+
+        os.makedirs(dest.parent, exist_ok=True)
+        if dest.is_file():
+            os.remove(dest)
+
+        if cls._reflink(src, dest):
+            return dest
+
+        try:
+            os.link(src, dest)
+        except OSError:
+            shutil.copyfile(src, dest)
+
+        return dest
@@ -0,0 +1,249 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains XML backends for patching FFDec's XML files.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+import io
+import os
+import re
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+
+# Element of the used backend
+Element = Any
+
+
+# Placeholder for the tags of shards while the rest of a document is written
+SHARD_MARKER = "DRIP-SHARD-MARKER"
+
+# XPath queries used by the patcher, variables are marked with "$"
+QUERIES: Dict[str, str] = {
+    "sprites": "./item[@type='DefineSpriteTag'][@spriteId]",
+    "shape_bounds": "./shapeBounds",
+    "texts": "./item[@type='DefineEditTextTag'][@characterID]",
+    "text_color": "./textColor[@type='RGBA']",
+    "sub_tags": "./subTags/item[@characterId][@depth]",
+    "sub_tags_by_char": "./subTags/item[@characterId=$char_id][@depth]",
+    "sub_tags_by_depth": "./subTags/item[@characterId][@depth=$depth]",
+    "sub_tags_by_char_depth": "./subTags/item[@characterId=$char_id][@depth=$depth]",
+    "matrix": "./matrix",
+    "color_transform": "./colorTransform",
+}
+
+
+class XMLBackend:
+    """
+    Base class for XML backends.
+    """
+
+    name: str = None
+
+    def __repr__(self):
+        return f"XMLBackend({self.name})"
+
+    def parse(self, xml_file: Path):
+        """
+        Parses <xml_file> and returns its document.
+        """
+
+        raise NotImplementedError
+
+    def get_root(self, document) -> Element:
+        """
+        Returns root element of <document>.
+        """
+
+        return document.getroot()
+
+    def findall(self, element: Element, query: str, **variables) -> List[Element]:
+        """
+        Returns all elements matching <query> with <variables>.
+        """
+
+        raise NotImplementedError
+
+    def find(self, element: Element, query: str, **variables) -> Element:
+        """
+        Returns first element matching <query> with <variables> or None.
+        """
+
+        elements = self.findall(element, query, **variables)
+        return elements[0] if elements else None
+
+    def get_index(self, element: Element, attribute: str) -> Dict[str, List[Element]]:
+        """
+        Returns child elements of <element> by their value of <attribute>
+        in document order. This replaces one search through all children
+        per looked up value by a single pass.
+        """
+
+        index: Dict[str, List[Element]] = {}
+        for child in element:
+            value = child.get(attribute)
+            if value is not None:
+                index.setdefault(value, []).append(child)
+
+        return index
+
+    def create_element(self, tag: str, attrib: Dict[str, str]) -> Element:
+        """
+        Creates new element.
+        """
+
+        raise NotImplementedError
+
+    def to_bytes(self, element: Element) -> bytes:
+        """
+        Serializes <element> including its tail
+        like it is serialized as part of a document.
+        """
+
+        raise NotImplementedError
+
+    def from_bytes(self, data: bytes) -> Element:
+        """
+        Parses element from serialized <data>.
+        """
+
+        raise NotImplementedError
+
+    def _write(self, document, file: BinaryIO):
+        raise NotImplementedError
+
+    def write(self, document, xml_file: Path):
+        """
+        Writes <document> to <xml_file>.
+        The file is replaced instead of overwritten,
+        so that other links to the file keep their content.
+        """
+
+        tmp_file = xml_file.with_name(f".{xml_file.name}.tmp")
+        with open(tmp_file, "wb") as file:
+            self._write(document, file)
+        os.replace(tmp_file, xml_file)
+
+    def write_shards(self, document, element: Element, shards: List[bytes], xml_file: Path):
+        """
+        Writes <document> to <xml_file> with the children of <element>
+        replaced by the serialized children in <shards>.
+        """
+
+        children = list(element)
+        text = element.text
+        del element[:]
+        element.text = (text or "") + SHARD_MARKER
+
+        buffer = io.BytesIO()
+        try:
+            self._write(document, buffer)
+        finally:
+            element.text = text
+            element.extend(children)
+        prefix, suffix = buffer.getvalue().split(SHARD_MARKER.encode(), 1)
+
+        tmp_file = xml_file.with_name(f".{xml_file.name}.tmp")
+        with open(tmp_file, "wb") as file:
+            file.write(prefix)
+            for shard in shards:
+                file.write(shard)
+            file.write(suffix)
+        os.replace(tmp_file, xml_file)
+
+
+class ElementTreeBackend(XMLBackend):
+    """
+    XML backend using Python's ElementTree.
+    """
+
+    name = "ElementTree"
+
+    def __init__(self):
+        # ElementTree only supports literal values in predicates
+        self.queries = {
+            name: re.sub(r"\$(\w+)", r"'{\1}'", query)
+            for name, query in QUERIES.items()
+        }
+
+    def parse(self, xml_file: Path):
+        return ET.parse(str(xml_file))
+
+    def findall(self, element: Element, query: str, **variables):
+        return element.findall(self.queries[query].format(**variables))
+
+    def create_element(self, tag: str, attrib: Dict[str, str]):
+        return ET.Element(tag, attrib)
+
+    def to_bytes(self, element: Element):
+        return ET.tostring(element, encoding="utf-8")
+
+    def from_bytes(self, data: bytes):
+        return ET.fromstring(data)
+
+    def _write(self, document: ET.ElementTree, file: BinaryIO):
+        document.write(file, encoding="utf8")
+
+
+class LxmlBackend(XMLBackend):
+    """
+    XML backend using lxml with precompiled XPath queries.
+    Supports very large documents.
+    """
+
+    name = "lxml"
+
+    def __init__(self):
+        self.parser = etree.XMLParser(huge_tree=True)
+        self.queries = {
+            name: etree.XPath(query)
+            for name, query in QUERIES.items()
+        }
+
+    def parse(self, xml_file: Path):
+        return etree.parse(str(xml_file), self.parser)
+
+    def findall(self, element: Element, query: str, **variables):
+        return self.queries[query](
+            element,
+            **{name: str(value) for name, value in variables.items()}
+        )
+
+    def create_element(self, tag: str, attrib: Dict[str, str]):
+        return etree.Element(tag, attrib)
+
+    def to_bytes(self, element: Element):
+        return etree.tostring(element, encoding="utf8", xml_declaration=False)
+
+    def from_bytes(self, data: bytes):
+        return etree.fromstring(data, self.parser)
+
+    def _write(self, document, file: BinaryIO):
+        document.write(file, encoding="utf8", xml_declaration=True)
+
+
+def get_backend(name: str = None) -> XMLBackend:
+    """
+    Returns XML backend with <name> or lxml if it is installed.
+    """
+
+    if name is None:
+        name = LxmlBackend.name if etree is not None else ElementTreeBackend.name
+
+    match name:
+        case LxmlBackend.name:
+            if etree is None:
+                raise ImportError("lxml is not installed!")
+            return LxmlBackend()
+
+        case ElementTreeBackend.name:
+            return ElementTreeBackend()
+
+    raise ValueError(f"Unknown XML backend: {name!r}")
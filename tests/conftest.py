@@ -0,0 +1,147 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains shared fixtures for the tests.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+import logging
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import operations
+from main import HeadlessApp
+from stats import PatchStats
+from xml_backend import get_backend
+
+
+# Small XML file in the format written by FFDec's swf2xml
+SAMPLE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<swf type="SWF" version="10">
+<displayRect type="RECT" Xmax="25600" Xmin="0" Ymax="14400" Ymin="0"/>
+<tags>
+<item type="DefineShape2Tag" shapeId="5"><shapeBounds type="RECT" Xmax="25600" Xmin="0" Ymax="14400" Ymin="0"/></item>
+<item type="DefineShape2Tag" shapeId="6"><shapeBounds type="RECT" Xmax="200" Xmin="0" Ymax="100" Ymin="0"/></item>
+<item type="DefineEditTextTag" characterID="1" fontId="2" useOutlines="false" initialText="&lt;p&gt;&lt;font color=&quot;#ffffff&quot;&gt;Name&lt;/font&gt;&lt;/p&gt;"><textColor type="RGBA" red="255" green="255" blue="255" alpha="255"/></item>
+<item type="DefineEditTextTag" characterID="2" fontId="2" useOutlines="false" initialText="Level"><textColor type="RGBA" red="0" green="0" blue="0" alpha="255"/></item>
+<item type="DefineEditTextTag" characterID="3" fontId="4" useOutlines="true" initialText="Race"><textColor type="RGBA" red="0" green="0" blue="0" alpha="255"/></item>
+<item type="DefineSpriteTag" spriteId="1"><subTags>
+<item type="PlaceObject2Tag" characterId="20" depth="1"><matrix type="MATRIX" hasScale="false" hasRotate="false" scaleX="0" scaleY="0" rotateSkew0="0" rotateSkew1="0" translateX="100" translateY="200"/></item>
+<item type="PlaceObject2Tag" characterId="21" depth="2"><matrix type="MATRIX" hasScale="true" hasRotate="false" scaleX="65536" scaleY="32768" rotateSkew0="0" rotateSkew1="0" translateX="-50" translateY="20"/></item>
+<item type="PlaceObject2Tag" characterId="22" depth="3" placeFlagHasColorTransform="true"><matrix type="MATRIX" hasScale="false" hasRotate="false" scaleX="0" scaleY="0" rotateSkew0="0" rotateSkew1="0" translateX="0" translateY="0"/><colorTransform type="CXFORMWITHALPHA" alphaAddTerm="0" alphaMultTerm="128" blueAddTerm="0" blueMultTerm="0" greenAddTerm="0" greenMultTerm="0" hasAddTerms="false" hasMultTerms="true" nbits="10" redAddTerm="0" redMultTerm="0"/></item>
+</subTags></item>
+<item type="DefineSpriteTag" spriteId="2"><subTags>
+<item type="PlaceObject2Tag" characterId="20" depth="1"><matrix type="MATRIX" hasScale="false" hasRotate="false" scaleX="0" scaleY="0" rotateSkew0="0" rotateSkew1="0" translateX="1" translateY="2"/></item>
+<item type="PlaceObject2Tag" characterId="21" depth="2"><matrix type="MATRIX" hasScale="false" hasRotate="false" scaleX="0" scaleY="0" rotateSkew0="0" rotateSkew1="0" translateX="3" translateY="4"/></item>
+</subTags></item>
+<item type="ShowFrameTag"/>
+</tags>
+</swf>
+"""
+
+
+@pytest.fixture(scope="session")
+def app():
+    return HeadlessApp.instance() or HeadlessApp()
+
+
+@pytest.fixture
+def log():
+    return logging.getLogger("Test")
+
+
+@pytest.fixture
+def sample_xml(tmp_path: Path):
+    """
+    Returns path to a new copy of the sample XML file.
+    """
+
+    xml_file = tmp_path / "sample.xml"
+    xml_file.write_text(SAMPLE_XML, encoding="utf8")
+    return xml_file
+
+
+@pytest.fixture
+def patch_sample(tmp_path: Path, log: logging.Logger):
+    """
+    Returns function that applies patch data to the tags
+    of a new copy of the sample XML file and returns the written file.
+    """
+
+    def patch(patch_data: dict, backend: str = None):
+        xml_file = tmp_path / "patched.xml"
+        xml_file.write_text(SAMPLE_XML, encoding="utf8")
+
+        xml = get_backend(backend)
+        document = xml.parse(xml_file)
+        xml_root = xml.get_root(document)
+
+        operations.patch_tags(
+            xml, xml_root[1], patch_data, dict(xml_root[0].attrib), PatchStats("sample"), log
+        )
+
+        xml.write(document, xml_file)
+        return xml_file.read_bytes()
+
+    return patch
+
+
+def _random_patch(rnd: random.Random):
+    def choice(*values):
+        return rnd.choice(values)
+
+    def group(keys, values):
+        return {
+            key: rnd.choice(values)
+            for key in rnd.sample(keys, rnd.randint(0, len(keys)))
+        }
+
+    sprites = []
+    for _ in range(rnd.randint(1, 6)):
+        sprite = {
+            "SpriteID": choice("1", "2", "*"),
+            "CharacterID": choice(["20"], ["21"], ["22"], ["*"], ["20", "21"]),
+            "Depth": choice(["1"], ["2"], ["*"], ["1", "2"]),
+        }
+        if matrix := group(["translateX", "translateY", "scaleX", "hasScale"], ["0", "1", "2"]):
+            sprite["MATRIX"] = matrix
+        if rnd.random() < 0.3:
+            sprite["colorTransform"] = group(["redMultTerm", "hasMultTerms"], ["0", "1"])
+        sprites.append(sprite)
+
+    texts = []
+    for _ in range(rnd.randint(0, 4)):
+        text = {"index": choice([1], [2], ["*"], [1, 2], ["3"])}
+        for attribute, values in (
+            ("font", ("5", "6")),
+            ("useOutlines", ("true", "false")),
+            ("color", ("11223344", "aabbccdd")),
+        ):
+            if rnd.random() < 0.5:
+                text[attribute] = rnd.choice(values)
+        texts.append(text)
+
+    shapes = [
+        {"index": choice([5], [6], [5, 6]), "shapeBounds": {"Xmax": choice("0", "1")}}
+        for _ in range(rnd.randint(0, 2))
+    ]
+
+    return {"sprites": sprites, "text": texts, "shapes": shapes}
+
+
+@pytest.fixture
+def random_patch():
+    """
+    Returns function that creates random patch data
+    for the sample XML file from a seed.
+    """
+
+    def create(seed: int):
+        return _random_patch(random.Random(seed))
+
+    return create
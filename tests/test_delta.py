@@ -0,0 +1,129 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains tests for SWFDelta and precompiled patches.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+import hashlib
+import json
+import struct
+import zlib
+from pathlib import Path
+
+import pytest
+
+import bsa
+import errors
+from delta import SWFDelta
+from patcher import Patcher
+from swf import SWFFile
+
+PATCH_DATA = {"racesex_menu.swf": {"text": [{"index": [1], "font": "5"}]}}
+
+
+def tag(code: int, data: bytes):
+    if len(data) < 0x3F:
+        return struct.pack("<H", code << 6 | len(data)) + data
+    return struct.pack("<HI", code << 6 | 0x3F, len(data)) + data
+
+
+def make_swf(tags: list):
+    """
+    Returns compressed SWF file with <tags> and an empty stage.
+    """
+
+    rect = bytes([0x78, 0, 5, 0x5F, 0, 0, 0x0F, 0xA0, 0])
+    body = rect + struct.pack("<HH", 24 << 8, 1) + b"".join(tags) + tag(0, b"")
+    return SWFFile.compress(b"CWS", 10, body)
+
+
+@pytest.fixture
+def patcher(app, tmp_path: Path):
+    """
+    Returns Patcher for a patch with a compiled delta
+    and the RaceMenu source it was compiled for.
+    """
+
+    source_data = make_swf([tag(2, bytes(size)) for size in (10, 100, 1000)])
+    target = SWFFile.from_bytes(make_swf([tag(2, bytes(10)), tag(2, b"patched" * 20)]))
+
+    racemenu_path = tmp_path / "RaceMenu"
+    racemenu_path.mkdir()
+    source_file = tmp_path / "racesex_menu.swf"
+    source_file.write_bytes(source_data)
+    writer = bsa.BSAWriter(app)
+    writer.add_file("interface/racesex_menu.swf", source_file)
+    writer.write(racemenu_path / "RaceMenu.bsa")
+
+    patch_path = tmp_path / "Patch"
+    (patch_path / "compiled").mkdir(parents=True)
+    (patch_path / "patch.json").write_text(json.dumps(PATCH_DATA), encoding="utf8")
+
+    patcher = Patcher(app, patch_path, racemenu_path, patch_data=PATCH_DATA)
+    delta = SWFDelta.create(
+        source_data, target, patcher._get_patch_hash(PATCH_DATA["racesex_menu.swf"])
+    )
+    source_hash = hashlib.sha256(source_data).hexdigest()
+    delta.dump(patch_path / "compiled" / SWFDelta.get_file_name("racesex_menu.swf", source_hash))
+
+    return patcher
+
+
+def get_delta_file(patcher: Patcher):
+    return next((patcher.patch_path / "compiled").glob("*.delta"))
+
+
+def get_source_file(patcher: Patcher):
+    return patcher.racemenu_path.parent / "racesex_menu.swf"
+
+
+def test_compiled_patch_is_applied(patcher):
+    assert patcher.is_precompiled()
+
+    patched_swf = patcher._apply_compiled(
+        get_source_file(patcher), PATCH_DATA["racesex_menu.swf"]
+    )
+    assert patched_swf is not None
+    assert b"patched" in SWFFile.from_bytes(patched_swf.read_bytes()).get_body()
+
+
+@pytest.mark.parametrize(
+    "damage",
+    [
+        lambda data: data[:len(SWFDelta.MAGIC)],
+        lambda data: data[:len(SWFDelta.MAGIC) + 3],
+        lambda data: data[:len(data) // 2],
+        lambda data: data[:12] + bytes(8) + data[20:],
+        lambda data: data[:-1] + bytes([data[-1] ^ 0xFF]),
+    ],
+)
+def test_damaged_delta_falls_back(patcher, damage):
+    delta_file = get_delta_file(patcher)
+    delta_file.write_bytes(damage(delta_file.read_bytes()))
+
+    with pytest.raises(errors.InvalidPatchError):
+        SWFDelta.load(delta_file)
+
+    assert not patcher.is_precompiled()
+    assert patcher._apply_compiled(
+        get_source_file(patcher), PATCH_DATA["racesex_menu.swf"]
+    ) is None
+
+
+@pytest.mark.parametrize("info", [b"{not json", b'{"source": "0"}', b"[]"])
+def test_invalid_info_falls_back(patcher, info):
+    # Intact container with a broken info block
+    payload = struct.pack("<I", len(info)) + info
+    delta_file = get_delta_file(patcher)
+    delta_file.write_bytes(
+        SWFDelta.MAGIC
+        + bytes([SWFDelta.FORMAT_VERSION])
+        + struct.pack("<I", zlib.crc32(payload))
+        + zlib.compress(payload)
+    )
+
+    with pytest.raises(errors.InvalidPatchError):
+        SWFDelta.load(delta_file)
+
+    assert not patcher.is_precompiled()
@@ -0,0 +1,141 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains tests for patching shards of the tags in worker processes.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from pathlib import Path
+
+import pytest
+
+import operations
+from stats import PatchStats
+from xml_backend import etree, get_backend
+
+BACKENDS = [
+    "ElementTree",
+    pytest.param("lxml", marks=pytest.mark.skipif(etree is None, reason="lxml is not installed")),
+]
+
+
+def patch_sharded(
+    xml_file: Path,
+    output_file: Path,
+    patch_data: dict,
+    backend: str,
+    count: int,
+    executor: ProcessPoolExecutor = None
+):
+    """
+    Applies <patch_data> to <count> shards of the tags in <xml_file>
+    like Patcher._patch_shards and writes the result to <output_file>.
+    """
+
+    xml = get_backend(backend)
+    document = xml.parse(xml_file)
+    xml_root = xml.get_root(document)
+    original_rect = dict(xml_root[0].attrib)
+
+    shards = operations.split_shards(xml, xml_root[1], count)
+    assert len(shards) == count
+
+    args = (repeat(backend), shards, repeat(patch_data), repeat(original_rect))
+    if executor is not None:
+        results = list(executor.map(operations.patch_shard, *args))
+    else:
+        results = list(map(operations.patch_shard, *args))
+
+    stats = PatchStats("sharded")
+    stats.merge([entries for _, entries, _ in results])
+
+    xml.write_shards(document, xml_root[1], [patched for patched, _, _ in results], output_file)
+    return output_file.read_bytes(), stats
+
+
+def get_counts(stats: PatchStats):
+    return [
+        (entry.name, entry.matched, entry.written, entry.created)
+        for entry in stats.entries
+    ]
+
+
+def test_import_without_qt():
+    # Worker processes only import operations and its dependencies
+    src_path = Path(operations.__file__).parent
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, operations; "
+            "print(sorted({m.split('.')[0] for m in sys.modules} & {'qtpy', 'PySide6', 'main', 'utils'}))",
+        ],
+        cwd=src_path,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    assert result.stdout.strip() == "[]"
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("count", [1, 2, 3, 5])
+def test_unpatched_shards(sample_xml, tmp_path, patch_sample, backend, count):
+    sharded, _ = patch_sharded(sample_xml, tmp_path / "sharded.xml", {}, backend, count)
+
+    assert sharded == patch_sample({}, backend)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_transforms_in_shards(sample_xml, tmp_path, patch_sample, backend):
+    # Transforms as returned by resolve_transforms()
+    patch_data = {
+        "sprites": [
+            {"SpriteID": "*", "CharacterID": ["21"], "Depth": ["*"], "colorTransform": {"redMultTerm": "7"}},
+        ],
+        "transforms": [
+            {"SpriteID": "1", "scale": [2, 0.5], "translate": [10.0, -5.0], "origin": [100, 100]},
+            {"CharacterID": "20", "translate": [3.0, 3.0]},
+        ],
+    }
+
+    sharded, _ = patch_sharded(sample_xml, tmp_path / "sharded.xml", patch_data, backend, 3)
+
+    assert sharded == patch_sample(patch_data, backend)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("seed", range(50))
+def test_random_patches(sample_xml, tmp_path, patch_sample, random_patch, log, backend, seed):
+    patch_data = random_patch(seed)
+
+    sharded, sharded_stats = patch_sharded(
+        sample_xml, tmp_path / "sharded.xml", patch_data, backend, 1 + seed % 4
+    )
+
+    xml = get_backend(backend)
+    document = xml.parse(sample_xml)
+    xml_root = xml.get_root(document)
+    stats = PatchStats("sample")
+    operations.patch_tags(xml, xml_root[1], patch_data, dict(xml_root[0].attrib), stats, log)
+
+    assert sharded == patch_sample(patch_data, backend)
+    assert get_counts(sharded_stats) == get_counts(stats)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_worker_processes(sample_xml, tmp_path, patch_sample, random_patch, backend):
+    with ProcessPoolExecutor(2) as executor:
+        for seed in range(5):
+            patch_data = random_patch(seed)
+
+            sharded, _ = patch_sharded(
+                sample_xml, tmp_path / "sharded.xml", patch_data, backend, 2, executor
+            )
+
+            assert sharded == patch_sample(patch_data, backend)
@@ -0,0 +1,167 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains tests for PatchOptimizer.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+import pytest
+
+from optimizer import PatchOptimizer
+from stats import PatchStats
+
+
+@pytest.fixture
+def optimizer(app):
+    return PatchOptimizer(app)
+
+
+def test_overwritten_keys_are_dropped(optimizer, patch_sample):
+    patch_data = {
+        "sprites": [
+            {"SpriteID": "1", "CharacterID": ["20"], "Depth": ["1"], "MATRIX": {"translateX": "5", "translateY": "6"}},
+            {"SpriteID": "*", "CharacterID": ["*"], "Depth": ["*"], "MATRIX": {"translateX": "7"}},
+        ]
+    }
+
+    optimized = optimizer.optimize("sample.swf", patch_data)
+
+    assert optimized["sprites"][0]["MATRIX"] == {"translateY": "6"}
+    assert optimizer.conflicts["sample.swf"]
+    assert patch_sample(optimized) == patch_sample(patch_data)
+
+
+def test_overlapping_keys_are_kept(optimizer, patch_sample):
+    patch_data = {
+        "sprites": [
+            {"SpriteID": "1", "CharacterID": ["20", "21"], "Depth": ["*"], "MATRIX": {"translateX": "5"}},
+            {"SpriteID": "1", "CharacterID": ["21"], "Depth": ["*"], "MATRIX": {"translateX": "7"}},
+        ]
+    }
+
+    optimized = optimizer.optimize("sample.swf", patch_data)
+
+    assert [sprite["MATRIX"] for sprite in optimized["sprites"]] == [
+        {"translateX": "5"}, {"translateX": "7"}
+    ]
+    assert patch_sample(optimized) == patch_sample(patch_data)
+
+
+def test_equal_selectors_are_merged(optimizer, patch_sample):
+    patch_data = {
+        "sprites": [
+            {"SpriteID": "1", "CharacterID": ["20"], "Depth": ["1"], "MATRIX": {"translateX": "5"}},
+            {"SpriteID": "2", "CharacterID": ["21"], "Depth": ["2"], "MATRIX": {"translateY": "1"}},
+            {"SpriteID": "1", "CharacterID": ["20"], "Depth": ["1"], "colorTransform": {"redMultTerm": "3"}},
+        ]
+    }
+
+    optimized = optimizer.optimize("sample.swf", patch_data)
+
+    assert len(optimized["sprites"]) == 2
+    assert optimized["sprites"][0]["_sources"] == [0, 2]
+    assert patch_sample(optimized) == patch_sample(patch_data)
+
+
+def test_merge_stops_at_overlapping_entry(optimizer, patch_sample):
+    patch_data = {
+        "sprites": [
+            {"SpriteID": "1", "CharacterID": ["20"], "Depth": ["1"], "MATRIX": {"translateX": "5"}},
+            {"SpriteID": "*", "CharacterID": ["20"], "Depth": ["*"], "MATRIX": {"translateY": "1"}},
+            {"SpriteID": "1", "CharacterID": ["20"], "Depth": ["1"], "MATRIX": {"translateY": "2"}},
+        ]
+    }
+
+    optimized = optimizer.optimize("sample.swf", patch_data)
+
+    assert len(optimized["sprites"]) == 3
+    assert patch_sample(optimized) == patch_sample(patch_data)
+
+
+def test_texts_are_regrouped_around_wildcard(optimizer, patch_sample):
+    patch_data = {
+        "text": [
+            {"index": [1], "font": "5", "color": "11223344"},
+            {"index": ["*"], "font": "6"},
+            {"index": [2, 3], "font": "7"},
+            {"index": ["3"], "useOutlines": "false", "color": "aabbccdd"},
+        ]
+    }
+
+    optimized = optimizer.optimize("sample.swf", patch_data)
+
+    assert optimized["text"][0]["index"] == ["*"]
+    assert len(optimized["text"]) == 4
+    assert patch_sample(optimized) == patch_sample(patch_data)
+
+
+def test_shape_bounds_are_grouped(optimizer, patch_sample):
+    patch_data = {
+        "shapes": [
+            {"index": [5], "shapeBounds": {"Xmax": "100"}},
+            {"index": [6], "shapeBounds": {"Xmax": "100"}},
+            {"index": [5], "shapeBounds": {"Ymax": "50"}},
+        ]
+    }
+
+    optimized = optimizer.optimize("sample.swf", patch_data)
+
+    assert patch_sample(optimized) == patch_sample(patch_data)
+
+
+def test_removed_entries_are_overwritten(optimizer):
+    patch_data = {
+        "sprites": [
+            {"SpriteID": "1", "CharacterID": ["20"], "Depth": ["1"], "MATRIX": {"translateX": "5"}},
+            {"SpriteID": "*", "CharacterID": ["*"], "Depth": ["*"], "MATRIX": {"translateX": "7"}},
+        ],
+        "text": [
+            {"index": [1], "font": "5"},
+            {"index": ["*"], "font": "6"},
+            {"index": [2], "font": "6"},
+        ],
+        "shapes": [
+            {"index": [5], "filePath": "shapes/5.svg"},
+            {"index": [6], "shapeBounds": {"Xmax": "100"}},
+            {"index": [6], "shapeBounds": {"Xmax": "200"}},
+        ],
+    }
+
+    optimized = optimizer.optimize("sample.swf", patch_data)
+
+    assert optimizer.overwritten["sample.swf"] == {
+        "sprites": {0: 1},
+        "text": {0: 1},
+        "shapes": {1: 2},
+    }
+
+    # Explicit text entry with the wildcard value is applied by the wildcard entry
+    assert optimized["text"] == [{"index": ["*"], "font": "6", "_sources": [1, 2]}]
+
+    stats = PatchStats("sample.swf")
+    for section in ("sprites", "text", "shapes"):
+        for entry in optimized[section]:
+            stats.add(section, entry["_sources"])
+    stats.add_unused(patch_data, optimizer.overwritten["sample.swf"])
+
+    # Shapes without shape bounds are only replaced by FFDec and not listed
+    assert {
+        entry["entry"]: entry["overwritten_by"]
+        for entry in stats.to_dict()
+    } == {
+        "sprites[2]": None,
+        "sprites[1]": 2,
+        "text[2+3]": None,
+        "text[1]": 2,
+        "shapes[3]": None,
+        "shapes[2]": 3,
+    }
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_random_patches(optimizer, patch_sample, random_patch, seed):
+    patch_data = random_patch(seed)
+
+    optimized = optimizer.optimize("sample.swf", patch_data)
+
+    assert patch_sample(optimized) == patch_sample(patch_data)
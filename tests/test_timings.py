@@ -0,0 +1,80 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains tests for TimingDatabase and RunProgress.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+import pytest
+
+from timings import RunProgress, TimingDatabase
+
+PATCH_DATA = {"racesex_menu.swf": {"sprites": [{}, {}], "text": [{}]}}
+STAGES = ["extract", "swf2xml"]
+SWF_SIZE = 1_000_000
+
+
+@pytest.fixture
+def timings(app, tmp_path):
+    timings = TimingDatabase(app, tmp_path / "timings.db")
+    yield timings
+    timings.close()
+
+
+def run(app, timings: TimingDatabase, durations: dict, skipped: set = frozenset()):
+    """
+    Simulates a run with <durations> by stage and returns its progress.
+    """
+
+    progress = RunProgress(app, timings, PATCH_DATA, STAGES)
+    progress.set_size("racesex_menu.swf", SWF_SIZE)
+    for stage, duration in durations.items():
+        progress.start("racesex_menu.swf", stage)
+        progress.finish("racesex_menu.swf", stage, duration, skipped=stage in skipped)
+    timings.add_run("Patch", progress.samples, sum(durations.values()))
+
+    return progress
+
+
+def predict(timings: TimingDatabase):
+    return timings.predict("swf2xml", SWF_SIZE, 3)
+
+
+def test_no_samples(timings):
+    assert predict(timings) is None
+
+
+def test_skipped_stages_are_not_stored(app, timings):
+    run(app, timings, {"extract": 1.0, "swf2xml": 30.0})
+    progress = run(app, timings, {"extract": 1.0, "swf2xml": 0.001}, {"swf2xml"})
+
+    assert [sample[1] for sample in progress.samples] == ["extract"]
+    assert predict(timings) == pytest.approx(30.0)
+
+
+def test_lasting_change_becomes_baseline(app, timings):
+    # Durations of stages without work stored by older versions
+    for _ in range(3):
+        run(app, timings, {"extract": 1.0, "swf2xml": 0.001})
+    assert predict(timings) == pytest.approx(0.001)
+
+    outliers = []
+    for _ in range(10):
+        progress = run(app, timings, {"extract": 1.0, "swf2xml": 30.0})
+        outliers.append(progress.samples[1][5])
+
+    assert outliers[:3] == [True, True, True]
+    assert not any(outliers[3:])
+    assert predict(timings) == pytest.approx(30.0)
+
+
+def test_single_outlier_is_ignored(app, timings):
+    for _ in range(5):
+        run(app, timings, {"extract": 1.0, "swf2xml": 10.0})
+
+    progress = run(app, timings, {"extract": 1.0, "swf2xml": 100.0})
+    assert progress.samples[1][5]
+    assert predict(timings) == pytest.approx(10.0)
+
+    run(app, timings, {"extract": 1.0, "swf2xml": 11.0})
+    assert predict(timings) == pytest.approx(10.0)
@@ -0,0 +1,77 @@
+"""
+Part of Dynamic RaceMenu Interface Patcher (DRIP).
+Contains tests for the XML backends.
+
+Licensed under Attribution-NonCommercial-NoDerivatives 4.0 International
+"""
+
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from xml_backend import ElementTreeBackend, get_backend
+
+pytest.importorskip("lxml")
+
+
+def normalize(data: bytes):
+    """
+    Returns canonical form of XML <data> without differences
+    in the XML declaration, quoting and escaping of both backends.
+    """
+
+    return ET.canonicalize(data.decode("utf8"))
+
+
+def test_default_backend_is_lxml():
+    assert get_backend().name == "lxml"
+    assert isinstance(get_backend("ElementTree"), ElementTreeBackend)
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        get_backend("minidom")
+
+
+def test_unpatched_output_is_equal(patch_sample):
+    assert normalize(patch_sample({}, "ElementTree")) == normalize(patch_sample({}, "lxml"))
+
+
+def test_color_transforms_are_created_per_sub_tag(patch_sample):
+    patch_data = {
+        "sprites": [
+            {"SpriteID": "1", "CharacterID": ["20", "21"], "Depth": ["*"], "colorTransform": {"redMultTerm": "128", "hasMultTerms": "true"}},
+            {"SpriteID": "1", "CharacterID": ["20"], "Depth": ["1"], "colorTransform": {"redMultTerm": "64"}},
+        ]
+    }
+
+    outputs = [
+        patch_sample(patch_data, backend)
+        for backend in ("ElementTree", "lxml")
+    ]
+    assert normalize(outputs[0]) == normalize(outputs[1])
+
+    sprite = ET.fromstring(outputs[0]).find("./tags/item[@spriteId='1']")
+    sub_tags = sprite.findall("./subTags/item")
+    transforms = [sub_tag.findall("./colorTransform") for sub_tag in sub_tags]
+
+    # Every sub tag gets its own color transform and only one
+    assert [len(items) for items in transforms] == [1, 1, 1]
+    assert transforms[0][0].get("redMultTerm") == "64"
+    assert transforms[1][0].get("redMultTerm") == "128"
+    assert transforms[1][0].get("hasMultTerms") == "true"
+    # Existing color transform is not touched
+    assert transforms[2][0].get("alphaMultTerm") == "128"
+    assert sub_tags[0].get("placeFlagHasColorTransform") == "true"
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_random_patches(patch_sample, random_patch, seed):
+    patch_data = random_patch(seed)
+
+    outputs = [
+        patch_sample(patch_data, backend)
+        for backend in ("ElementTree", "lxml")
+    ]
+
+    assert normalize(outputs[0]) == normalize(outputs[1])